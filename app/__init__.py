@@ -3,14 +3,22 @@ import json
 import os
 from app.config import Config, DevelopmentConfig, ProductionConfig
 from app.repositories.pg_repo import PostgresRepository
+from app.repositories.pg_pool import pool_stats
 from .mongo import mongo, init_mongo
 from .mongo_setup import MongoSetup
 from app.auth import auth_bp
 from app.api.materials import materials_bp
 from app.api.tests import tests_bp
+from app.api.jobs import jobs_bp
+from app.llm.model_registry import model_registry
+from app.llm.backends import inference_backend_options
+from app.services.fact_cache_service import FactCacheService
+from app.services.generation_cache_service import GenerationCacheService
+from app.services.question_bank_service import QuestionBankService
+from app.services.job_worker import start_job_workers
 from flask.json.provider import DefaultJSONProvider
 
-def create_app():
+def create_app(start_workers: bool = True):
     app = Flask(__name__)
 
     env = os.getenv('FLASK_ENV', 'development')
@@ -32,6 +40,7 @@ def create_app():
     app.register_blueprint(auth_bp)
     app.register_blueprint(materials_bp)
     app.register_blueprint(tests_bp)
+    app.register_blueprint(jobs_bp)
 
     # Инициализация репозитория
     pg_repo = PostgresRepository()
@@ -45,6 +54,13 @@ def create_app():
         else:
             app.logger.warning("Failed to create some MongoDB indexes")
 
+    # Фоновые воркеры очереди generation_jobs в этом процессе
+    # (отдельный процесс-воркер запускается через worker.py)
+    worker_threads = app.config.get("JOB_WORKER_THREADS", 0)
+    if start_workers and mongo_connected and worker_threads > 0:
+        start_job_workers(app, worker_threads)
+        app.logger.info(f"Started {worker_threads} in-process job worker(s)")
+
     @app.route('/test-mongo')
     def test_mongo():
         if not mongo_connected:
@@ -57,7 +73,8 @@ def create_app():
             collections = mongo.db.list_collection_names()
             # Информация об индексах
             indexes_info = {}
-            for coll_name in ['test_documents', 'materials_raw']:
+            for coll_name in ['test_documents', 'materials_raw', 'facts', 'test_generation_cache',
+                              'generation_jobs']:
                 if coll_name in collections:
                     indexes = list(mongo.db[coll_name].list_indexes())
                     indexes_info[coll_name] = [idx['name'] for idx in indexes]
@@ -138,7 +155,8 @@ def create_app():
                 'postgres': db_status,
                 'mongodb': mongo_status,
                 's3': s3_status
-            }
+            },
+            'postgres_pool': pool_stats()
         })
 
     @app.route('/test-db')
@@ -155,6 +173,17 @@ def create_app():
                 'error': str(e)
             }), 500
 
+    @app.route('/model-status')
+    def model_status():
+        return jsonify({
+            'status': 'OK',
+            'use_mock': app.config.get("USE_MOCK_QUESTION_GENERATOR", True),
+            'registry': model_registry.stats(),
+            'fact_cache': FactCacheService.stats(),
+            'generation_cache': GenerationCacheService.stats(),
+            'question_bank': QuestionBankService.stats()
+        })
+
     use_mock = app.config.get("USE_MOCK_QUESTION_GENERATOR", True)
     if use_mock:
         app.logger.info("Using MOCK question generator (dev mode)")
@@ -165,5 +194,31 @@ def create_app():
             app.logger.warning("Real generator configured but model not found - will fail on generation")
         else:
             app.logger.info(f"Using REAL question generator with model at: {model_path}")
+            # Веб-процесс, который только ставит задачи в очередь, модель не загружает:
+            # в pre-fork сервере иначе каждый веб-воркер держал бы свою копию модели
+            runs_generation = (start_workers and app.config.get("JOB_WORKER_THREADS", 0) > 0) \
+                or not app.config.get("GENERATION_ASYNC_DEFAULT", True)
+            if runs_generation:
+                preload_model(app)
 
     return app
+
+
+def preload_model(app):
+    """Загрузить и прогреть модель при старте процесса, который выполняет генерацию (PRELOAD_MODEL)"""
+    if app.config.get("USE_MOCK_QUESTION_GENERATOR", True) or not app.config.get("PRELOAD_MODEL", False):
+        return
+    model_path = app.config.get("MODEL_PATH")
+    if not model_path or not os.path.exists(model_path):
+        return
+    try:
+        loaded = model_registry.warmup(
+            model_path,
+            backend=app.config.get("INFERENCE_BACKEND"),
+            backend_options=inference_backend_options(app.config)
+        )
+        app.logger.info(
+            f"Model preloaded in {loaded.load_time:.1f}s, memory: {loaded.memory}"
+        )
+    except Exception as e:
+        app.logger.error(f"Model preload failed: {type(e).__name__}: {e}")
@@ -0,0 +1,33 @@
+from flask import Blueprint, request, jsonify
+from app.services.job_service import JobService
+from app.auth import token_required
+import traceback
+
+jobs_bp = Blueprint('jobs', __name__, url_prefix='/jobs')
+
+
+@jobs_bp.route('/<job_id>', methods=['GET'])
+@token_required
+def get_job(job_id):
+    """
+    Get background job status and per-batch progress
+    """
+    try:
+        service = JobService()
+        job = service.get_job(job_id, request.user_id)
+
+        if not job:
+            return jsonify({"error": "Job not found"}), 404
+
+        return jsonify({
+            "success": True,
+            "job": job
+        }), 200
+
+    except Exception as e:
+        print(f"Error getting job: {e}")
+        traceback.print_exc()
+        return jsonify({
+            "error": "Failed to get job",
+            "details": str(e)
+        }), 500
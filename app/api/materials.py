@@ -1,6 +1,7 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from app.services.material_service import MaterialService
 from app.auth import token_required
+from app.utils.helpers import parse_page_params
 import traceback
 
 materials_bp = Blueprint('materials', __name__, url_prefix='/materials')
@@ -12,7 +13,8 @@ def create_material():
     Upload a plaintext material
     Body: {
         "title": "My Study Material",
-        "text": "Content here..."
+        "text": "Content here...",
+        "precompute_facts": true (optional, extract facts in the background; default FACTS_PRECOMPUTE)
     }
     """
     try:
@@ -36,7 +38,8 @@ def create_material():
             user_id=request.user_id,
             title=title,
             text=text,
-            material_type='text'
+            material_type='text',
+            precompute_facts=bool(data.get('precompute_facts', current_app.config.get('FACTS_PRECOMPUTE', False)))
         )
 
         return jsonify({
@@ -60,13 +63,20 @@ def list_materials():
     Get list of user's materials (metadata only)
     """
     try:
+        limit, cursor, error = parse_page_params(
+            request.args, current_app.config['PAGE_SIZE_DEFAULT'], current_app.config['PAGE_SIZE_MAX']
+        )
+        if error:
+            return jsonify({"error": error}), 400
+
         service = MaterialService()
-        materials = service.list_user_materials(request.user_id)
+        materials, next_cursor = service.list_user_materials(request.user_id, limit, cursor)
 
         return jsonify({
             "success": True,
             "materials": materials,
-            "count": len(materials)
+            "count": len(materials),
+            "next_cursor": next_cursor
         }), 200
 
     except Exception as e:
@@ -1,11 +1,51 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
 from app.services.test_service import TestService
+from app.llm.cancellation import CancellationToken
 from app.auth import token_required
+from app.utils.helpers import parse_page_params
 import traceback
+import socket
+import json
 
 tests_bp = Blueprint('tests', __name__, url_prefix='/tests')
 
 
+def _parse_deadline(value, default=None):
+    """
+    deadline_seconds из запроса; без него - GENERATION_DEADLINE_SECONDS (если задан default)
+    :return: (seconds_or_None, error)
+    """
+    if value is None:
+        return default, None
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        return None, "deadline_seconds must be a number"
+    if seconds <= 0:
+        return None, "deadline_seconds must be positive"
+    return seconds, None
+
+
+def _client_disconnected_probe(environ):
+    """
+    () -> bool: закрыл ли клиент соединение (peek сокета без чтения).
+    None, если сервер не отдаёт сокет в environ.
+    """
+    sock = environ.get('gunicorn.socket') or environ.get('werkzeug.socket')
+    if sock is None:
+        return None
+
+    def disconnected():
+        try:
+            return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+        except BlockingIOError:
+            return False
+        except OSError:
+            return True
+
+    return disconnected
+
+
 @tests_bp.route('', methods=['POST'])
 @token_required
 def create_test():
@@ -59,13 +99,20 @@ def list_tests():
     Get list of user's tests
     """
     try:
+        limit, cursor, error = parse_page_params(
+            request.args, current_app.config['PAGE_SIZE_DEFAULT'], current_app.config['PAGE_SIZE_MAX']
+        )
+        if error:
+            return jsonify({"error": error}), 400
+
         service = TestService()
-        tests = service.list_user_tests(request.user_id)
+        tests, next_cursor = service.list_user_tests(request.user_id, limit, cursor)
 
         return jsonify({
             "success": True,
             "tests": tests,
-            "count": len(tests)
+            "count": len(tests),
+            "next_cursor": next_cursor
         }), 200
 
     except Exception as e:
@@ -111,7 +158,12 @@ def generate_test(test_id):
     Generate questions for a test from a material
     Body: {
         "material_id": "uuid-of-material",
-        "question_count": 10 (optional, default 10)
+        "question_count": 10 (optional, default 10),
+        "bypass_cache": false (optional, regenerate without reading caches),
+        "async": true (optional, default GENERATION_ASYNC_DEFAULT=true: enqueue a job and return 202 with its id;
+            false runs the generation in the request),
+        "deadline_seconds": 60 (optional, return the questions ready by then with "truncated": true;
+            for jobs counted from the job start)
     }
     """
     try:
@@ -122,6 +174,7 @@ def generate_test(test_id):
 
         material_id = data.get('material_id')
         question_count = data.get('question_count', 10)
+        bypass_cache = bool(data.get('bypass_cache', False))
 
         if not material_id:
             return jsonify({"error": "material_id is required"}), 400
@@ -134,13 +187,70 @@ def generate_test(test_id):
             return jsonify({"error": "question_count must be an integer"}), 400
 
         service = TestService()
+
+        run_async = data.get('async', current_app.config.get('GENERATION_ASYNC_DEFAULT', True))
+        if not isinstance(run_async, bool):
+            return jsonify({"error": "async must be a boolean"}), 400
+        # Срок по умолчанию нужен только синхронным запросам: их обрывает таймаут шлюза
+        deadline_seconds, error = _parse_deadline(
+            data.get('deadline_seconds'),
+            None if run_async else current_app.config.get('GENERATION_DEADLINE_SECONDS')
+        )
+        if error:
+            return jsonify({"error": error}), 400
+
+        if run_async:
+            job, error = service.enqueue_test_generation(
+                test_id=test_id,
+                user_id=request.user_id,
+                material_id=material_id,
+                question_count=question_count,
+                bypass_cache=bypass_cache,
+                deadline_seconds=deadline_seconds
+            )
+            if error:
+                return jsonify({
+                    "success": False,
+                    "error": error
+                }), 400
+
+            return jsonify({
+                "success": True,
+                "message": "Generation queued",
+                "job_id": job['job_id'],
+                "status_url": f"/jobs/{job['job_id']}"
+            }), 202
+
+        # Событие "truncated": к сроку готова только часть вопросов
+        truncated = []
+
+        def on_event(event_type, data):
+            if event_type == "truncated":
+                truncated.append(data)
+
         questions, error = service.generate_test_questions(
             test_id=test_id,
             user_id=request.user_id,
             material_id=material_id,
-            question_count=question_count
+            question_count=question_count,
+            bypass_cache=bypass_cache,
+            on_event=on_event,
+            cancel_token=CancellationToken(poll_fn=_client_disconnected_probe(request.environ)),
+            deadline_seconds=deadline_seconds
         )
 
+        if error == TestService.ERROR_CANCELLED:
+            return jsonify({
+                "success": False,
+                "error": error
+            }), 409
+
+        if error == TestService.ERROR_DEADLINE:
+            return jsonify({
+                "success": False,
+                "error": error
+            }), 503
+
         if error:
             return jsonify({
                 "success": False,
@@ -151,7 +261,8 @@ def generate_test(test_id):
             "success": True,
             "message": "Questions generated successfully",
             "questions": questions,
-            "question_count": len(questions)
+            "question_count": len(questions),
+            "truncated": bool(truncated)
         }), 200
 
     except Exception as e:
@@ -163,6 +274,93 @@ def generate_test(test_id):
         }), 500
 
 
+@tests_bp.route('/<test_id>/generate', methods=['DELETE'])
+@token_required
+def cancel_generate_test(test_id):
+    """
+    Cancel running or queued question generation for a test
+    (synchronous, streaming and background jobs)
+    """
+    try:
+        service = TestService()
+        result, error = service.cancel_test_generation(test_id, request.user_id)
+
+        if error:
+            return jsonify({"error": error}), 404
+
+        return jsonify({
+            "success": True,
+            **result
+        }), 200
+
+    except Exception as e:
+        print(f"Error cancelling generation: {e}")
+        traceback.print_exc()
+        return jsonify({
+            "error": "Failed to cancel generation",
+            "details": str(e)
+        }), 500
+
+
+@tests_bp.route('/<test_id>/generate/stream', methods=['GET'])
+@token_required
+def stream_generate_test(test_id):
+    """
+    Generate questions and stream them as server-sent events
+    Query: ?material_id=uuid-of-material&question_count=10&bypass_cache=false&deadline_seconds=60
+    Events: stage, bank (questions reused from the material's question bank),
+    batch (validated questions of one batch), truncated, done, error
+    Closing the connection cancels the generation.
+    """
+    material_id = request.args.get('material_id')
+    question_count = request.args.get('question_count', 10)
+    bypass_cache = request.args.get('bypass_cache', 'false').lower() == 'true'
+
+    if not material_id:
+        return jsonify({"error": "material_id is required"}), 400
+
+    try:
+        question_count = int(question_count)
+        if question_count < 1 or question_count > 50:
+            return jsonify({"error": "question_count must be between 1 and 50"}), 400
+    except ValueError:
+        return jsonify({"error": "question_count must be an integer"}), 400
+
+    deadline_seconds, error = _parse_deadline(
+        request.args.get('deadline_seconds'),
+        current_app.config.get('GENERATION_DEADLINE_SECONDS')
+    )
+    if error:
+        return jsonify({"error": error}), 400
+
+    service = TestService()
+    events = service.stream_test_questions(
+        test_id=test_id,
+        user_id=request.user_id,
+        material_id=material_id,
+        question_count=question_count,
+        bypass_cache=bypass_cache,
+        deadline_seconds=deadline_seconds
+    )
+
+    def event_stream():
+        for event_type, data in events:
+            if event_type == "ping":
+                # SSE-комментарий: клиент его игнорирует, а разрыв соединения обнаруживается
+                yield ": ping\n\n"
+                continue
+            yield f"event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    return Response(
+        stream_with_context(event_stream()),
+        mimetype='text/event-stream',
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # nginx не должен буферизовать поток
+        }
+    )
+
+
 @tests_bp.route('/<test_id>/content', methods=['GET'])
 @token_required
 def get_test_content(test_id):
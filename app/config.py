@@ -13,6 +13,13 @@ class Config:
     DB_NAME = os.getenv('DB_NAME', 'test_mvp_db')
     DB_USER = os.getenv('DB_USER', 'test_mvp_user')
     DB_PASSWORD = os.getenv('DB_PASSWORD', 'test_mvp_password')
+    # Пул соединений на процесс: соединения, открываемые при создании пула, максимум
+    # (столько же может простаивать открытыми), ожидание свободного соединения (сек)
+    # и простой, после которого соединение проверяется SELECT 1 перед выдачей
+    DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+    DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '10'))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+    DB_POOL_HEALTH_CHECK_SECONDS = float(os.getenv('DB_POOL_HEALTH_CHECK_SECONDS', '30'))
 
     MONGO_URI = os.getenv("MONGO_URI")
     MONGO_DBNAME = os.getenv("MONGO_DBNAME")
@@ -42,13 +49,79 @@ class Config:
     S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME", "test-materials")
     S3_REGION = os.getenv("S3_REGION", "us-east-1")
 
+    #generation
+    # Бэкенд инференса: transformers-gpu (4-bit, bitsandbytes), transformers-cpu (int8), onnxruntime
+    INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "transformers-gpu")
+    # Потоки torch / ONNX Runtime для CPU-бэкендов (0 - по умолчанию библиотеки)
+    INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "0")) or None
+    # Динамическая int8-квантизация Linear-слоёв в transformers-cpu
+    INFERENCE_CPU_INT8 = os.getenv("INFERENCE_CPU_INT8", "true").lower() == "true"
+    # Черновая модель для speculative decoding (пусто - выключено); грузится тем же бэкендом
+    GENERATION_DRAFT_MODEL_PATH = os.getenv("GENERATION_DRAFT_MODEL_PATH") or None
+    # Все батчи теста одним padded-вызовом model.generate вместо последовательных вызовов
+    GENERATION_BATCHED = os.getenv("GENERATION_BATCHED", "false").lower() == "true"
+    # Максимум батчей в одном вызове generate (пусто - без ограничения)
+    GENERATION_MAX_PARALLEL_BATCHES = int(os.getenv("GENERATION_MAX_PARALLEL_BATCHES", "0")) or None
+    # KV-кэш статического префикса промпта вопросов (примеры и правила)
+    GENERATION_PREFIX_CACHE = os.getenv("GENERATION_PREFIX_CACHE", "true").lower() == "true"
+    # Фиксированный seed генерации (пусто - случайная генерация)
+    GENERATION_SEED = int(os.getenv("GENERATION_SEED")) if os.getenv("GENERATION_SEED") else None
+    # Continuous batching: промпты всех одновременных запросов декодируются общими шагами
+    GENERATION_SCHEDULER = os.getenv("GENERATION_SCHEDULER", "false").lower() == "true"
+    GENERATION_SCHEDULER_MAX_BATCH = int(os.getenv("GENERATION_SCHEDULER_MAX_BATCH", "16"))
+    # Декодирование вопросов, ограниченное JSON-шаблоном батча: невалидный JSON становится невозможен
+    GENERATION_CONSTRAINED = os.getenv("GENERATION_CONSTRAINED", "false").lower() == "true"
+    # Срок синхронной генерации (сек, меньше таймаута шлюза): к нему возвращается готовая часть
+    # вопросов с truncated=true; запрос может передать свой deadline_seconds (0 - без срока)
+    GENERATION_DEADLINE_SECONDS = float(os.getenv("GENERATION_DEADLINE_SECONDS", "0")) or None
+    # Длинные материалы режутся по предложениям на фрагменты не длиннее FACT_CHUNK_TOKENS токенов
+    FACT_CHUNK_TOKENS = int(os.getenv("FACT_CHUNK_TOKENS", "1500"))
+    # Сколько фрагментов извлекается одним padded-вызовом generate
+    FACT_CHUNK_BATCH_SIZE = int(os.getenv("FACT_CHUNK_BATCH_SIZE", "4"))
+    # Конвейер: батчи вопросов стартуют, как только извлечены факты их части материала
+    GENERATION_PIPELINE = os.getenv("GENERATION_PIPELINE", "true").lower() == "true"
+    # Каждому батчу вопросов - своё подмножество фактов (0 - все факты в каждом промпте)
+    FACTS_PER_BATCH = int(os.getenv("FACTS_PER_BATCH", "12")) or None
+    # Банк вопросов по материалам (коллекция question_bank): новый тест берёт вопросы из банка
+    # по набору типов и генерирует только недостающие
+    QUESTION_BANK_ENABLED = os.getenv("QUESTION_BANK_ENABLED", "true").lower() == "true"
+    # Кэш провалидированных батчей вопросов (коллекция test_generation_cache)
+    GENERATION_CACHE_ENABLED = os.getenv("GENERATION_CACHE_ENABLED", "true").lower() == "true"
+    GENERATION_CACHE_TTL_SECONDS = int(os.getenv("GENERATION_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+    GENERATION_CACHE_MAX_ENTRIES = int(os.getenv("GENERATION_CACHE_MAX_ENTRIES", "10000"))
+    # Запись кэша фактов (коллекция facts) удаляется, если не использовалась столько секунд
+    FACT_CACHE_TTL_SECONDS = int(os.getenv("FACT_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+
+    #jobs
+    # По умолчанию POST /tests/<id>/generate ставит задачу в очередь и возвращает 202
+    GENERATION_ASYNC_DEFAULT = os.getenv("GENERATION_ASYNC_DEFAULT", "true").lower() == "true"
+    # Потоки-воркеры очереди внутри веб-процесса (0 - только отдельный worker.py).
+    # В pre-fork сервере воркер (и модель) появился бы в каждом веб-процессе, поэтому по умолчанию 0
+    JOB_WORKER_THREADS = int(os.getenv("JOB_WORKER_THREADS", "0"))
+    JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+    # Задача running без heartbeat дольше этого времени забирается другим воркером
+    JOB_STALE_AFTER_SECONDS = int(os.getenv("JOB_STALE_AFTER_SECONDS", "600"))
+    # Как часто воркер продлевает аренду выполняемой задачи (не реже JOB_STALE_AFTER_SECONDS / 3)
+    JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "30"))
+    # Извлекать факты загруженного материала фоновой задачей precompute_facts
+    FACTS_PRECOMPUTE = os.getenv("FACTS_PRECOMPUTE", "false").lower() == "true"
+
+    # Размер страницы списков GET /tests и GET /materials (параметр limit не больше PAGE_SIZE_MAX)
+    PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", "20"))
+    PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "100"))
+
 class DevelopmentConfig(Config):
     DEBUG = True
     # No real model loading
     USE_MOCK_QUESTION_GENERATOR = True
     MOCK_GENERATION_DELAY = 2.0
+    # Один процесс run.py: задачи выполняются прямо в нём
+    JOB_WORKER_THREADS = int(os.getenv("JOB_WORKER_THREADS", "1"))
 
 class ProductionConfig(Config):
     DEBUG = False
     USE_MOCK_QUESTION_GENERATOR = False
     MODEL_PATH = os.environ.get('MODEL_PATH')
+    # Загрузить модель и прогреть её при старте, а не на первом запросе. Только в процессах,
+    # которые генерируют: worker.py, веб-процесс с JOB_WORKER_THREADS > 0 или GENERATION_ASYNC_DEFAULT=false
+    PRELOAD_MODEL = os.getenv('PRELOAD_MODEL', 'true').lower() == 'true'
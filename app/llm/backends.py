@@ -0,0 +1,190 @@
+import os
+import resource
+from typing import Dict
+
+
+def process_rss_bytes() -> int:
+    """Текущий RSS процесса (Linux), иначе пиковый"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def gpu_allocated_bytes() -> int:
+    try:
+        import torch
+        if torch.cuda.is_available():
+            return torch.cuda.memory_allocated()
+    except Exception:
+        pass
+    return 0
+
+
+class InferenceBackend:
+    """
+    Способ загрузить модель и токенизатор.
+    Загруженная модель должна поддерживать model.generate(**inputs) и model.device.
+    """
+    name = None
+    # Поддерживает ли модель прямой forward с past_key_values
+    # (нужен для KV-кэша префикса и планировщика continuous batching)
+    supports_kv_reuse = True
+
+    def __init__(self, **options):
+        self.options = options
+
+    def load(self, model_path: str):
+        """:return: (model, tokenizer, memory)"""
+        raise NotImplementedError
+
+    def describe(self) -> Dict:
+        return {"name": self.name, "options": self.options, "supports_kv_reuse": self.supports_kv_reuse}
+
+
+class TransformersGPUBackend(InferenceBackend):
+    """transformers + bitsandbytes: 4-битные веса на GPU"""
+    name = "transformers-gpu"
+
+    def load(self, model_path: str):
+        import torch
+        from transformers import AutoTokenizer, AutoModelForCausalLM
+
+        # Set memory optimization
+        os.environ['PYTORCH_CUDA_ALLOC_CONF'] = 'expandable_segments:True'
+
+        gpu_before = gpu_allocated_bytes()
+        tokenizer = AutoTokenizer.from_pretrained(model_path)
+        model = AutoModelForCausalLM.from_pretrained(
+            model_path,
+            device_map="auto",
+            load_in_4bit=True,
+            torch_dtype=torch.float16
+        )
+        model.eval()
+
+        memory = {
+            "model_bytes": model.get_memory_footprint(),
+            "gpu_allocated_bytes": gpu_allocated_bytes() - gpu_before,
+            "process_max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        }
+        return model, tokenizer, memory
+
+
+class TransformersCPUBackend(InferenceBackend):
+    """
+    transformers на CPU: float32 веса с динамической int8-квантизацией Linear-слоёв
+    и ограничением числа потоков torch
+    """
+    name = "transformers-cpu"
+
+    def load(self, model_path: str):
+        import torch
+        from transformers import AutoTokenizer, AutoModelForCausalLM
+
+        num_threads = self.options.get("num_threads")
+        if num_threads:
+            torch.set_num_threads(num_threads)
+
+        rss_before = process_rss_bytes()
+        tokenizer = AutoTokenizer.from_pretrained(model_path)
+        model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=torch.float32)
+        model.eval()
+
+        if self.options.get("int8", True):
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+        memory = {
+            "process_rss_delta_bytes": process_rss_bytes() - rss_before,
+            "process_max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            "torch_threads": torch.get_num_threads()
+        }
+        return model, tokenizer, memory
+
+
+class OnnxRuntimeBackend(InferenceBackend):
+    """
+    ONNX Runtime через optimum: берёт готовый model.onnx из model_path
+    или экспортирует модель при загрузке
+    """
+    name = "onnxruntime"
+    # ORTModelForCausalLM не принимает DynamicCache в прямом forward
+    supports_kv_reuse = False
+
+    def load(self, model_path: str):
+        import onnxruntime
+        from transformers import AutoTokenizer
+        from optimum.onnxruntime import ORTModelForCausalLM
+
+        session_options = onnxruntime.SessionOptions()
+        num_threads = self.options.get("num_threads")
+        if num_threads:
+            session_options.intra_op_num_threads = num_threads
+
+        providers = onnxruntime.get_available_providers()
+        provider = "CUDAExecutionProvider" if "CUDAExecutionProvider" in providers else "CPUExecutionProvider"
+        has_onnx = any(name.endswith(".onnx") for name in os.listdir(model_path))
+
+        rss_before = process_rss_bytes()
+        tokenizer = AutoTokenizer.from_pretrained(model_path)
+        model = ORTModelForCausalLM.from_pretrained(
+            model_path,
+            export=not has_onnx,
+            provider=provider,
+            session_options=session_options,
+            use_cache=True
+        )
+
+        memory = {
+            "process_rss_delta_bytes": process_rss_bytes() - rss_before,
+            "process_max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            "provider": provider,
+            "exported": not has_onnx
+        }
+        return model, tokenizer, memory
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (TransformersGPUBackend, TransformersCPUBackend, OnnxRuntimeBackend)
+}
+
+DEFAULT_BACKEND = TransformersGPUBackend.name
+
+
+def inference_backend_options(config) -> Dict:
+    """Опции бэкенда из конфигурации приложения"""
+    options = {"num_threads": config.get("INFERENCE_THREADS")}
+    if config.get("INFERENCE_BACKEND") == TransformersCPUBackend.name:
+        options["int8"] = config.get("INFERENCE_CPU_INT8", True)
+    return options
+
+
+def get_backend(name: str = None, **options) -> InferenceBackend:
+    name = name or DEFAULT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {name}. Available: {', '.join(BACKENDS)}")
+    return BACKENDS[name](**options)
+
+
+class ThroughputMeter:
+    """Накопленная пропускная способность генерации одной загруженной модели"""
+
+    def __init__(self):
+        self.calls = 0
+        self.new_tokens = 0
+        self.seconds = 0.0
+
+    def record(self, new_tokens: int, seconds: float):
+        self.calls += 1
+        self.new_tokens += new_tokens
+        self.seconds += seconds
+
+    def to_dict(self) -> Dict:
+        return {
+            "generate_calls": self.calls,
+            "new_tokens": self.new_tokens,
+            "seconds": round(self.seconds, 3),
+            "tokens_per_second": round(self.new_tokens / self.seconds, 2) if self.seconds else 0.0
+        }
@@ -0,0 +1,113 @@
+import threading
+from contextlib import contextmanager
+from typing import Dict, List
+
+
+class GenerationCancelled(Exception):
+    """Генерация остановлена по запросу отмены"""
+
+
+class CancellationToken:
+    """
+    Флаг кооперативной отмены генерации.
+    Проверяется между батчами и на каждом шаге декодирования (CancellationStoppingCriteria),
+    в том числе в общем потоке планировщика, поэтому cancelled только читает флаг.
+    Внешние проверки (запросы в Mongo, peek сокета) выполняет поток-наблюдатель watching().
+    """
+
+    def __init__(self, poll_fn=None, poll_interval: float = 2.0):
+        """
+        :param poll_fn: () -> bool, внешняя проверка отмены (разорванное соединение, флаг в Mongo);
+            внутри watching() проверки вызываются раз в poll_interval секунд
+        """
+        self._event = threading.Event()
+        self._polls = [poll_fn] if poll_fn is not None else []
+        self.poll_interval = poll_interval
+        self.reason = None
+
+    def add_poll(self, poll_fn):
+        self._polls.append(poll_fn)
+
+    def cancel(self, reason: str = "cancelled"):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def poll(self) -> bool:
+        """Выполнить внешние проверки один раз; при срабатывании отменить"""
+        for poll_fn in list(self._polls):
+            try:
+                if poll_fn():
+                    self.cancel("poll")
+                    break
+            except Exception as e:
+                print(f"Cancellation poll failed: {e}")
+        return self._event.is_set()
+
+    @contextmanager
+    def watching(self):
+        """Пока выполняется блок, опрашивать внешние проверки в отдельном потоке"""
+        stop = threading.Event()
+
+        def watch():
+            while not stop.wait(self.poll_interval) and not self._event.is_set():
+                self.poll()
+
+        if self._polls:
+            threading.Thread(target=watch, name="cancellation-watcher", daemon=True).start()
+        try:
+            yield self
+        finally:
+            stop.set()
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise GenerationCancelled(self.reason or "cancelled")
+
+
+class CancellationStoppingCriteria:
+    """Stopping criteria для model.generate: после отмены останавливаются все строки батча"""
+
+    def __init__(self, token: CancellationToken):
+        self.token = token
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+
+        return torch.full((input_ids.shape[0],), self.token.cancelled, dtype=torch.bool, device=input_ids.device)
+
+
+class CancellationRegistry:
+    """Токены генераций, идущих в этом процессе, по ключу (test_id)"""
+
+    def __init__(self):
+        self._tokens: Dict[str, List[CancellationToken]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, key: str, token: CancellationToken) -> CancellationToken:
+        with self._lock:
+            self._tokens.setdefault(key, []).append(token)
+        return token
+
+    def release(self, key: str, token: CancellationToken):
+        with self._lock:
+            tokens = self._tokens.get(key, [])
+            if token in tokens:
+                tokens.remove(token)
+            if not tokens:
+                self._tokens.pop(key, None)
+
+    def cancel(self, key: str, reason: str = "cancelled") -> int:
+        """:return: сколько генераций отменено"""
+        with self._lock:
+            tokens = list(self._tokens.get(key, []))
+        for token in tokens:
+            token.cancel(reason)
+        return len(tokens)
+
+
+cancellation_registry = CancellationRegistry()
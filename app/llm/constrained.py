@@ -0,0 +1,305 @@
+import json
+import threading
+from typing import Dict, List
+
+# Максимальная длина строкового значения: дальше разрешено только закрыть строку
+MAX_STRING_CHARS = 400
+
+_vocabularies: Dict[int, "TokenVocabulary"] = {}
+_vocabularies_lock = threading.Lock()
+
+
+def build_segments(template: List[Dict]) -> List[tuple]:
+    """
+    Разобрать шаблон батча (как в промпте) в последовательность сегментов вывода:
+      ("lit", text)     - фиксированный текст JSON (ключи, скобки, номера, типы);
+      ("str",)          - содержимое строки на месте "" (без кавычек и экранирования);
+      ("choice", alts)  - один из вариантов (индекс правильного ответа MCQ).
+    Закрывающая кавычка строки - первый символ следующего литерала.
+    """
+    segments = []
+
+    def lit(text):
+        if segments and segments[-1][0] == "lit":
+            segments[-1] = ("lit", segments[-1][1] + text)
+        else:
+            segments.append(("lit", text))
+
+    def value(val, key=None, question=None):
+        if val == "":
+            lit('"')
+            segments.append(("str",))
+            lit('"')
+        elif key == "answers" and question.get("question_type") == "mcq":
+            n_options = max(1, len(question.get("options", [])))
+            lit("[")
+            segments.append(("choice", [str(i) for i in range(n_options)]))
+            lit("]")
+        elif isinstance(val, list):
+            lit("[")
+            for i, item in enumerate(val):
+                if i:
+                    lit(", ")
+                value(item)
+            lit("]")
+        else:
+            lit(json.dumps(val, ensure_ascii=False))
+
+    lit("[")
+    for i, question in enumerate(template):
+        if i:
+            lit(", ")
+        lit("{")
+        for j, (key, val) in enumerate(question.items()):
+            if j:
+                lit(", ")
+            lit(json.dumps(key, ensure_ascii=False) + ": ")
+            value(val, key, question)
+        lit("}")
+    lit("]")
+    return segments
+
+
+class TokenVocabulary:
+    """Текст каждого токена словаря и производные таблицы; строится один раз на токенизатор"""
+
+    def __init__(self, tokenizer):
+        import torch
+
+        self.size = len(tokenizer)
+        special = set(tokenizer.all_special_ids)
+
+        # Декодируем токен после "якоря", чтобы сохранить ведущий пробел (SentencePiece его теряет)
+        anchor = tokenizer.encode("a", add_special_tokens=False)[-1]
+        anchor_text = tokenizer.decode([anchor])
+        decoded = tokenizer.batch_decode([[anchor, token_id] for token_id in range(self.size)])
+
+        self.texts = []
+        for token_id, full in enumerate(decoded):
+            if token_id in special:
+                self.texts.append(None)
+            elif full.startswith(anchor_text):
+                self.texts.append(full[len(anchor_text):])
+            else:
+                self.texts.append(tokenizer.decode([token_id]))
+
+        self.by_text: Dict[str, List[int]] = {}
+        self.quote_tokens = []
+        plain = torch.zeros(self.size, dtype=torch.bool)
+        for token_id, text in enumerate(self.texts):
+            if not text:
+                continue
+            self.by_text.setdefault(text, []).append(token_id)
+            if "\\" in text or any(ord(ch) < 32 for ch in text):
+                continue
+            if '"' in text:
+                self.quote_tokens.append((token_id, text.index('"'), text))
+            else:
+                plain[token_id] = True
+
+        self.plain_mask = plain
+        self.max_token_chars = max(len(text) for text in self.by_text)
+        self._plain_by_device = {}
+        self._memo = {}
+
+    def plain_mask_on(self, device):
+        mask = self._plain_by_device.get(str(device))
+        if mask is None:
+            mask = self.plain_mask.to(device)
+            self._plain_by_device[str(device)] = mask
+        return mask
+
+    def prefix_ids(self, text: str) -> List[int]:
+        """Токены, текст которых - непустой префикс text"""
+        key = ("prefix", text)
+        if key not in self._memo:
+            ids = []
+            for k in range(1, min(len(text), self.max_token_chars) + 1):
+                ids.extend(self.by_text.get(text[:k], []))
+            self._memo[key] = ids
+        return self._memo[key]
+
+    def closing_ids(self, next_literal: str, allow_content: bool, has_content: bool) -> List[int]:
+        """
+        Токены, закрывающие строку: до первой кавычки - допустимое содержимое строки,
+        начиная с кавычки - префикс следующего литерала
+        """
+        key = ("close", next_literal, allow_content, has_content)
+        if key not in self._memo:
+            ids = []
+            for token_id, quote_pos, text in self.quote_tokens:
+                if quote_pos > 0 and not allow_content:
+                    continue
+                if quote_pos == 0 and not has_content:
+                    continue
+                if next_literal.startswith(text[quote_pos:]):
+                    ids.append(token_id)
+            self._memo[key] = ids
+        return self._memo[key]
+
+
+def get_vocabulary(tokenizer) -> TokenVocabulary:
+    vocab = _vocabularies.get(id(tokenizer))
+    if vocab is None:
+        with _vocabularies_lock:
+            vocab = _vocabularies.get(id(tokenizer))
+            if vocab is None:
+                vocab = TokenVocabulary(tokenizer)
+                _vocabularies[id(tokenizer)] = vocab
+    return vocab
+
+
+class TemplateState:
+    """Позиция одной строки батча в сегментах шаблона"""
+
+    def __init__(self, segments: List[tuple]):
+        self.segments = segments
+        self.seg = 0
+        self.offset = 0
+        self.str_len = 0
+        self.choice = ""
+        # Если вывод разошёлся с шаблоном (чего не должно случаться), ограничения снимаются
+        self.unconstrained = False
+
+    @property
+    def done(self) -> bool:
+        return self.seg >= len(self.segments)
+
+    def _next(self):
+        self.seg += 1
+        self.offset = 0
+        self.str_len = 0
+        self.choice = ""
+
+    def consume(self, text: str):
+        i = 0
+        while i < len(text) and not self.unconstrained:
+            if self.done:
+                self.unconstrained = True
+                return
+
+            segment = self.segments[self.seg]
+            ch = text[i]
+            if segment[0] == "lit":
+                literal = segment[1]
+                if literal[self.offset] != ch:
+                    self.unconstrained = True
+                    return
+                self.offset += 1
+                i += 1
+                if self.offset == len(literal):
+                    self._next()
+            elif segment[0] == "str":
+                if ch == '"':
+                    # Кавычка закрывает строку и принадлежит следующему литералу
+                    self._next()
+                    continue
+                self.str_len += 1
+                i += 1
+            else:
+                alts = segment[1]
+                self.choice += ch
+                i += 1
+                if not any(alt.startswith(self.choice) for alt in alts):
+                    self.unconstrained = True
+                    return
+                if self.choice in alts and not any(alt != self.choice and alt.startswith(self.choice) for alt in alts):
+                    self._next()
+
+    def allowed(self, vocab: TokenVocabulary):
+        """:return: (разрешено ли любое содержимое строки, список дополнительно разрешённых токенов)"""
+        segment = self.segments[self.seg]
+        if segment[0] == "lit":
+            return False, vocab.prefix_ids(segment[1][self.offset:])
+        if segment[0] == "str":
+            next_literal = self.segments[self.seg + 1][1]
+            allow_content = self.str_len < MAX_STRING_CHARS
+            return allow_content, vocab.closing_ids(next_literal, allow_content, self.str_len > 0)
+
+        ids = []
+        for alt in segment[1]:
+            if alt.startswith(self.choice) and alt != self.choice:
+                ids.extend(vocab.prefix_ids(alt[len(self.choice):]))
+        return False, ids
+
+
+class JsonTemplateLogitsProcessor:
+    """
+    Logits processor (интерфейс transformers), который заставляет каждую строку батча
+    выводить JSON-массив строго по шаблону её батча: фиксированные части форсируются,
+    свободными остаются только строковые значения и индекс ответа MCQ.
+    После закрытия массива разрешён только EOS.
+    """
+
+    def __init__(self, tokenizer, templates: List[List[Dict]], prompt_len: int, eos_token_ids: List[int]):
+        """
+        :param templates: шаблон батча для каждой строки
+        :param prompt_len: длина input_ids до начала генерации
+            (0, если в input_ids передаются только сгенерированные токены)
+        """
+        self.vocab = get_vocabulary(tokenizer)
+        self.segments = [build_segments(template) for template in templates]
+        self.rows = [TemplateState(segments) for segments in self.segments]
+        # Токены, уже учтённые в состоянии каждой строки
+        self.consumed = [[] for _ in templates]
+        self.prompt_len = prompt_len
+        self.eos_token_ids = eos_token_ids
+
+    def _consume(self, row: int, token_id: int):
+        self.consumed[row].append(token_id)
+        state = self.rows[row]
+        if state.done or state.unconstrained:
+            return
+        text = self.vocab.texts[token_id] if token_id < self.vocab.size else None
+        if text is None:
+            state.unconstrained = True
+        else:
+            state.consume(text)
+
+    def _sync(self, input_ids):
+        """
+        Привести состояние строк к input_ids. Обычно добавлен один токен;
+        при speculative decoding процессор вызывается и для отклонённых кандидатов,
+        тогда состояние строки пересобирается с начала.
+        """
+        length = input_ids.shape[1] - self.prompt_len
+        tail = input_ids[:, -2:].tolist() if length > 0 else [[] for _ in self.rows]
+        for row, consumed in enumerate(self.consumed):
+            last = tail[row][-1] if length > 0 else None
+            before_last = tail[row][-2] if length > 1 else None
+            if length == len(consumed) and (length == 0 or last == consumed[-1]):
+                continue
+            if length == len(consumed) + 1 and (not consumed or before_last == consumed[-1]):
+                self._consume(row, last)
+                continue
+
+            self.rows[row] = TemplateState(self.segments[row])
+            self.consumed[row] = []
+            for token_id in input_ids[row, self.prompt_len:].tolist():
+                self._consume(row, token_id)
+
+    def __call__(self, input_ids, scores):
+        import torch
+
+        self._sync(input_ids)
+
+        allowed = torch.zeros_like(scores, dtype=torch.bool)
+        for row, state in enumerate(self.rows):
+            if state.unconstrained:
+                allowed[row] = True
+                continue
+            if state.done:
+                allowed[row, self.eos_token_ids] = True
+                continue
+
+            allow_content, ids = state.allowed(self.vocab)
+            if allow_content:
+                allowed[row, :self.vocab.size] = self.vocab.plain_mask_on(scores.device)
+            if ids:
+                allowed[row, ids] = True
+            if not allow_content and not ids:
+                # Токена для продолжения шаблона в словаре нет - отпускаем строку
+                state.unconstrained = True
+                allowed[row] = True
+
+        return scores.masked_fill(~allowed, float("-inf"))
@@ -0,0 +1,111 @@
+import math
+import threading
+import time
+from typing import Dict
+
+# Запас на сохранение результата и ответ клиенту
+DEADLINE_RESERVE_SECONDS = 2.0
+
+
+class Deadline:
+    """Срок, к которому запрос должен вернуть ответ (по монотонным часам)"""
+
+    def __init__(self, seconds: float, reserve: float = DEADLINE_RESERVE_SECONDS):
+        self.seconds = seconds
+        self.reserve = reserve
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        """Секунды, доступные генерации (без запаса на ответ)"""
+        return self.expires_at - time.monotonic() - self.reserve
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+class LatencyEstimator:
+    """
+    Оценка длительности вызова generate по недавним замерам:
+    seconds ~ overhead + per_token * max_new_tokens.
+    Прямая подбирается по экспоненциально взвешенным суммам (свежие замеры весят больше),
+    так что оценка следует за загрузкой модели и сменой бэкенда.
+    Также сглаживается доля вопросов, не прошедших с первой попытки (цена повторов).
+    """
+
+    def __init__(self, alpha: float = 0.3, default_overhead: float = 1.0, default_per_token: float = 0.05,
+                 default_failure_rate: float = 0.2):
+        self.alpha = alpha
+        self.default_overhead = default_overhead
+        self.default_per_token = default_per_token
+        self.failure_rate = default_failure_rate
+        self.samples = 0
+        # Взвешенные суммы: вес, x, y, x^2, x*y
+        self._w = self._x = self._y = self._xx = self._xy = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, max_new_tokens: int, seconds: float):
+        with self._lock:
+            decay = 1.0 - self.alpha
+            self._w = self._w * decay + 1.0
+            self._x = self._x * decay + max_new_tokens
+            self._y = self._y * decay + seconds
+            self._xx = self._xx * decay + max_new_tokens * max_new_tokens
+            self._xy = self._xy * decay + max_new_tokens * seconds
+            self.samples += 1
+
+    def observe_failures(self, requested: int, failed: int):
+        if requested:
+            with self._lock:
+                self.failure_rate += self.alpha * (failed / requested - self.failure_rate)
+
+    def coefficients(self):
+        """:return: (overhead, per_token)"""
+        with self._lock:
+            if not self.samples:
+                return self.default_overhead, self.default_per_token
+            mean_x = self._x / self._w
+            mean_y = self._y / self._w
+            var_x = self._xx / self._w - mean_x * mean_x
+            if self.samples >= 2 and var_x > 1.0:
+                per_token = (self._xy / self._w - mean_x * mean_y) / var_x
+                overhead = mean_y - per_token * mean_x
+                if per_token > 0 and overhead >= 0:
+                    return overhead, per_token
+            # Один размер вызовов (или шумные замеры): всё время относим на токены
+            return 0.0, mean_y / mean_x if mean_x else self.default_per_token
+
+    def estimate(self, max_new_tokens: int) -> float:
+        overhead, per_token = self.coefficients()
+        return overhead + per_token * max_new_tokens
+
+    def retry_rounds(self, first_pass: float, spare: float, max_retries: int) -> int:
+        """
+        Сколько попыток на вопрос укладывается в срок: повтор перегенерирует
+        только не прошедшие вопросы, т.е. стоит ~failure_rate от первого прохода
+        """
+        if first_pass <= 0:
+            return max_retries
+        retry_cost = first_pass * max(self.failure_rate, 0.05)
+        return max(1, min(max_retries, 1 + math.floor(max(spare, 0.0) / retry_cost)))
+
+    def to_dict(self) -> Dict:
+        overhead, per_token = self.coefficients()
+        return {
+            "samples": self.samples,
+            "overhead_seconds": round(overhead, 3),
+            "seconds_per_token": round(per_token, 5),
+            "failure_rate": round(self.failure_rate, 3)
+        }
+
+
+_estimators: Dict[str, LatencyEstimator] = {}
+_estimators_lock = threading.Lock()
+
+
+def get_latency_estimator(model_id: str) -> LatencyEstimator:
+    """Оценщик на модель (и бэкенд) в пределах процесса: замеры переживают запросы"""
+    with _estimators_lock:
+        if model_id not in _estimators:
+            _estimators[model_id] = LatencyEstimator()
+        return _estimators[model_id]
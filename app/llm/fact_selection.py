@@ -0,0 +1,57 @@
+import re
+from typing import List, Set
+
+# Грубая основа слова: первые N букв (достаточно для пересечения русских словоформ)
+STEM_CHARS = 6
+MIN_WORD_CHARS = 4
+
+
+def split_facts(facts: str) -> List[str]:
+    """Список фактов из вывода extract_facts (по одному на строку)"""
+    lines = [line.strip(" -•*\t\r") for line in facts.splitlines()]
+    return [line for line in lines if line]
+
+
+def _stems(fact: str) -> Set[str]:
+    words = re.findall(r"\w+", fact.lower())
+    return {word[:STEM_CHARS] for word in words if len(word) >= MIN_WORD_CHARS}
+
+
+def _overlap(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def select_batch_facts(facts: List[str], n_batches: int, facts_per_batch: int) -> List[List[str]]:
+    """
+    Подобрать каждому батчу подмножество фактов.
+    Батч начинается с наименее использованного факта (начальная позиция сдвигается от батча к батчу)
+    и добирает наименее использованные факты с наибольшим лексическим пересечением с ним,
+    поэтому подмножества не пересекаются, пока факты не закончатся, а затем ротируются.
+    Факты внутри подмножества остаются в исходном порядке (важно для SEQUENCE).
+    """
+    if n_batches <= 0:
+        return []
+    if len(facts) <= facts_per_batch:
+        return [list(facts) for _ in range(n_batches)]
+
+    stems = [_stems(fact) for fact in facts]
+    usage = [0] * len(facts)
+    stride = max(1, len(facts) // n_batches)
+
+    selections = []
+    for batch_idx in range(n_batches):
+        offset = batch_idx * stride
+        seed = min(range(len(facts)), key=lambda i: (usage[i], (i - offset) % len(facts)))
+
+        others = sorted(
+            (i for i in range(len(facts)) if i != seed),
+            key=lambda i: (usage[i], -_overlap(stems[seed], stems[i]), (i - offset) % len(facts))
+        )
+        chosen = sorted([seed] + others[:facts_per_batch - 1])
+        for i in chosen:
+            usage[i] += 1
+        selections.append([facts[i] for i in chosen])
+
+    return selections
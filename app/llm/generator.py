@@ -3,15 +3,171 @@ import random
 import re
 import json
 import gc
+import queue
+import threading
 from typing import List, Dict
+from app.llm.model_registry import model_registry
+from app.llm.backends import DEFAULT_BACKEND
+from app.llm.fact_selection import split_facts, select_batch_facts
+from app.llm.cancellation import GenerationCancelled, CancellationStoppingCriteria
+from app.llm.deadline import get_latency_estimator
+from app.llm.speculative import ForwardCounter, SpeculativeStats
+from app.llm.stopping import JsonArrayScanner, FactsListScanner, ScannerStoppingCriteria, ScannerStopFn
+
+
+# Bump when the extract_facts prompt changes: cached facts are keyed by it
+FACTS_PROMPT_VERSION = "1"
+
+# Examples are based on a completely different domain
+QUESTION_EXAMPLE_FACTS = """Фотосинтез преобразует световую энергию в химическую энергию.
+Хлорофилл - это пигмент, который улавливает солнечный свет.
+Углекислый газ и вода являются сырьем.
+Глюкоза и кислород - это продукты.
+Процесс происходит в хлоропластах."""
+
+QUESTION_EXAMPLE_OUTPUT = """[
+  {
+    "test_set": "Пример",
+    "question_number": 1,
+    "question_type": "mcq",
+    "question_text": "Что преобразует фотосинтез?",
+    "options": ["световую энергию в химическую энергию", "химическую энергию в световую энергию", "воду в кислород"],
+    "answers": [0]
+  },
+  {
+    "test_set": "Пример",
+    "question_number": 2,
+    "question_type": "input",
+    "question_text": "Какой пигмент улавливает солнечный свет в растениях?",
+    "answer": "Хлорофилл"
+  },
+  {
+    "test_set": "Пример",
+    "question_number": 3,
+    "question_type": "match",
+    "question_text": "Сопоставьте каждый термин с его ролью в фотосинтезе:",
+    "question_options": ["Углекислый газ", "Глюкоза", "Хлоропласты"],
+    "options": ["Сырье, используемое в процессе", "Продукт процесса", "Место, где происходит процесс"],
+    "answers": [[0,0],[1,1],[2,2]]
+  }
+]"""
+
+# Бюджет новых токенов на вопрос каждого типа (JSON-обвязка + тексты с запасом)
+QUESTION_TOKEN_BUDGET = {"mcq": 220, "input": 140, "match": 260, "sequence": 240}
+QUESTION_BATCH_OVERHEAD_TOKENS = 30
+QUESTION_MAX_NEW_TOKENS = 1500
+FACTS_MAX_NEW_TOKENS = 1024
+# Под срок запроса батч можно укрупнить до этого размера (меньше вызовов generate);
+# бюджет 5 самых длинных вопросов ещё укладывается в QUESTION_MAX_NEW_TOKENS
+DEADLINE_MAX_BATCH_SIZE = 5
+
+
+def plan_question_types(question_count: int, rng: random.Random = None) -> List[str]:
+    """
+    Distribution: prefer MCQ and INPUT (cheaper), some MATCH and SEQUENCE
+    :param rng: генератор случайных чисел запроса (generator.rng); глобальный random не трогается
+    """
+    import math
+
+    n_match = max(1, int(question_count * 0.10))
+    n_seq = max(1, int(question_count * 0.10))
+    remainder = question_count - (n_match + n_seq)
+    n_mcq = math.ceil(remainder * 0.5)
+    n_input = remainder - n_mcq
+
+    types_pool = []
+    types_pool.extend(["match"] * n_match)
+    types_pool.extend(["sequence"] * n_seq)
+    types_pool.extend(["mcq"] * n_mcq)
+    types_pool.extend(["input"] * n_input)
+
+    # Prefer MCQ/Input earlier, add randomness
+    (rng or random).shuffle(types_pool)
+    types_pool.sort(key=lambda t: 0 if t in ("mcq", "input") else 1)
+    return types_pool[:question_count]
+
+
+QUESTION_SYSTEM_PROMPT = "Вы - точный генератор вопросов, возвращающий только JSON."
+
+# Static part of every batch prompt: it goes first so its KV cache can be shared
+# by all batches and retries; only the task, facts and template follow it.
+QUESTION_PROMPT_PREFIX = f"""Вы - строгий генератор вопросов. Изучите ПРИМЕР ниже, затем сгенерируйте вопросы для ЦЕЛЕВЫХ ФАКТОВ.
+
+=== ПРИМЕР (только для справки) ===
+ПРИМЕРНЫЕ ФАКТЫ:
+{QUESTION_EXAMPLE_FACTS}
+
+ПРИМЕРНЫЙ ВЫВОД:
+{QUESTION_EXAMPLE_OUTPUT}
+
+КРИТИЧЕСКИЕ ПРАВИЛА:
+1) Используйте ТОЛЬКО информацию из ЦЕЛЕВЫХ ФАКТОВ. Никаких внешних знаний.
+2) Для INPUT: ответ должен быть 1-3 СЛОВА из фактов (термин, имя или концепция). Никогда не предложение. Удалите пунктуацию.
+3) Для MCQ: ВСЕ 3 ВАРИАНТА ДОЛЖНЫ БЫТЬ РАЗНЫМИ. Если вы не можете создать 3 различных правдоподобных варианта, пропустите этот тип вопроса. Каждый вариант максимум 10 слов.
+4) Для MATCH: создавайте различные пары термин-определение. Каждый вариант справа должен быть ПОЛНОЙ фразой/предложением, описывающим ОДНУ конкретную вещь.
+5) Для SEQUENCE: используйте только если в фактах есть четкий хронологический порядок.
+6) question_text ВСЕГДА должен быть заполнен (никогда не пустым).
+7) Ответы используют индексацию с 0.
+8) НЕ обрывайте варианты посередине предложения. Пишите полные фразы.
+
+ХОРОШИЕ и ПЛОХИЕ ПРИМЕРЫ:
+
+MCQ - ПЛОХО:
+"Что такое фотосинтез?"
+Варианты: ["Процесс с использованием солнечного света", "Процесс с использованием лунного света", "Процесс, превращающий растения в камни"]
+Проблема: Вариант 3 абсурден и нереалистичен
+
+MCQ - ХОРОШО:
+"Что такое фотосинтез?"
+Варианты: ["Процесс, преобразующий световую энергию в химическую энергию", "Процесс, преобразующий химическую энергию в световую энергию", "Процесс, хранящий воду в клетках растений"]
+Почему: Все варианты - правдоподобные биологические процессы
+
+MATCH - ПЛОХО:
+Question_options: ["Термин А", "Термин Б"]
+Options: ["Что-то неясное", "Другая неясная вещь"]
+Проблема: Неясные соответствия
+
+MATCH - ХОРОШО:
+Question_options: ["Хлорофилл", "Глюкоза"]
+Options: ["Пигмент, улавливающий солнечный свет", "Сахар, производимый фотосинтезом"]
+Почему: Четкие пары термин-определение из фактов
+
+SEQUENCE - ПЛОХО:
+Использование фактов, которые происходят одновременно или не имеют четкого порядка
+Проблема: Навязывает искусственную последовательность
+
+SEQUENCE - ХОРОШО:
+Использование фактов с явными временными маркерами, такими как "сначала", "затем", "после" или логическим прогрессом
+Почему: Естественный порядок существует в исходном материале
+
+ПРАВИЛА ВЫВОДА:
+- Возвращайте ТОЛЬКО валидный JSON, без объяснений, без markdown, без преамбулы
+- Не выдумывайте факты, термины или различия, не присутствующие в источнике
+- Делайте вопросы сложными, но справедливыми
+- Убедитесь, что все варианты четко различны и правдоподобны
+
+"""
 
 
 class MockGenerator:
+    model_id = "mock"
+    facts_prompt_version = FACTS_PROMPT_VERSION
+
     def __init__(self, delay: float = 2.0):
         self.delay = delay
+        self.rng = random.Random()
+        self.cancel_token = None
+        self.deadline = None
+        self.truncated = False
+        self.facts_truncated = False
+
+    def _check_cancelled(self):
+        if self.cancel_token is not None:
+            self.cancel_token.raise_if_cancelled()
 
     def extract_facts(self, text: str) -> str:
         time.sleep(self.delay * 0.5)  # Shorter delay for facts
+        self._check_cancelled()
 
         # Extract some real sentences from the text for realism
         sentences = [s.strip() for s in text.split('.') if s.strip()]
@@ -19,9 +175,26 @@ class MockGenerator:
 
         return "\n".join(f"- {fact}" for fact in facts if fact)
 
+    def iter_facts(self, text: str):
+        # Мок извлекает всё одной группой
+        yield 0, 1, self.extract_facts(text).splitlines()
+
+    def generate_questions_streaming(self, fact_groups, test_set_name: str = "Test 1",
+                                     question_count: int = 10, cache=None, on_batch=None,
+                                     on_facts=None, types: List[str] = None) -> List[Dict]:
+        lines = []
+        for group_index, total_groups, facts in fact_groups:
+            lines.extend(facts)
+            if on_facts is not None:
+                on_facts(group_index, total_groups, facts)
+        return self.generate_questions("\n".join(lines), test_set_name, question_count, cache, on_batch, types)
+
     def generate_questions(self, facts: str, test_set_name: str = "Test 1",
-                          question_count: int = 10) -> List[Dict]:
+                          question_count: int = 10, cache=None, on_batch=None,
+                          types: List[str] = None) -> List[Dict]:
+        # cache не используется: мок не обращается к модели
         time.sleep(self.delay)  # Simulate generation time
+        self._check_cancelled()
 
         words = facts.split()
         sample_words = [w.strip('.,;:!?-') for w in words if len(w) > 3][:20]
@@ -35,8 +208,10 @@ class MockGenerator:
             ["match"] * int(question_count * 0.1) +
             ["sequence"] * int(question_count * 0.1)
         )
-        random.shuffle(types_pool)
+        self.rng.shuffle(types_pool)
         types_pool = types_pool[:question_count]
+        if types:
+            types_pool = list(types)
 
         for i, qtype in enumerate(types_pool, 1):
             if qtype == "mcq":
@@ -48,6 +223,10 @@ class MockGenerator:
             elif qtype == "sequence":
                 questions.append(self._mock_sequence(i, test_set_name, sample_words))
 
+        # Мок генерирует всё одним "батчем"
+        if on_batch is not None:
+            on_batch(0, 1, questions)
+
         return questions
 
     def _mock_mcq(self, num: int, test_name: str, words: List[str]) -> Dict:
@@ -84,7 +263,7 @@ class MockGenerator:
         selected = words[:3] if len(words) >= 3 else words + ["Термин"]
 
         shuffled_indices = [0, 1, 2]
-        random.shuffle(shuffled_indices)
+        self.rng.shuffle(shuffled_indices)
 
         return {
             "test_set": test_name,
@@ -124,44 +303,157 @@ class MockGenerator:
 
 
 class RealGenerator:
-
-    def __init__(self, model_path: str = None, batch_size: int = 3, max_retries: int = 3, temperature: float = 0.15):
+    facts_prompt_version = FACTS_PROMPT_VERSION
+
+    def __init__(self, model_path: str = None, batch_size: int = 3, max_retries: int = 3, temperature: float = 0.15,
+                 batched: bool = False, max_parallel_batches: int = None, use_prefix_cache: bool = False,
+                 seed: int = None, fact_chunk_tokens: int = 1500, fact_chunk_batch_size: int = 4,
+                 use_scheduler: bool = False, scheduler_max_batch_size: int = 16,
+                 constrained_decoding: bool = False, facts_per_batch: int = None,
+                 backend: str = None, backend_options: Dict = None, draft_model_path: str = None):
         self.model_path = model_path
+        # Бэкенд инференса (app.llm.backends): transformers-gpu, transformers-cpu, onnxruntime
+        self.backend = backend
+        # Квантизация бэкенда влияет на вывод, поэтому небазовый бэкенд входит в ключ кэша батчей
+        self.model_id = model_path if backend in (None, DEFAULT_BACKEND) else f"{model_path}@{backend}"
+        self.backend_options = backend_options or {}
+        # Маленькая черновая модель для speculative decoding (assisted generation)
+        self.draft_model_path = draft_model_path
+        self.speculative_stats = SpeculativeStats()
+        self._draft = None
+        # CancellationToken текущего запроса (генератор создаётся на запрос)
+        self.cancel_token = None
+        # Deadline текущего запроса: размер батча и число повторов подбираются под срок,
+        # а вызовы generate, не успевающие к сроку, не запускаются (truncated = True)
+        self.deadline = None
+        self.truncated = False
+        # Извлечение фактов остановлено по сроку: факты неполные и не кэшируются
+        self.facts_truncated = False
+        # Замеры длительности вызовов generate этой модели (общие для всех запросов процесса);
+        # группы извлечения фактов (длинные промпты) замеряются отдельно
+        self.latency = get_latency_estimator(self.model_id)
+        self.facts_latency = get_latency_estimator(f"{self.model_id}:facts")
+        # Бюджет токенов исходного текста на один фрагмент при извлечении фактов
+        self.fact_chunk_tokens = fact_chunk_tokens
+        # Сколько фрагментов извлекается одним padded-вызовом generate
+        self.fact_chunk_batch_size = fact_chunk_batch_size
+        # Разбиение на фрагменты влияет на результат, поэтому входит в ключ кэша фактов
+        self.facts_prompt_version = f"{FACTS_PROMPT_VERSION}-c{fact_chunk_tokens}"
         self.batch_size = batch_size
         self.max_retries = max_retries
+        # Попыток на вопрос в текущем запросе (меньше max_retries, если не укладываемся в срок)
+        self._retry_limit = max_retries
         self.temperature = temperature
+        # Фиксированный seed делает генерацию воспроизводимой (и входит в ключ кэша батчей)
+        self.seed = seed
+        # Случайность запроса (план типов, перемешивание MATCH) - свой random.Random на прогон:
+        # random.seed() в потоке запроса сбивал бы перемешивания параллельных запросов
+        self.rng = random.Random(seed)
+        # batched: все батчи (и их повторы) одним padded-вызовом model.generate
+        self.batched = batched
+        # Ограничение числа батчей в одном вызове (None - без ограничения)
+        self.max_parallel_batches = max_parallel_batches
+        # Переиспользовать KV-кэш статического префикса промпта вопросов
+        self.use_prefix_cache = use_prefix_cache
+        # Отправлять промпты в общий планировщик continuous batching модели
+        # вместо собственного вызова model.generate
+        self.use_scheduler = use_scheduler
+        self.scheduler_max_batch_size = scheduler_max_batch_size
+        # Декодирование вопросов, ограниченное JSON-шаблоном батча (невалидный JSON невозможен)
+        self.constrained_decoding = constrained_decoding
+        # Сколько фактов получает промпт одного батча (None - все факты в каждом батче)
+        self.facts_per_batch = facts_per_batch
+        # Счётчики попыток последнего generate_questions
+        self.batch_stats = self._empty_batch_stats()
         self.model = None
         self.tokenizer = None
+        self._loaded = None
         self._model_loaded = False
 
     def _load_model(self):
-        """Lazy load model and tokenizer"""
+        """Lazy load model and tokenizer from the process-wide registry"""
         if self._model_loaded:
             return
 
         if not self.model_path:
             raise ValueError("MODEL_PATH not configured for RealGenerator")
 
-        print(f"Загрузка модели из {self.model_path}...")
+        self._loaded = model_registry.get(self.model_path, self.backend, self.backend_options)
+        self.model = self._loaded.model
+        self.tokenizer = self._loaded.tokenizer
 
-        # Import here to avoid loading dependencies in dev mode
-        import torch
-        from transformers import AutoTokenizer, AutoModelForCausalLM
-        import os
-
-        # Set memory optimization
-        os.environ['PYTORCH_CUDA_ALLOC_CONF'] = 'expandable_segments:True'
-
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_path)
-        self.model = AutoModelForCausalLM.from_pretrained(
-            self.model_path,
-            device_map="auto",
-            load_in_4bit=True,
-            torch_dtype=torch.float16
-        )
+        if not self._loaded.backend.supports_kv_reuse and (self.use_prefix_cache or self.use_scheduler):
+            print(f"Бэкенд {self._loaded.backend.name} не поддерживает KV-кэш префикса и планировщик; отключены")
+            self.use_prefix_cache = False
+            self.use_scheduler = False
 
+        if self.draft_model_path:
+            if self.use_scheduler or not self._loaded.backend.supports_kv_reuse:
+                print("Speculative decoding недоступен с планировщиком и этим бэкендом; черновая модель не используется")
+            else:
+                self._draft = model_registry.get(self.draft_model_path, self.backend, self.backend_options)
         self._model_loaded = True
-        print("Модель успешно загружена!")
+
+    def _question_prefix_text(self) -> str:
+        """Rendered chat-template text up to the end of the static question prompt prefix"""
+        marker = "<<<SUFFIX>>>"
+        messages = [
+            {"role": "system", "content": QUESTION_SYSTEM_PROMPT},
+            {"role": "user", "content": QUESTION_PROMPT_PREFIX + marker}
+        ]
+        rendered = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        return rendered[:rendered.index(marker)]
+
+    @staticmethod
+    def _empty_batch_stats() -> Dict:
+        return {"batches": 0, "attempts": 0, "parse_failures": 0, "validation_failures": 0,
+                "questions": 0, "questions_requested": 0, "questions_failed": 0}
+
+    def _record_attempt(self, parsed, requested: int, failed: int):
+        """Одна попытка = одно декодирование (батча или его недостающей части)"""
+        self.batch_stats["attempts"] += 1
+        self.batch_stats["questions_requested"] += requested
+        self.batch_stats["questions_failed"] += failed
+        if parsed is None:
+            self.batch_stats["parse_failures"] += 1
+        elif failed:
+            self.batch_stats["validation_failures"] += 1
+
+    def retry_stats(self) -> Dict:
+        """Доля неудачных попыток и число перегенерированных вопросов"""
+        stats = dict(self.batch_stats)
+        attempts = stats["attempts"]
+        stats["retries"] = max(0, attempts - stats["batches"])
+        stats["retry_rate"] = round((stats["parse_failures"] + stats["validation_failures"]) / attempts, 3) if attempts else 0.0
+        stats["parse_failure_rate"] = round(stats["parse_failures"] / attempts, 3) if attempts else 0.0
+        stats["questions_regenerated"] = max(0, stats["questions_requested"] - stats["questions"])
+        return stats
+
+    def _eos_token_ids(self) -> List[int]:
+        eos = getattr(getattr(self.model, "generation_config", None), "eos_token_id", None)
+        if eos is None:
+            eos = self.tokenizer.eos_token_id
+        if isinstance(eos, int):
+            eos = [eos]
+        return list(eos or [])
+
+    def _check_cancelled(self):
+        if self.cancel_token is not None:
+            self.cancel_token.raise_if_cancelled()
+
+    def _stopping_criteria(self, stop_scanner, batch_size: int, prompt_len: int):
+        from transformers import StoppingCriteriaList
+
+        stopping_criteria = StoppingCriteriaList()
+        if stop_scanner:
+            stopping_criteria.append(ScannerStoppingCriteria(self.tokenizer, stop_scanner, batch_size, prompt_len))
+        if self.cancel_token is not None:
+            stopping_criteria.append(CancellationStoppingCriteria(self.cancel_token))
+        return stopping_criteria
+
+    def _json_constraint(self, templates: List[List[Dict]], prompt_len: int):
+        from app.llm.constrained import JsonTemplateLogitsProcessor
+        return JsonTemplateLogitsProcessor(self.tokenizer, templates, prompt_len, self._eos_token_ids())
 
     def _clear_cuda(self):
         """Clear CUDA memory and run garbage collection"""
@@ -176,7 +468,10 @@ class RealGenerator:
         """Extract and parse JSON array from text with error recovery"""
         cleaned = re.sub(r'```json\s*|\s*```', '', text).strip()
         start = cleaned.find('[')
-        end = cleaned.rfind(']') + 1
+        scanner = JsonArrayScanner()
+        scanner.feed(cleaned)
+        # Closed top-level array: ignore anything the model added after it
+        end = scanner.end if scanner.end is not None else cleaned.rfind(']') + 1
         if start == -1 or end <= start:
             return None
         candidate = cleaned[start:end]
@@ -221,8 +516,7 @@ class RealGenerator:
         Shuffle MATCH-type options and remap answer indices.
         Avoids asking LLM to randomize (more reliable).
         """
-        if seed is not None:
-            random.seed(seed)
+        rng = random.Random(seed) if seed is not None else self.rng
 
         output = []
         for q in questions_json:
@@ -236,7 +530,7 @@ class RealGenerator:
                 right = right[:n]
 
                 indices = list(range(n))
-                random.shuffle(indices)
+                rng.shuffle(indices)
                 shuffled_right = [right[i] for i in indices]
 
                 # Remap answers to new positions
@@ -252,14 +546,8 @@ class RealGenerator:
             output.append(q_copy)
         return output
 
-    def extract_facts(self, text: str) -> str:
-        """Extract factual statements from text"""
-        try:
-            self._load_model()
-
-            import torch
-
-            prompt = f"""Извлеките ТОЛЬКО фактические утверждения, явно присутствующие в ТЕКСТЕ ниже.
+    def _build_facts_messages(self, text: str) -> List[Dict]:
+        prompt = f"""Извлеките ТОЛЬКО фактические утверждения, явно присутствующие в ТЕКСТЕ ниже.
 НЕ добавляйте интерпретации, мнения или внешние знания.
 Перепишите факты в виде коротких, четких пунктов (один факт на строку).
 Избегайте избыточности. Если факт не указан явно в тексте, НЕ включайте его.
@@ -270,54 +558,278 @@ class RealGenerator:
 
 ФАКТЫ:
 """
-            messages = [
-                {"role": "system", "content": "Вы - точный ассистент по извлечению фактов. Извлекайте только явные факты."},
-                {"role": "user", "content": prompt}
+        return [
+            {"role": "system", "content": "Вы - точный ассистент по извлечению фактов. Извлекайте только явные факты."},
+            {"role": "user", "content": prompt}
+        ]
+
+    def _split_sentences(self, text: str) -> List[str]:
+        """Split text on sentence boundaries and line breaks"""
+        sentences = []
+        for paragraph in text.splitlines():
+            parts = re.split(r'(?<=[.!?…])\s+', paragraph.strip())
+            sentences.extend(part for part in parts if part)
+        return sentences
+
+    def _chunk_text(self, text: str, max_tokens: int) -> List[str]:
+        """
+        Greedily pack whole sentences into chunks of at most max_tokens tokens.
+        A single sentence longer than the budget is split by tokens.
+        """
+        sentences = self._split_sentences(text)
+        if not sentences:
+            return []
+
+        token_ids = self.tokenizer(sentences, add_special_tokens=False)["input_ids"]
+
+        chunks = []
+        current = []
+        current_tokens = 0
+        for sentence, ids in zip(sentences, token_ids):
+            if len(ids) > max_tokens:
+                if current:
+                    chunks.append(" ".join(current))
+                    current, current_tokens = [], 0
+                for start in range(0, len(ids), max_tokens):
+                    chunks.append(self.tokenizer.decode(ids[start:start + max_tokens]))
+                continue
+
+            if current and current_tokens + len(ids) > max_tokens:
+                chunks.append(" ".join(current))
+                current, current_tokens = [], 0
+            current.append(sentence)
+            current_tokens += len(ids)
+
+        if current:
+            chunks.append(" ".join(current))
+        return chunks
+
+    def _parse_facts_output(self, raw: str) -> List[str]:
+        """Post-process: cut off text after the list, normalize bullet lines"""
+        scanner = FactsListScanner()
+        scanner.feed(raw)
+        if scanner.end is not None:
+            raw = raw[:scanner.end]
+        cleaned = re.sub(r'^\s*\-+\s*$', '', raw, flags=re.MULTILINE).strip()
+        return [line.strip(" -\t\n\r") for line in cleaned.splitlines() if line.strip()]
+
+    def _merge_facts(self, fact_lists: List[List[str]], seen: set = None) -> List[str]:
+        """
+        Deduplicate facts from all chunks while preserving order
+        :param seen: ключи уже выданных фактов (пополняется); для слияния по мере поступления
+        """
+        seen = set() if seen is None else seen
+        facts = []
+        for lines in fact_lists:
+            for line in lines:
+                key = re.sub(r'\s+', ' ', line).strip(' .;').lower()
+                if key and key not in seen:
+                    seen.add(key)
+                    facts.append(line)
+        return facts
+
+    def iter_facts(self, text: str):
+        """
+        Extract facts chunk group by chunk group (one padded generate call per group).
+        With a deadline, extraction stops before a group that would leave no time for a question batch
+        (facts_truncated = True); the groups extracted so far stand.
+        :return: итератор (group_index, total_groups, facts): новые факты группы без дублей с предыдущими
+        """
+        self._load_model()
+        self.facts_truncated = False
+
+        chunks = self._chunk_text(text, self.fact_chunk_tokens) or [text]
+        if len(chunks) > 1:
+            print(f"Извлечение фактов: {len(chunks)} фрагмент(ов) по <= {self.fact_chunk_tokens} токенов")
+
+        seen = set()
+        starts = range(0, len(chunks), self.fact_chunk_batch_size)
+        for group_index, start in enumerate(starts):
+            self._check_cancelled()
+            if not self._fits_facts_deadline(group_index):
+                print(f"Срок запроса: извлечено {group_index} из {len(starts)} групп фактов, "
+                      f"остаток материала пропущен")
+                self.facts_truncated = True
+                return
+            group = chunks[start:start + self.fact_chunk_batch_size]
+            started = time.perf_counter()
+            raws = self._generate_texts(
+                [self._build_facts_messages(chunk) for chunk in group],
+                max_new_tokens=FACTS_MAX_NEW_TOKENS,
+                top_p=0.95,
+                stop_scanner=FactsListScanner
+            )
+            self.facts_latency.observe(FACTS_MAX_NEW_TOKENS, time.perf_counter() - started)
+            yield group_index, len(starts), self._merge_facts([self._parse_facts_output(raw) for raw in raws], seen)
+
+    def extract_facts(self, text: str) -> str:
+        """
+        Extract factual statements from text.
+        Long texts are split into sentence-aligned chunks within fact_chunk_tokens;
+        chunks are extracted in padded batches and the results merged (map-reduce).
+        """
+        try:
+            facts = []
+            for _, _, group_facts in self.iter_facts(text):
+                facts.extend(group_facts)
+            return "\n".join(facts)
+
+        except GenerationCancelled:
+            raise
+        except Exception as e:
+            raise RuntimeError(f"Ошибка извлечения фактов: {str(e)}")
+
+    def _generate_texts(self, messages_list: List[List[Dict]], max_new_tokens: int, top_p: float,
+                        use_prefix_cache: bool = False, json_templates: List[List[Dict]] = None,
+                        stop_scanner=None) -> List[str]:
+        """
+        Run one model.generate call for several chat prompts.
+        Prompts are left-padded into a single tensor so the batch decodes together.
+        With use_prefix_cache the shared question prompt prefix is taken from the KV cache.
+        With use_scheduler the prompts join the model's shared continuous-batching loop instead,
+        together with prompts of all other in-flight requests.
+        With json_templates (one per prompt) decoding is constrained to the template's JSON.
+        With stop_scanner (JsonArrayScanner/FactsListScanner) each row stops as soon as
+        its decoded text is complete instead of running to max_new_tokens.
+        With a draft model the prompts go through speculative decoding one by one.
+        A cancelled cancel_token stops decoding at the next token and raises GenerationCancelled.
+        """
+        import torch
+        from transformers import LogitsProcessorList
+
+        self._check_cancelled()
+
+        texts = [
+            self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+            for messages in messages_list
+        ]
+
+        if self.use_scheduler:
+            scheduler = self._loaded.get_scheduler(self.scheduler_max_batch_size)
+            futures = [
+                scheduler.submit(
+                    text,
+                    max_new_tokens=max_new_tokens,
+                    temperature=self.temperature,
+                    top_p=top_p,
+                    # Планировщик передаёт процессору только сгенерированные токены
+                    logits_processor=self._json_constraint([json_templates[i]], 0) if json_templates else None,
+                    stop_fn=ScannerStopFn(self.tokenizer, stop_scanner) if stop_scanner else None,
+                    cancel_token=self.cancel_token
+                )
+                for i, text in enumerate(texts)
             ]
+            raws = [future.result() for future in futures]
+            self._check_cancelled()
+            return raws
+
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        # Decoder-only models must be padded on the left for batched generation
+        self.tokenizer.padding_side = "left"
+
+        if self._draft is not None:
+            return self._generate_assisted(texts, max_new_tokens, top_p, json_templates, stop_scanner)
+
+        inputs = None
+        if use_prefix_cache:
+            prefix_cache = self._loaded.get_prefix_cache(self._question_prefix_text())
+            inputs = prefix_cache.prepare_inputs(self.tokenizer, texts)
+        if inputs is None:
+            inputs = self.tokenizer(texts, return_tensors="pt", padding=True).to(self.model.device)
+
+        logits_processor = LogitsProcessorList()
+        if json_templates:
+            logits_processor.append(self._json_constraint(json_templates, inputs['input_ids'].shape[1]))
+        stopping_criteria = self._stopping_criteria(stop_scanner, len(texts), inputs['input_ids'].shape[1])
+
+        started = time.perf_counter()
+        with torch.no_grad():
+            outputs = self.model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                temperature=self.temperature,
+                do_sample=True if self.temperature > 0 else False,
+                top_p=top_p,
+                pad_token_id=self.tokenizer.pad_token_id,
+                logits_processor=logits_processor,
+                stopping_criteria=stopping_criteria
+            )
 
-            text_input = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-            inputs = self.tokenizer(text_input, return_tensors="pt").to(self.model.device)
+        prompt_len = inputs['input_ids'].shape[1]
+        new_tokens = int((outputs[:, prompt_len:] != self.tokenizer.pad_token_id).sum())
+        self._loaded.throughput.record(new_tokens, time.perf_counter() - started)
+        raws = [
+            self.tokenizer.decode(output[prompt_len:], skip_special_tokens=True)
+            for output in outputs
+        ]
+        del outputs, inputs
+        self._clear_cuda()
+        self._check_cancelled()
+        return raws
 
-            with torch.no_grad():
+    def _generate_assisted(self, texts: List[str], max_new_tokens: int, top_p: float,
+                           json_templates: List[List[Dict]] = None, stop_scanner=None) -> List[str]:
+        """
+        Speculative decoding: the draft model proposes tokens and the main model verifies
+        them in a single forward pass. Assisted generation in transformers takes one sequence
+        at a time, so prompts are decoded sequentially; the prefix KV cache is not used here.
+        """
+        import torch
+        from transformers import LogitsProcessorList
+
+        assistant_kwargs = {}
+        if len(self._draft.tokenizer) != len(self.tokenizer):
+            # Разные словари: universal assisted decoding с перекодированием через текст
+            assistant_kwargs = {"tokenizer": self.tokenizer, "assistant_tokenizer": self._draft.tokenizer}
+
+        raws = []
+        for i, text in enumerate(texts):
+            self._check_cancelled()
+            inputs = self.tokenizer([text], return_tensors="pt").to(self.model.device)
+            prompt_len = inputs['input_ids'].shape[1]
+
+            logits_processor = LogitsProcessorList()
+            if json_templates:
+                logits_processor.append(self._json_constraint([json_templates[i]], prompt_len))
+            stopping_criteria = self._stopping_criteria(stop_scanner, 1, prompt_len)
+
+            started = time.perf_counter()
+            with ForwardCounter(self.model, self._draft.model) as counter, torch.no_grad():
                 outputs = self.model.generate(
                     **inputs,
-                    max_new_tokens=1024,
+                    assistant_model=self._draft.model,
+                    max_new_tokens=max_new_tokens,
                     temperature=self.temperature,
                     do_sample=True if self.temperature > 0 else False,
-                    top_p=0.95
+                    top_p=top_p,
+                    pad_token_id=self.tokenizer.pad_token_id,
+                    logits_processor=logits_processor,
+                    stopping_criteria=stopping_criteria,
+                    **assistant_kwargs
                 )
+            elapsed = time.perf_counter() - started
 
-            raw = self.tokenizer.decode(outputs[0][inputs['input_ids'].shape[1]:], skip_special_tokens=True)
+            new_tokens = outputs.shape[1] - prompt_len
+            self.speculative_stats.record(new_tokens, counter, elapsed)
+            self._loaded.speculative.record(new_tokens, counter, elapsed)
+            self._loaded.throughput.record(new_tokens, elapsed)
+            raws.append(self.tokenizer.decode(outputs[0][prompt_len:], skip_special_tokens=True))
             del outputs, inputs
-            self._clear_cuda()
-
-            # Post-process: normalize and deduplicate
-            cleaned = re.sub(r'^\s*\-+\s*$', '', raw, flags=re.MULTILINE).strip()
-            lines = [line.strip(" -\t\n\r") for line in cleaned.splitlines() if line.strip()]
-
-            # Deduplicate while preserving order
-            seen = set()
-            facts = []
-            for L in lines:
-                if L not in seen:
-                    seen.add(L)
-                    facts.append(L)
-
-            return "\n".join(facts)
 
-        except Exception as e:
-            raise RuntimeError(f"Ошибка извлечения фактов: {str(e)}")
-
-    def _generate_batch_via_model(self, facts: str, types_to_generate: List[str],
-                                   start_index: int, test_set_name: str):
-        """Generate a batch of questions of specified types"""
-        import torch
-        import math
+        self._clear_cuda()
+        self._check_cancelled()
+        return raws
 
-        # Build dynamic template
+    def _build_question_template(self, types_to_generate: List[str], start_index: int,
+                                 test_set_name: str, numbers: List[int] = None) -> List[Dict]:
+        """
+        Per-type JSON shapes of a batch; used in the prompt and as the decoding constraint
+        :param numbers: номера вопросов, если они не идут подряд от start_index (повтор части батча)
+        """
         template = []
         for i, qtype in enumerate(types_to_generate):
-            idx = start_index + i
+            idx = numbers[i] if numbers else start_index + i
             base = {
                 "test_set": test_set_name,
                 "question_number": idx,
@@ -337,272 +849,606 @@ class RealGenerator:
                 base["options"] = ["", "", ""]
                 base["answers"] = [0, 1, 2]
             template.append(base)
+        return template
+
+    def _question_token_budget(self, types_to_generate: List[str]) -> int:
+        """max_new_tokens for a batch, derived from the number and types of its questions"""
+        budget = QUESTION_BATCH_OVERHEAD_TOKENS + sum(
+            QUESTION_TOKEN_BUDGET.get(qtype, max(QUESTION_TOKEN_BUDGET.values())) for qtype in types_to_generate
+        )
+        return min(budget, QUESTION_MAX_NEW_TOKENS)
+
+    def _build_batch_messages(self, facts: str, types_to_generate: List[str],
+                              start_index: int, test_set_name: str, numbers: List[int] = None) -> List[Dict]:
+        """Build chat messages asking for a batch of questions of specified types"""
+        template = self._build_question_template(types_to_generate, start_index, test_set_name, numbers)
         template_str = json.dumps(template, indent=2, ensure_ascii=False)
 
-        # Create examples based on a completely different domain
-        example_facts = """Фотосинтез преобразует световую энергию в химическую энергию.
-Хлорофилл - это пигмент, который улавливает солнечный свет.
-Углекислый газ и вода являются сырьем.
-Глюкоза и кислород - это продукты.
-Процесс происходит в хлоропластах."""
+        prompt = QUESTION_PROMPT_PREFIX + f"""=== ВАША ЗАДАЧА ===
+Сгенерируйте ровно {len(types_to_generate)} вопросов в таком порядке: {', '.join(types_to_generate)}
 
-        example_output = """[
-  {
-    "test_set": "Пример",
-    "question_number": 1,
-    "question_type": "mcq",
-    "question_text": "Что преобразует фотосинтез?",
-    "options": ["световую энергию в химическую энергию", "химическую энергию в световую энергию", "воду в кислород"],
-    "answers": [0]
-  },
-  {
-    "test_set": "Пример",
-    "question_number": 2,
-    "question_type": "input",
-    "question_text": "Какой пигмент улавливает солнечный свет в растениях?",
-    "answer": "Хлорофилл"
-  },
-  {
-    "test_set": "Пример",
-    "question_number": 3,
-    "question_type": "match",
-    "question_text": "Сопоставьте каждый термин с его ролью в фотосинтезе:",
-    "question_options": ["Углекислый газ", "Глюкоза", "Хлоропласты"],
-    "options": ["Сырье, используемое в процессе", "Продукт процесса", "Место, где происходит процесс"],
-    "answers": [[0,0],[1,1],[2,2]]
-  }
-]"""
+ЦЕЛЕВЫЕ ФАКТЫ:
+{facts}
 
-        prompt = f"""Вы - строгий генератор вопросов. Изучите ПРИМЕР ниже, затем сгенерируйте вопросы для ЦЕЛЕВЫХ ФАКТОВ.
+ШАБЛОН:
+{template_str}
 
-=== ПРИМЕР (только для справки) ===
-ПРИМЕРНЫЕ ФАКТЫ:
-{example_facts}
+Верните ТОЛЬКО JSON массив. Без комментариев.
+"""
+        return [
+            {"role": "system", "content": QUESTION_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
 
-ПРИМЕРНЫЙ ВЫВОД:
-{example_output}
+    def _parse_batch_output(self, raw: str, test_set_name: str):
+        parsed = self._extract_json_array_from_text(raw)
+        if parsed is None:
+            return None
 
-=== ВАША ЗАДАЧА ===
-Сгенерируйте ровно {len(types_to_generate)} вопросов в таком порядке: {', '.join(types_to_generate)}
+        parsed = self._ensure_test_set_name(parsed, test_set_name)
+        return parsed
 
-ЦЕЛЕВЫЕ ФАКТЫ:
-{facts}
+    def _generate_batch_via_model(self, facts: str, types_to_generate: List[str],
+                                   start_index: int, test_set_name: str, numbers: List[int] = None):
+        """Generate a batch of questions of specified types"""
+        messages = self._build_batch_messages(facts, types_to_generate, start_index, test_set_name, numbers)
+        json_templates = None
+        if self.constrained_decoding:
+            json_templates = [self._build_question_template(types_to_generate, start_index, test_set_name, numbers)]
+        max_new_tokens = self._question_token_budget(types_to_generate)
+        started = time.perf_counter()
+        raw = self._generate_texts([messages], max_new_tokens=max_new_tokens,
+                                   top_p=0.9, use_prefix_cache=self.use_prefix_cache,
+                                   json_templates=json_templates, stop_scanner=JsonArrayScanner)[0]
+        self.latency.observe(max_new_tokens, time.perf_counter() - started)
+        return self._parse_batch_output(raw, test_set_name)
+
+    def _generate_batches_via_model(self, facts: str, batches: List[Dict], test_set_name: str):
+        """
+        Generate several batches in a single padded model.generate call.
+        :param batches: список {"types": [...], "start_index": N, "numbers": [...], "facts": str}
+            (numbers и facts необязательны; без facts используются общие факты)
+        :return: распарсенный JSON (или None) для каждого батча, в том же порядке
+        """
+        messages_list = [
+            self._build_batch_messages(batch.get("facts") or facts, batch["types"], batch["start_index"],
+                                       test_set_name, batch.get("numbers"))
+            for batch in batches
+        ]
+        json_templates = None
+        if self.constrained_decoding:
+            json_templates = [
+                self._build_question_template(batch["types"], batch["start_index"], test_set_name,
+                                              batch.get("numbers"))
+                for batch in batches
+            ]
+        # One padded call shares max_new_tokens; rows that finish early stop via the scanner
+        max_new_tokens = max(self._question_token_budget(batch["types"]) for batch in batches)
+        started = time.perf_counter()
+        raws = self._generate_texts(messages_list, max_new_tokens=max_new_tokens, top_p=0.9,
+                                    use_prefix_cache=self.use_prefix_cache,
+                                    json_templates=json_templates, stop_scanner=JsonArrayScanner)
+        self.latency.observe(max_new_tokens, time.perf_counter() - started)
+        return [self._parse_batch_output(raw, test_set_name) for raw in raws]
+
+    def _plan_question_types(self, question_count: int) -> List[str]:
+        return plan_question_types(question_count, self.rng)
+
+    def _split_batches(self, types_pool: List[str], batch_size: int) -> List[Dict]:
+        return [
+            {"types": types_pool[start:start + batch_size], "start_index": start + 1}
+            for start in range(0, len(types_pool), batch_size)
+        ]
 
-КРИТИЧЕСКИЕ ПРАВИЛА:
-1) Используйте ТОЛЬКО информацию из ЦЕЛЕВЫХ ФАКТОВ. Никаких внешних знаний.
-2) Для INPUT: ответ должен быть 1-3 СЛОВА из фактов (термин, имя или концепция). Никогда не предложение. Удалите пунктуацию.
-3) Для MCQ: ВСЕ 3 ВАРИАНТА ДОЛЖНЫ БЫТЬ РАЗНЫМИ. Если вы не можете создать 3 различных правдоподобных варианта, пропустите этот тип вопроса. Каждый вариант максимум 10 слов.
-4) Для MATCH: создавайте различные пары термин-определение. Каждый вариант справа должен быть ПОЛНОЙ фразой/предложением, описывающим ОДНУ конкретную вещь.
-5) Для SEQUENCE: используйте только если в фактах есть четкий хронологический порядок.
-6) question_text ВСЕГДА должен быть заполнен (никогда не пустым).
-7) Ответы используют индексацию с 0.
-8) НЕ обрывайте варианты посередине предложения. Пишите полные фразы.
+    def _call_cost(self, types_list: List[List[str]]) -> float:
+        """Estimated seconds of one generate call decoding these batches (padded to the longest budget)"""
+        return self.latency.estimate(max(self._question_token_budget(types) for types in types_list))
 
-ХОРОШИЕ и ПЛОХИЕ ПРИМЕРЫ:
+    def _first_pass_cost(self, batches: List[Dict]) -> float:
+        """Estimated seconds to decode every batch once"""
+        if self.batched:
+            step = self.max_parallel_batches or len(batches)
+            groups = [batches[start:start + step] for start in range(0, len(batches), step)]
+        else:
+            groups = [[batch] for batch in batches]
+        return sum(self._call_cost([batch["types"] for batch in group]) for group in groups)
 
-MCQ - ПЛОХО:
-"Что такое фотосинтез?"
-Варианты: ["Процесс с использованием солнечного света", "Процесс с использованием лунного света", "Процесс, превращающий растения в камни"]
-Проблема: Вариант 3 абсурден и нереалистичен
+    def _deadline_batch_size(self, types_pool: List[str]) -> int:
+        """
+        Smallest batch size (not below the configured one) whose first pass fits the deadline:
+        bigger batches mean fewer calls and less per-call overhead, but longer decodes
+        and more questions lost to one bad JSON
+        """
+        if self.deadline is None or not types_pool:
+            return self.batch_size
+        remaining = self.deadline.remaining()
+        largest = max(self.batch_size, DEADLINE_MAX_BATCH_SIZE)
+        for size in range(self.batch_size, largest + 1):
+            if self._first_pass_cost(self._split_batches(types_pool, size)) <= remaining:
+                return size
+        return largest
+
+    def _deadline_retry_limit(self, batches: List[Dict]) -> int:
+        """Attempts per question that fit into the time left after the first pass"""
+        if self.deadline is None:
+            return self.max_retries
+        first_pass = self._first_pass_cost(batches)
+        spare = self.deadline.remaining() - first_pass
+        if spare < 0:
+            print(f"Срок: первый проход ~{first_pass:.0f} с при {self.deadline.remaining():.0f} с в запасе; "
+                  f"результат будет неполным")
+        return self.latency.retry_rounds(first_pass, spare, self.max_retries)
+
+    def _fits_deadline(self, types_list: List[List[str]]) -> bool:
+        """A generate call is started only if its estimated duration fits the remaining time"""
+        if self.deadline is None:
+            return True
+        if self._call_cost(types_list) <= self.deadline.remaining():
+            return True
+        if not self.truncated:
+            print(f"Срок запроса: осталось {max(self.deadline.remaining(), 0):.1f} с, "
+                  f"вызов generate не успеет; возвращаем готовые вопросы")
+        self.truncated = True
+        return False
+
+    def _fits_facts_deadline(self, group_index: int) -> bool:
+        """
+        A chunk group is extracted only if it and one question batch still fit the deadline.
+        Before the first measured group its cost is unknown, so the first group only needs room for a batch
+        """
+        if self.deadline is None:
+            return True
+        needed = self._call_cost([["mcq"] * self.batch_size])
+        if group_index > 0 or self.facts_latency.samples:
+            needed += self.facts_latency.estimate(FACTS_MAX_NEW_TOKENS)
+        return needed <= self.deadline.remaining()
+
+    def _validate_question(self, q: Dict, test_set_name: str):
+        """Post-process and validate one parsed question; return None if it is invalid"""
+        if not isinstance(q, dict):
+            return None
+        qtype = str(q.get("question_type", "")).lower()
 
-MCQ - ХОРОШО:
-"Что такое фотосинтез?"
-Варианты: ["Процесс, преобразующий световую энергию в химическую энергию", "Процесс, преобразующий химическую энергию в световую энергию", "Процесс, хранящий воду в клетках растений"]
-Почему: Все варианты - правдоподобные биологические процессы
+        if q.get("test_set", "") == "":
+            q["test_set"] = test_set_name
 
-MATCH - ПЛОХО:
-Question_options: ["Термин А", "Термин Б"]
-Options: ["Что-то неясное", "Другая неясная вещь"]
-Проблема: Неясные соответствия
+        # MCQ validation
+        if qtype == "mcq":
+            opts = q.get("options", [])
+            opts = [self._shorten_option(opt, max_words=10) for opt in opts]
 
-MATCH - ХОРОШО:
-Question_options: ["Хлорофилл", "Глюкоза"]
-Options: ["Пигмент, улавливающий солнечный свет", "Сахар, производимый фотосинтезом"]
-Почему: Четкие пары термин-определение из фактов
+            # Check for duplicate options - if found, mark as invalid
+            if len(opts) != len(set(opts)):
+                print(f"    MCQ имеет дублирующиеся варианты, помечено как невалидное")
+                return None
 
-SEQUENCE - ПЛОХО:
-Использование фактов, которые происходят одновременно или не имеют четкого порядка
-Проблема: Навязывает искусственную последовательность
+            q["options"] = opts
+            ans = q.get("answers", [])
+            if not isinstance(ans, list) or len(ans) == 0:
+                return None
+            filtered = [int(a) for a in ans if isinstance(a, int) or (isinstance(a, str) and a.isdigit())]
+            if not filtered:
+                return None
+            q["answers"] = [filtered[0]]
 
-SEQUENCE - ХОРОШО:
-Использование фактов с явными временными маркерами, такими как "сначала", "затем", "после" или логическим прогрессом
-Почему: Естественный порядок существует в исходном материале
+        # INPUT validation
+        elif qtype == "input":
+            ans = q.get("answer", "")
+            if not isinstance(ans, str) or ans.strip() == "":
+                return None
+            q["answer"] = self._truncate_to_n_words(ans, 3)
+
+        # MATCH validation
+        elif qtype == "match":
+            left = q.get("question_options", [])
+            right = q.get("options", [])
+            n = min(len(left), len(right))
+            if n == 0:
+                return None
+            q["question_options"] = left[:n]
+            q["options"] = [self._shorten_option(x, max_words=8) for x in right[:n]]
+            q["answers"] = [[i, i] for i in range(n)]
+            # Shuffle match questions programmatically
+            q = self._programmatically_mangle_match([q])[0]
+
+        # SEQUENCE validation
+        elif qtype == "sequence":
+            opts = q.get("options", [])
+            if len(opts) < 2:
+                return None
+            opts = [opt.strip() for opt in opts]
+            q["options"] = opts[:5]
+            q["answers"] = list(range(len(q["options"])))
 
-ПРАВИЛА ВЫВОДА:
-- Возвращайте ТОЛЬКО валидный JSON, без объяснений, без markdown, без преамбулы
-- Не выдумывайте факты, термины или различия, не присутствующие в источнике
-- Делайте вопросы сложными, но справедливыми
-- Убедитесь, что все варианты четко различны и правдоподобны
+        else:
+            return None
 
-ШАБЛОН:
-{template_str}
+        return q
 
-Верните ТОЛЬКО JSON массив. Без комментариев.
-"""
-        messages = [
-            {"role": "system", "content": "Вы - точный генератор вопросов, возвращающий только JSON."},
-            {"role": "user", "content": prompt}
+    def _new_slots(self, batch: Dict) -> List[Dict]:
+        """One slot per requested question; the retry budget is tracked per slot"""
+        return [
+            {"type": qtype, "number": batch["start_index"] + i, "question": None, "attempts": 0}
+            for i, qtype in enumerate(batch["types"])
         ]
 
-        text_input = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-        inputs = self.tokenizer(text_input, return_tensors="pt").to(self.model.device)
+    def _missing_slots(self, slots: List[Dict]) -> List[Dict]:
+        """Slots still without a valid question that have retry budget left"""
+        return [slot for slot in slots if slot["question"] is None and slot["attempts"] < self._retry_limit]
 
-        with torch.no_grad():
-            outputs = self.model.generate(
-                **inputs,
-                max_new_tokens=1500,
-                temperature=self.temperature,
-                do_sample=True if self.temperature > 0 else False,
-                top_p=0.9
-            )
+    def _slots_request(self, batch: Dict, missing: List[Dict]) -> Dict:
+        """Batch description asking only for the missing questions"""
+        return {
+            "types": [slot["type"] for slot in missing],
+            "start_index": batch["start_index"],
+            "numbers": [slot["number"] for slot in missing],
+            "facts": batch.get("facts")
+        }
 
-        raw = self.tokenizer.decode(outputs[0][inputs['input_ids'].shape[1]:], skip_special_tokens=True)
-        del outputs, inputs
-        self._clear_cuda()
+    def _apply_attempt(self, missing: List[Dict], parsed, test_set_name: str) -> int:
+        """
+        Fill requested slots from a parsed model answer.
+        Each slot takes the first unused question of its type.
+        :return: число слотов, оставшихся без валидного вопроса
+        """
+        for slot in missing:
+            slot["attempts"] += 1
+
+        failed = 0
+        candidates = [item for item in (parsed or []) if isinstance(item, dict)]
+        for slot in missing:
+            item = next(
+                (c for c in candidates if str(c.get("question_type", "")).lower() == slot["type"]),
+                None
+            )
+            if item is not None:
+                candidates.remove(item)
+            question = self._validate_question(item, test_set_name) if item is not None else None
+            if question is None:
+                failed += 1
+                continue
+            question["question_number"] = slot["number"]
+            slot["question"] = question
+
+        self._record_attempt(parsed, len(missing), failed)
+        self.latency.observe_failures(len(missing), failed)
+        return failed
+
+    def _slots_result(self, slots: List[Dict]):
+        """Valid questions of a finished batch, or None if none survived"""
+        questions = [slot["question"] for slot in slots if slot["question"] is not None]
+        return questions or None
+
+    def _run_batches_sequential(self, facts: str, batches: List[Dict], test_set_name: str,
+                                on_result=None) -> List:
+        """
+        One model.generate call per batch attempt; a retry asks only for the questions
+        that are still missing
+        :param on_result: callback(batch_idx, validated_or_None), вызывается, как только судьба батча решена
+        """
+        results = [None] * len(batches)
+
+        for batch_idx, batch in enumerate(batches):
+            if self.truncated:
+                break
+            print(f"Обработка батча {batch_idx+1}/{len(batches)}: {batch['types']}")
+            slots = self._new_slots(batch)
+
+            attempt = 0
+            missing = self._missing_slots(slots)
+            while missing:
+                request = self._slots_request(batch, missing)
+                if not self._fits_deadline([request["types"]]):
+                    break
+                attempt += 1
+                parsed = self._generate_batch_via_model(
+                    facts=request["facts"] or facts,
+                    types_to_generate=request["types"],
+                    start_index=request["start_index"],
+                    test_set_name=test_set_name,
+                    numbers=request["numbers"]
+                )
+                failed = self._apply_attempt(missing, parsed, test_set_name)
+                if parsed is None:
+                    print(f"  Попытка {attempt}: невалидный JSON; повтор...")
+                elif failed:
+                    print(f"  Попытка {attempt}: {failed} из {len(missing)} вопрос(ов) не прошли валидацию; "
+                          f"повтор только для них...")
+                missing = self._missing_slots(slots)
+
+            results[batch_idx] = self._slots_result(slots)
+            lost = sum(1 for slot in slots if slot["question"] is None)
+            if lost and not self.truncated:
+                print(f"  Батч {batch_idx+1}: {lost} вопрос(ов) не удались после {self._retry_limit} попыток; пропуск.")
+            if on_result is not None:
+                on_result(batch_idx, results[batch_idx])
+
+        return results
+
+    def _run_batches_padded(self, facts: str, batches: List[Dict], test_set_name: str,
+                            on_result=None) -> List:
+        """
+        All pending batches (and on later rounds the missing questions of each)
+        are left-padded into one tensor and decoded by a single model.generate call per round.
+        :param on_result: callback(batch_idx, validated_or_None), вызывается, как только судьба батча решена
+        """
+        results = [None] * len(batches)
+        slots = [self._new_slots(batch) for batch in batches]
+        pending = list(range(len(batches)))
+
+        round_num = 0
+        while pending:
+            round_num += 1
+            print(f"Раунд {round_num}: {len(pending)} батч(ей) в одном вызове generate")
+
+            step = self.max_parallel_batches or len(pending)
+            for offset in range(0, len(pending), step):
+                group = pending[offset:offset + step]
+                missing = {batch_idx: self._missing_slots(slots[batch_idx]) for batch_idx in group}
+                requests = [self._slots_request(batches[i], missing[i]) for i in group]
+                if not self._fits_deadline([request["types"] for request in requests]):
+                    break
+                parsed_list = self._generate_batches_via_model(
+                    facts=facts,
+                    batches=requests,
+                    test_set_name=test_set_name
+                )
+                for batch_idx, parsed in zip(group, parsed_list):
+                    self._apply_attempt(missing[batch_idx], parsed, test_set_name)
+
+            still_pending = []
+            for batch_idx in pending:
+                # После истечения срока батчи завершаются с тем, что успели
+                if not self.truncated and self._missing_slots(slots[batch_idx]):
+                    still_pending.append(batch_idx)
+                    continue
+                results[batch_idx] = self._slots_result(slots[batch_idx])
+                lost = sum(1 for slot in slots[batch_idx] if slot["question"] is None)
+                if lost and not self.truncated:
+                    print(f"  Батч {batch_idx+1}: {lost} вопрос(ов) не удались после {self._retry_limit} попыток; пропуск.")
+                if on_result is not None:
+                    on_result(batch_idx, results[batch_idx])
+            pending = still_pending
+
+        return results
+
+    def _start_run(self, question_count: int, types: List[str] = None) -> List[Dict]:
+        """Reset per-request state and split the planned (or given) question types into batches"""
+        self.truncated = False
+        self._retry_limit = self.max_retries
+        self.batch_stats = self._empty_batch_stats()
+        self.rng = random.Random(self.seed)
+
+        types_pool = list(types) if types else self._plan_question_types(question_count)
+
+        batch_size = self._deadline_batch_size(types_pool)
+        if batch_size != self.batch_size:
+            print(f"Срок запроса: размер батча {self.batch_size} -> {batch_size}")
+        return self._split_batches(types_pool, batch_size)
+
+    def _select_facts(self, batches: List[Dict], facts: str):
+        """With facts_per_batch each batch gets its own subset of the facts (batch["facts"])"""
+        if not self.facts_per_batch:
+            return
+        fact_list = split_facts(facts)
+        selections = select_batch_facts(fact_list, len(batches), self.facts_per_batch)
+        for batch, selected in zip(batches, selections):
+            batch["facts"] = "\n".join(selected)
+        print(f"Отбор фактов: {len(fact_list)} факт(ов), до {self.facts_per_batch} на батч")
+
+    def _run_batch_indices(self, facts: str, batches: List[Dict], indices: List[int], results: List,
+                           test_set_name: str, cache=None, on_batch=None, unfinished: List[Dict] = None):
+        """
+        Take the given batches from the cache or generate them; results[batch_idx] is filled in place
+        :param unfinished: все ещё не сгенерированные батчи запроса (для бюджета повторов под срок);
+            по умолчанию - только эти
+        """
+        def batch_facts(batch_idx):
+            return batches[batch_idx].get("facts") or facts
+
+        def finish_batch(batch_idx, validated, from_cache=False):
+            results[batch_idx] = validated
+            # В кэш попадают только полные батчи
+            complete = validated is not None and len(validated) == len(batches[batch_idx]["types"])
+            if complete and cache is not None and not from_cache:
+                cache.put_batch(self, batch_facts(batch_idx), batches[batch_idx]["types"], test_set_name, validated)
+            if on_batch is not None:
+                on_batch(batch_idx, len(batches), validated or [])
+
+        pending = []
+        for batch_idx in indices:
+            cached = cache.get_batch(self, batch_facts(batch_idx), batches[batch_idx]["types"],
+                                     test_set_name) if cache is not None else None
+            if cached:
+                finish_batch(batch_idx, cached, from_cache=True)
+            else:
+                pending.append(batch_idx)
+        if len(pending) < len(indices):
+            print(f"Кэш: {len(indices) - len(pending)}/{len(indices)} батч(ей) без обращения к модели")
+
+        # После истечения срока новые батчи не начинаются
+        if not pending or self.truncated:
+            return
 
-        parsed = self._extract_json_array_from_text(raw)
-        if parsed is None:
-            return None
+        self._load_model()
+        if self.seed is not None:
+            from transformers import set_seed
+            set_seed(self.seed)
+
+        to_generate = [batches[batch_idx] for batch_idx in pending]
+        self._retry_limit = self._deadline_retry_limit(unfinished or to_generate)
+        if self._retry_limit != self.max_retries:
+            print(f"Срок запроса: до {self._retry_limit} попыток на вопрос вместо {self.max_retries}")
+        self.batch_stats["batches"] += len(to_generate)
+        self.batch_stats["questions"] += sum(len(batch["types"]) for batch in to_generate)
+        run_batches = self._run_batches_padded if self.batched else self._run_batches_sequential
+        run_batches(
+            facts, to_generate, test_set_name,
+            on_result=lambda local_idx, validated: finish_batch(pending[local_idx], validated)
+        )
 
-        parsed = self._ensure_test_set_name(parsed, test_set_name)
-        return parsed
+    def _finish_run(self, results: List, question_count: int, test_set_name: str) -> List[Dict]:
+        """Print retry statistics and join the batches into the final numbered question list"""
+        if self.batch_stats["attempts"]:
+            stats = self.retry_stats()
+            print(f"Попыток: {stats['attempts']} на {stats['batches']} батч(ей), "
+                  f"невалидный JSON: {stats['parse_failures']}, не прошли валидацию: {stats['validation_failures']}, "
+                  f"перегенерировано вопросов: {stats['questions_regenerated']}")
+
+        all_questions = []
+        for validated in results:
+            if validated:
+                all_questions.extend(validated)
+
+        # Trim and normalize
+        all_questions = all_questions[:question_count]
+        # Вопросы, потерянные из-за урезанного под срок числа попыток, - тоже усечение
+        if len(all_questions) < question_count and self._retry_limit < self.max_retries:
+            self.truncated = True
+        if self.truncated:
+            print(f"Срок запроса истёк: результат неполный ({self.latency.to_dict()})")
+        for i, q in enumerate(all_questions):
+            q["question_number"] = i + 1
+            if q.get("test_set", "") == "":
+                q["test_set"] = test_set_name
+
+        return all_questions
 
     def generate_questions(self, facts: str, test_set_name: str = "Test 1",
-                          question_count: int = 10) -> List[Dict]:
-        """Generate exam questions in batches with validation and error recovery"""
+                          question_count: int = 10, cache=None, on_batch=None,
+                          types: List[str] = None) -> List[Dict]:
+        """
+        Generate exam questions in batches with validation and error recovery
+        :param cache: кэш батчей (get_batch/put_batch); попадания не требуют обращения к модели
+        :param on_batch: callback(batch_idx, total_batches, questions) по завершении каждого батча
+        :param types: типы вопросов (например, недостающие после банка вопросов);
+            по умолчанию - распределение plan_question_types(question_count)
+        При заданном self.deadline возвращает то, что успело сгенерироваться, и ставит self.truncated
+        """
+        try:
+            if types:
+                question_count = len(types)
+            batches = self._start_run(question_count, types)
+            self._select_facts(batches, facts)
+
+            results = [None] * len(batches)
+            self._run_batch_indices(facts, batches, list(range(len(batches))), results, test_set_name,
+                                    cache=cache, on_batch=on_batch)
+            return self._finish_run(results, question_count, test_set_name)
+
+        except GenerationCancelled:
+            raise
+        except Exception as e:
+            raise RuntimeError(f"Ошибка генерации вопросов: {str(e)}")
+
+    @staticmethod
+    def _batch_fact_spans(n_batches: int, total_groups: int) -> List[range]:
+        """
+        Chunk groups whose facts feed each batch: batches are spread evenly over the document,
+        so early batches only wait for the first groups
+        """
+        spans = []
+        for batch_idx in range(n_batches):
+            first = batch_idx * total_groups // n_batches
+            last = max((batch_idx + 1) * total_groups // n_batches, first + 1)
+            spans.append(range(first, last))
+        return spans
+
+    def generate_questions_streaming(self, fact_groups, test_set_name: str = "Test 1",
+                                     question_count: int = 10, cache=None, on_batch=None,
+                                     on_facts=None, types: List[str] = None) -> List[Dict]:
+        """
+        Pipelined generation: facts are extracted in a producer thread while question batches
+        run as soon as the facts they need have arrived.
+        Each batch is fed by the facts of its share of the document (its span of chunk groups)
+        instead of the facts of the whole material.
+        :param fact_groups: итератор (group_index, total_groups, facts), например iter_facts(text);
+            выполняется в отдельном потоке
+        :param on_facts: callback(group_index, total_groups, facts), вызывается в вызывающем потоке
+        :param types: как в generate_questions
+        """
+        arrivals = queue.Queue()
+        stop = threading.Event()
+
+        def produce():
+            try:
+                for group in fact_groups:
+                    arrivals.put(("facts", group))
+                    if stop.is_set():
+                        break
+            except GenerationCancelled as e:
+                arrivals.put(("error", e))
+            except Exception as e:
+                arrivals.put(("error", RuntimeError(f"Ошибка извлечения фактов: {str(e)}")))
+            finally:
+                arrivals.put(("end", None))
+                if hasattr(fact_groups, "close"):
+                    fact_groups.close()
+
         try:
-            self._load_model()
-
-            import math
-
-            # Distribution: prefer MCQ and INPUT (cheaper), some MATCH and SEQUENCE
-            n_match = max(1, int(question_count * 0.10))
-            n_seq = max(1, int(question_count * 0.10))
-            remainder = question_count - (n_match + n_seq)
-            n_mcq = math.ceil(remainder * 0.5)
-            n_input = remainder - n_mcq
-
-            types_pool = []
-            types_pool.extend(["match"] * n_match)
-            types_pool.extend(["sequence"] * n_seq)
-            types_pool.extend(["mcq"] * n_mcq)
-            types_pool.extend(["input"] * n_input)
-
-            # Prefer MCQ/Input earlier, add randomness
-            random.shuffle(types_pool)
-            types_pool.sort(key=lambda t: 0 if t in ("mcq", "input") else 1)
-            types_pool = types_pool[:question_count]
-
-            all_questions = []
-            total_batches = math.ceil(len(types_pool) / self.batch_size)
-
-            for batch_idx in range(total_batches):
-                start = batch_idx * self.batch_size
-                end = min(start + self.batch_size, len(types_pool))
-                batch_types = types_pool[start:end]
-                batch_start_index = start + 1
-                print(f"Обработка батча {batch_idx+1}/{total_batches}: {batch_types}")
-
-                success = False
-                for attempt in range(1, self.max_retries + 1):
-                    parsed = self._generate_batch_via_model(
-                        facts=facts,
-                        types_to_generate=batch_types,
-                        start_index=batch_start_index,
-                        test_set_name=test_set_name
-                    )
-                    if parsed is None:
-                        print(f"  Попытка {attempt}: невалидный JSON; повтор...")
-                        continue
-
-                    # Post-process and validate
-                    valid = True
-                    for q in parsed:
-                        qtype = q.get("question_type", "").lower()
-
-                        if q.get("test_set", "") == "":
-                            q["test_set"] = test_set_name
-
-                        # MCQ validation
-                        if qtype == "mcq":
-                            opts = q.get("options", [])
-                            opts = [self._shorten_option(opt, max_words=10) for opt in opts]
-
-                            # Check for duplicate options - if found, mark as invalid
-                            if len(opts) != len(set(opts)):
-                                print(f"    MCQ имеет дублирующиеся варианты, помечено как невалидное")
-                                valid = False
-                                break
-
-                            q["options"] = opts
-                            ans = q.get("answers", [])
-                            if not isinstance(ans, list) or len(ans) == 0:
-                                valid = False
-                                break
-                            filtered = [int(a) for a in ans if isinstance(a, int) or (isinstance(a, str) and a.isdigit())]
-                            if not filtered:
-                                valid = False
-                                break
-                            q["answers"] = [filtered[0]]
-
-                        # INPUT validation
-                        elif qtype == "input":
-                            ans = q.get("answer", "")
-                            if not isinstance(ans, str) or ans.strip() == "":
-                                valid = False
-                                break
-                            q["answer"] = self._truncate_to_n_words(ans, 3)
-
-                        # MATCH validation
-                        elif qtype == "match":
-                            left = q.get("question_options", [])
-                            right = q.get("options", [])
-                            n = min(len(left), len(right))
-                            if n == 0:
-                                valid = False
-                                break
-                            q["question_options"] = left[:n]
-                            q["options"] = [self._shorten_option(x, max_words=8) for x in right[:n]]
-                            q["answers"] = [[i, i] for i in range(n)]
-
-                        # SEQUENCE validation
-                        elif qtype == "sequence":
-                            opts = q.get("options", [])
-                            if len(opts) < 2:
-                                valid = False
-                                break
-                            opts = [opt.strip() for opt in opts]
-                            q["options"] = opts[:5]
-                            q["answers"] = list(range(len(q["options"])))
-
-                        else:
-                            valid = False
-                            break
-
-                    if not valid:
-                        print(f"  Попытка {attempt}: валидация не прошла; повтор...")
-                        continue
-
-                    # Shuffle match questions programmatically
-                    parsed = self._programmatically_mangle_match(parsed)
-                    all_questions.extend(parsed)
-                    success = True
+            if types:
+                question_count = len(types)
+            batches = self._start_run(question_count, types)
+            results = [None] * len(batches)
+            group_facts = []
+            spans = None
+            started = set()
+
+            threading.Thread(target=produce, name="fact-producer", daemon=True).start()
+            while True:
+                kind, payload = arrivals.get()
+                if kind == "error":
+                    raise payload
+                if kind == "end":
                     break
 
-                if not success:
-                    print(f"  Батч {batch_idx+1} не удался после {self.max_retries} попыток; пропуск.")
+                group_index, total_groups, facts = payload
+                group_facts.append(facts)
+                if on_facts is not None:
+                    on_facts(group_index, total_groups, facts)
+                if spans is None:
+                    spans = self._batch_fact_spans(len(batches), total_groups)
+
+                ready = [batch_idx for batch_idx in range(len(batches))
+                         if batch_idx not in started and spans[batch_idx].stop <= len(group_facts)]
+                if not ready:
+                    continue
+                print(f"Конвейер: факты {len(group_facts)}/{total_groups} групп(ы), батчи {[i + 1 for i in ready]}")
+
+                all_facts = "\n".join(fact for facts_list in group_facts for fact in facts_list)
+                for span in sorted({spans[batch_idx] for batch_idx in ready}, key=lambda r: r.start):
+                    span_batches = [batches[batch_idx] for batch_idx in ready if spans[batch_idx] == span]
+                    span_facts = "\n".join(fact for g in span for fact in group_facts[g]) or all_facts
+                    for batch in span_batches:
+                        batch["facts"] = span_facts
+                    self._select_facts(span_batches, span_facts)
+
+                started.update(ready)
+                unfinished = [batches[batch_idx] for batch_idx in range(len(batches))
+                              if batch_idx in ready or batch_idx not in started]
+                self._run_batch_indices(all_facts, batches, ready, results, test_set_name,
+                                        cache=cache, on_batch=on_batch, unfinished=unfinished)
+                if self.truncated:
+                    break
 
-            # Trim and normalize
-            all_questions = all_questions[:question_count]
-            for i, q in enumerate(all_questions):
-                q["question_number"] = i + 1
-                if q.get("test_set", "") == "":
-                    q["test_set"] = test_set_name
+            # Извлечение остановлено по сроку до конца документа: батчи, чьи группы фактов
+            # не пришли, получают уже извлечённые факты
+            leftover = [batch_idx for batch_idx in range(len(batches)) if batch_idx not in started]
+            all_facts = "\n".join(fact for facts_list in group_facts for fact in facts_list)
+            if leftover and all_facts and not self.truncated:
+                leftover_batches = [batches[batch_idx] for batch_idx in leftover]
+                self._select_facts(leftover_batches, all_facts)
+                self._run_batch_indices(all_facts, batches, leftover, results, test_set_name,
+                                        cache=cache, on_batch=on_batch, unfinished=leftover_batches)
 
-            return all_questions
+            return self._finish_run(results, question_count, test_set_name)
 
+        except GenerationCancelled:
+            raise
         except Exception as e:
             raise RuntimeError(f"Ошибка генерации вопросов: {str(e)}")
+        finally:
+            stop.set()
 
 
 def get_generator(use_mock: bool = True, **kwargs):
@@ -614,9 +1460,35 @@ def get_generator(use_mock: bool = True, **kwargs):
         batch_size = kwargs.get('batch_size', 3)
         max_retries = kwargs.get('max_retries', 3)
         temperature = kwargs.get('temperature', 0.15)
+        batched = kwargs.get('batched', False)
+        max_parallel_batches = kwargs.get('max_parallel_batches')
+        use_prefix_cache = kwargs.get('use_prefix_cache', False)
+        seed = kwargs.get('seed')
+        fact_chunk_tokens = kwargs.get('fact_chunk_tokens', 1500)
+        fact_chunk_batch_size = kwargs.get('fact_chunk_batch_size', 4)
+        use_scheduler = kwargs.get('use_scheduler', False)
+        scheduler_max_batch_size = kwargs.get('scheduler_max_batch_size', 16)
+        constrained_decoding = kwargs.get('constrained_decoding', False)
+        facts_per_batch = kwargs.get('facts_per_batch')
+        backend = kwargs.get('backend')
+        backend_options = kwargs.get('backend_options')
+        draft_model_path = kwargs.get('draft_model_path')
         return RealGenerator(
             model_path=model_path,
             batch_size=batch_size,
             max_retries=max_retries,
-            temperature=temperature
+            temperature=temperature,
+            batched=batched,
+            max_parallel_batches=max_parallel_batches,
+            use_prefix_cache=use_prefix_cache,
+            seed=seed,
+            fact_chunk_tokens=fact_chunk_tokens,
+            fact_chunk_batch_size=fact_chunk_batch_size,
+            use_scheduler=use_scheduler,
+            scheduler_max_batch_size=scheduler_max_batch_size,
+            constrained_decoding=constrained_decoding,
+            facts_per_batch=facts_per_batch,
+            backend=backend,
+            backend_options=backend_options,
+            draft_model_path=draft_model_path
         )
@@ -0,0 +1,147 @@
+import os
+import time
+import threading
+from typing import Dict
+from app.llm.backends import InferenceBackend, ThroughputMeter, get_backend
+from app.llm.prefix_cache import PrefixKVCache
+from app.llm.speculative import SpeculativeStats
+from app.llm.scheduler import ContinuousBatchScheduler
+
+
+class LoadedModel:
+    """Модель и токенизатор, загруженные в память процесса, плюс метрики загрузки"""
+
+    def __init__(self, model_path: str, model, tokenizer, load_time: float, memory: Dict,
+                 backend: InferenceBackend = None):
+        self.model_path = model_path
+        self.backend = backend
+        self.model = model
+        self.tokenizer = tokenizer
+        self.load_time = load_time
+        self.memory = memory
+        self.loaded_at = time.time()
+        self.warmed_up = False
+        self.prefix_caches: Dict[str, PrefixKVCache] = {}
+        self.scheduler = None
+        self.throughput = ThroughputMeter()
+        # Speculative decoding, где эта модель - основная
+        self.speculative = SpeculativeStats()
+        self._lock = threading.Lock()
+
+    def get_prefix_cache(self, prefix_text: str) -> PrefixKVCache:
+        """KV-кэш статического префикса промпта, считается один раз на модель"""
+        cache = self.prefix_caches.get(prefix_text)
+        if cache is not None:
+            return cache
+
+        with self._lock:
+            cache = self.prefix_caches.get(prefix_text)
+            if cache is None:
+                cache = PrefixKVCache.build(self.model, self.tokenizer, prefix_text)
+                self.prefix_caches[prefix_text] = cache
+                print(f"KV-кэш префикса: {cache.length} токенов за {cache.build_time:.2f} с")
+        return cache
+
+    def get_scheduler(self, max_batch_size: int = 16) -> ContinuousBatchScheduler:
+        """Планировщик continuous batching, общий для всех запросов к этой модели"""
+        if self.scheduler is None:
+            with self._lock:
+                if self.scheduler is None:
+                    self.scheduler = ContinuousBatchScheduler(self.model, self.tokenizer, max_batch_size=max_batch_size)
+        return self.scheduler
+
+    def to_dict(self) -> Dict:
+        return {
+            "model_path": self.model_path,
+            "backend": self.backend.describe() if self.backend is not None else None,
+            "throughput": self.throughput.to_dict(),
+            "speculative": self.speculative.to_dict() if self.speculative.calls else None,
+            "load_time_seconds": round(self.load_time, 3),
+            "memory": self.memory,
+            "loaded_at": self.loaded_at,
+            "warmed_up": self.warmed_up,
+            "prefix_caches": [cache.to_dict() for cache in self.prefix_caches.values()],
+            "scheduler": self.scheduler.stats() if self.scheduler is not None else None
+        }
+
+
+class ModelRegistry:
+    """
+    Реестр моделей уровня процесса.
+    Каждая модель загружается один раз на процесс (для каждого бэкенда) и переиспользуется всеми запросами.
+    """
+
+    def __init__(self):
+        self._models: Dict[tuple, LoadedModel] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_path: str, backend: str = None, backend_options: Dict = None) -> LoadedModel:
+        """Вернуть загруженную модель, при первом обращении загрузить её"""
+        inference_backend = get_backend(backend, **(backend_options or {}))
+        key = (model_path, inference_backend.name)
+        loaded = self._models.get(key)
+        if loaded is not None:
+            return loaded
+
+        with self._lock:
+            # Другой поток мог загрузить модель, пока мы ждали блокировку
+            loaded = self._models.get(key)
+            if loaded is None:
+                loaded = self._load(model_path, inference_backend)
+                self._models[key] = loaded
+        return loaded
+
+    def warmup(self, model_path: str, backend: str = None, backend_options: Dict = None) -> LoadedModel:
+        """
+        Загрузить модель и выполнить короткую генерацию,
+        чтобы первый пользовательский запрос не платил за инициализацию ядер
+        """
+        loaded = self.get(model_path, backend, backend_options)
+        if loaded.warmed_up:
+            return loaded
+
+        import torch
+
+        inputs = loaded.tokenizer("Привет", return_tensors="pt").to(loaded.model.device)
+        with torch.no_grad():
+            loaded.model.generate(**inputs, max_new_tokens=1, do_sample=False)
+        loaded.warmed_up = True
+        return loaded
+
+    def unload(self, model_path: str, backend: str = None) -> bool:
+        with self._lock:
+            loaded = self._models.pop((model_path, get_backend(backend).name), None)
+        if loaded is None:
+            return False
+
+        del loaded
+        try:
+            import gc
+            import torch
+            gc.collect()
+            torch.cuda.empty_cache()
+        except Exception:
+            pass
+        return True
+
+    def stats(self) -> Dict:
+        return {
+            "pid": os.getpid(),
+            "models": [loaded.to_dict() for loaded in self._models.values()]
+        }
+
+    def _load(self, model_path: str, backend: InferenceBackend) -> LoadedModel:
+        if not model_path:
+            raise ValueError("MODEL_PATH not configured for RealGenerator")
+
+        print(f"Загрузка модели из {model_path} (бэкенд {backend.name})...")
+
+        started = time.perf_counter()
+        model, tokenizer, memory = backend.load(model_path)
+        load_time = time.perf_counter() - started
+
+        print(f"Модель успешно загружена за {load_time:.1f} с")
+        return LoadedModel(model_path, model, tokenizer, load_time, memory, backend)
+
+
+model_registry = ModelRegistry()
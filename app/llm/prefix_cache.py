@@ -0,0 +1,75 @@
+import copy
+import time
+from typing import Dict, List
+
+
+class PrefixKVCache:
+    """
+    KV-кэш фиксированного префикса промпта.
+    Считается один раз на загруженную модель; каждый вызов generate
+    копирует его и прогоняет через модель только переменный суффикс.
+    """
+
+    def __init__(self, prefix_text: str, input_ids, past_key_values, build_time: float):
+        self.prefix_text = prefix_text
+        self.input_ids = input_ids
+        self.past_key_values = past_key_values
+        self.build_time = build_time
+        self.hits = 0
+
+    @classmethod
+    def build(cls, model, tokenizer, prefix_text: str):
+        import torch
+
+        started = time.perf_counter()
+        input_ids = tokenizer(prefix_text, return_tensors="pt")["input_ids"].to(model.device)
+        with torch.no_grad():
+            outputs = model(input_ids=input_ids, use_cache=True)
+        return cls(prefix_text, input_ids, outputs.past_key_values, time.perf_counter() - started)
+
+    @property
+    def length(self) -> int:
+        return self.input_ids.shape[1]
+
+    def prepare_inputs(self, tokenizer, texts: List[str]):
+        """
+        Собрать аргументы generate() для промптов, начинающихся с префикса.
+        Суффиксы выравниваются левым паддингом и ставятся сразу после префикса;
+        паддинг внутри последовательности закрывается attention_mask.
+        :return: dict с input_ids/attention_mask/past_key_values или None, если кэш неприменим
+        """
+        import torch
+
+        if not all(text.startswith(self.prefix_text) for text in texts):
+            return None
+
+        past_key_values = copy.deepcopy(self.past_key_values)
+        batch_size = len(texts)
+        if batch_size > 1:
+            # Старые версии transformers не умеют расширять кэш по батчу
+            if not hasattr(past_key_values, "batch_repeat_interleave"):
+                return None
+            past_key_values.batch_repeat_interleave(batch_size)
+
+        suffixes = [text[len(self.prefix_text):] for text in texts]
+        suffix_inputs = tokenizer(
+            suffixes,
+            return_tensors="pt",
+            padding=True,
+            add_special_tokens=False
+        ).to(self.input_ids.device)
+
+        prefix_ids = self.input_ids.expand(batch_size, -1)
+        self.hits += 1
+        return {
+            "input_ids": torch.cat([prefix_ids, suffix_inputs["input_ids"]], dim=1),
+            "attention_mask": torch.cat([torch.ones_like(prefix_ids), suffix_inputs["attention_mask"]], dim=1),
+            "past_key_values": past_key_values
+        }
+
+    def to_dict(self) -> Dict:
+        return {
+            "prefix_tokens": self.length,
+            "build_time_seconds": round(self.build_time, 3),
+            "hits": self.hits
+        }
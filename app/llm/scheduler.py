@@ -0,0 +1,342 @@
+import inspect
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Dict, List
+
+
+class ScheduledSequence:
+    """Одна последовательность в общем цикле декодирования"""
+
+    def __init__(self, prompt_ids: List[int], max_new_tokens: int, temperature: float, top_p: float,
+                 stop_fn=None, logits_processor=None, cancel_token=None):
+        self.prompt_ids = prompt_ids
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        # stop_fn(generated_ids) -> bool: дополнительное условие остановки
+        self.stop_fn = stop_fn
+        # logits_processor(generated_ids[1, n], scores[1, V]) -> scores, как в transformers,
+        # но input_ids содержит только сгенерированные токены (без промпта)
+        self.logits_processor = logits_processor
+        # CancellationToken: отменённая последовательность сразу освобождает строку батча
+        self.cancel_token = cancel_token
+        self.generated: List[int] = []
+        self.done = False
+        self.future = Future()
+        self.submitted_at = time.perf_counter()
+        self.first_token_at = None
+
+
+class ContinuousBatchScheduler:
+    """
+    Continuous (in-flight) batching поверх одной загруженной модели.
+
+    Запросы из всех потоков попадают в общую очередь. Единственный поток планировщика
+    владеет моделью и гоняет общий цикл декодирования: на каждом шаге ожидающие
+    последовательности проходят prefill и добавляются в батч, а завершённые сразу
+    возвращают результат и освобождают место, не дожидаясь остальных.
+
+    Между шагами декодирования KV-кэш хранится в формате модели (DynamicCache) и дополняется
+    на месте. В legacy-формат tuple((key, value), ...) с тензорами [B, H, T, D] он переводится
+    только при смене состава батча (prefill новых строк, удаление завершённых);
+    последовательности разной длины выровнены левым паддингом, закрытым attention_mask.
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size: int = 16, max_prefill_batch: int = 4):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        # Сколько новых последовательностей проходит prefill за один шаг
+        self.max_prefill_batch = max_prefill_batch
+        self.eos_token_ids = self._eos_token_ids()
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else self.eos_token_ids[0]
+        self._logits_kwargs = self._detect_logits_kwargs()
+
+        self._waiting = deque()
+        self._condition = threading.Condition()
+        self._thread = None
+
+        # Состояние общего батча (меняется только потоком планировщика)
+        self._active: List[ScheduledSequence] = []
+        self._past = None
+        self._attention_mask = None
+        self._positions = None
+        self._last_tokens = None
+
+        self._stats = {"steps": 0, "tokens": 0, "sequences": 0, "batch_size_sum": 0, "ttft_sum": 0.0}
+
+    def submit(self, prompt_text: str, max_new_tokens: int, temperature: float = 0.0, top_p: float = 1.0,
+               stop_fn=None, logits_processor=None, cancel_token=None) -> Future:
+        """Поставить промпт в очередь; Future вернёт декодированный текст"""
+        prompt_ids = self.tokenizer(prompt_text)["input_ids"]
+        seq = ScheduledSequence(prompt_ids, max_new_tokens, temperature, top_p, stop_fn, logits_processor,
+                                cancel_token)
+
+        with self._condition:
+            self._waiting.append(seq)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="continuous-batching", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return seq.future
+
+    def stats(self) -> Dict:
+        steps = self._stats["steps"]
+        sequences = self._stats["sequences"]
+        return {
+            "waiting": len(self._waiting),
+            "active": len(self._active),
+            "steps": steps,
+            "tokens": self._stats["tokens"],
+            "sequences": sequences,
+            "avg_batch_size": round(self._stats["batch_size_sum"] / steps, 2) if steps else 0.0,
+            "avg_ttft_seconds": round(self._stats["ttft_sum"] / sequences, 3) if sequences else 0.0
+        }
+
+    def _eos_token_ids(self) -> List[int]:
+        eos = getattr(getattr(self.model, "generation_config", None), "eos_token_id", None)
+        if eos is None:
+            eos = self.tokenizer.eos_token_id
+        if isinstance(eos, int):
+            eos = [eos]
+        return list(eos or [])
+
+    def _detect_logits_kwargs(self) -> Dict:
+        """На prefill нужны логиты только последней позиции, а не всего промпта"""
+        params = inspect.signature(self.model.forward).parameters
+        if "logits_to_keep" in params:
+            return {"logits_to_keep": 1}
+        if "num_logits_to_keep" in params:
+            return {"num_logits_to_keep": 1}
+        return {}
+
+    def _loop(self):
+        import torch
+
+        while True:
+            with self._condition:
+                while not self._waiting and not self._active:
+                    self._condition.wait()
+
+                admitted = []
+                while (self._waiting
+                       and len(self._active) + len(admitted) < self.max_batch_size
+                       and len(admitted) < self.max_prefill_batch):
+                    seq = self._waiting.popleft()
+                    if seq.cancel_token is not None and seq.cancel_token.cancelled:
+                        # Отменён до prefill: модель на него не тратится
+                        seq.future.set_result("")
+                        continue
+                    admitted.append(seq)
+
+            try:
+                with torch.no_grad():
+                    if admitted:
+                        self._prefill(admitted)
+                    if self._active:
+                        self._decode_step()
+            except Exception as e:
+                print(f"Ошибка планировщика генерации: {e}")
+                self._fail_all(admitted, e)
+
+    def _prefill(self, seqs: List[ScheduledSequence]):
+        import torch
+
+        device = self.model.device
+        max_len = max(len(seq.prompt_ids) for seq in seqs)
+        input_ids = torch.full((len(seqs), max_len), self.pad_token_id, dtype=torch.long, device=device)
+        attention_mask = torch.zeros((len(seqs), max_len), dtype=torch.long, device=device)
+        for i, seq in enumerate(seqs):
+            length = len(seq.prompt_ids)
+            input_ids[i, max_len - length:] = torch.tensor(seq.prompt_ids, dtype=torch.long, device=device)
+            attention_mask[i, max_len - length:] = 1
+
+        position_ids = attention_mask.cumsum(-1) - 1
+        position_ids.masked_fill_(attention_mask == 0, 1)
+
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            use_cache=True,
+            **self._logits_kwargs
+        )
+        next_tokens = self._sample(seqs, outputs.logits[:, -1, :])
+
+        self._append_rows(
+            seqs,
+            self._to_legacy(outputs.past_key_values),
+            attention_mask,
+            attention_mask.sum(-1),
+            next_tokens
+        )
+        self._record(seqs, next_tokens)
+        self._finish_done()
+
+    def _decode_step(self):
+        import torch
+
+        attention_mask = torch.cat([
+            self._attention_mask,
+            torch.ones((len(self._active), 1), dtype=self._attention_mask.dtype, device=self._attention_mask.device)
+        ], dim=1)
+
+        outputs = self.model(
+            input_ids=self._last_tokens[:, None],
+            attention_mask=attention_mask,
+            position_ids=self._positions[:, None],
+            past_key_values=self._past,
+            use_cache=True
+        )
+
+        # Кэш дополнен моделью на месте: копирования нет, пока состав батча не меняется
+        self._past = outputs.past_key_values
+        self._attention_mask = attention_mask
+        self._positions = self._positions + 1
+        self._last_tokens = self._sample(self._active, outputs.logits[:, -1, :])
+
+        self._stats["steps"] += 1
+        self._stats["batch_size_sum"] += len(self._active)
+        self._record(self._active, self._last_tokens)
+        self._finish_done()
+
+    def _sample(self, seqs: List[ScheduledSequence], logits):
+        """Выбор следующего токена с параметрами каждой последовательности"""
+        import torch
+
+        tokens = []
+        for i, seq in enumerate(seqs):
+            scores = logits[i:i + 1].float()
+            if seq.logits_processor is not None:
+                generated = torch.tensor([seq.generated], dtype=torch.long, device=scores.device)
+                scores = seq.logits_processor(generated, scores)
+
+            if seq.temperature and seq.temperature > 0:
+                probs = torch.softmax(scores / seq.temperature, dim=-1)
+                if seq.top_p < 1.0:
+                    sorted_probs, sorted_idx = torch.sort(probs, descending=True)
+                    outside = sorted_probs.cumsum(-1) - sorted_probs > seq.top_p
+                    sorted_probs = sorted_probs.masked_fill(outside, 0.0)
+                    probs = torch.zeros_like(probs).scatter(-1, sorted_idx, sorted_probs)
+                token = torch.multinomial(probs, 1)
+            else:
+                token = scores.argmax(-1, keepdim=True)
+            tokens.append(token.view(-1))
+        return torch.cat(tokens)
+
+    def _record(self, seqs: List[ScheduledSequence], tokens):
+        now = time.perf_counter()
+        for seq, token in zip(seqs, tokens.tolist()):
+            if seq.first_token_at is None:
+                seq.first_token_at = now
+                self._stats["ttft_sum"] += now - seq.submitted_at
+            seq.generated.append(token)
+            self._stats["tokens"] += 1
+
+            if (token in self.eos_token_ids
+                    or len(seq.generated) >= seq.max_new_tokens
+                    or (seq.stop_fn is not None and seq.stop_fn(seq.generated))
+                    or (seq.cancel_token is not None and seq.cancel_token.cancelled)):
+                seq.done = True
+
+    def _append_rows(self, seqs, past, attention_mask, positions, last_tokens):
+        """Добавить новые строки в общий батч, выровняв длину кэша левым паддингом"""
+        import torch
+
+        if not self._active:
+            self._active = list(seqs)
+            self._past, self._attention_mask = self._from_legacy(past), attention_mask
+            self._positions, self._last_tokens = positions, last_tokens
+            return
+
+        active_past = self._to_legacy(self._past)
+        old_len, new_len = self._attention_mask.shape[1], attention_mask.shape[1]
+        if old_len < new_len:
+            active_past, self._attention_mask = self._left_pad(active_past, self._attention_mask, new_len - old_len)
+        elif new_len < old_len:
+            past, attention_mask = self._left_pad(past, attention_mask, old_len - new_len)
+
+        self._past = self._from_legacy(tuple(
+            (torch.cat([old_k, new_k], dim=0), torch.cat([old_v, new_v], dim=0))
+            for (old_k, old_v), (new_k, new_v) in zip(active_past, past)
+        ))
+        self._attention_mask = torch.cat([self._attention_mask, attention_mask], dim=0)
+        self._positions = torch.cat([self._positions, positions], dim=0)
+        self._last_tokens = torch.cat([self._last_tokens, last_tokens], dim=0)
+        self._active.extend(seqs)
+
+    @staticmethod
+    def _left_pad(past, attention_mask, pad: int):
+        import torch
+
+        padded = tuple(
+            (
+                torch.cat([key.new_zeros(key.shape[0], key.shape[1], pad, key.shape[3]), key], dim=2),
+                torch.cat([value.new_zeros(value.shape[0], value.shape[1], pad, value.shape[3]), value], dim=2)
+            )
+            for key, value in past
+        )
+        mask = torch.cat([attention_mask.new_zeros(attention_mask.shape[0], pad), attention_mask], dim=1)
+        return padded, mask
+
+    def _finish_done(self):
+        """Вернуть результаты завершённых последовательностей и убрать их строки из батча"""
+        import torch
+
+        keep = [i for i, seq in enumerate(self._active) if not seq.done]
+        if len(keep) == len(self._active):
+            return
+
+        for seq in self._active:
+            if seq.done:
+                self._stats["sequences"] += 1
+                seq.future.set_result(self.tokenizer.decode(seq.generated, skip_special_tokens=True))
+
+        if not keep:
+            self._reset()
+            return
+
+        index = torch.tensor(keep, dtype=torch.long, device=self._attention_mask.device)
+        self._active = [self._active[i] for i in keep]
+        past = tuple((key.index_select(0, index), value.index_select(0, index))
+                     for key, value in self._to_legacy(self._past))
+        self._attention_mask = self._attention_mask.index_select(0, index)
+        self._positions = self._positions.index_select(0, index)
+        self._last_tokens = self._last_tokens.index_select(0, index)
+
+        # Колонки, которые остались паддингом во всех строках, больше не нужны
+        used = self._attention_mask.any(dim=0).nonzero()
+        first = int(used[0]) if len(used) else 0
+        if first > 0:
+            past = tuple((key[:, :, first:, :], value[:, :, first:, :]) for key, value in past)
+            self._attention_mask = self._attention_mask[:, first:]
+        self._past = self._from_legacy(past)
+
+    def _fail_all(self, admitted: List[ScheduledSequence], error: Exception):
+        for seq in list(self._active) + [seq for seq in admitted if seq not in self._active]:
+            if not seq.future.done():
+                seq.future.set_exception(error)
+        self._reset()
+
+    def _reset(self):
+        self._active = []
+        self._past = None
+        self._attention_mask = None
+        self._positions = None
+        self._last_tokens = None
+
+    @staticmethod
+    def _to_legacy(past_key_values):
+        if hasattr(past_key_values, "to_legacy_cache"):
+            return past_key_values.to_legacy_cache()
+        return past_key_values
+
+    @staticmethod
+    def _from_legacy(legacy):
+        try:
+            from transformers import DynamicCache
+        except ImportError:
+            return legacy
+        return DynamicCache.from_legacy_cache(legacy)
@@ -0,0 +1,70 @@
+from typing import Dict
+
+
+class ForwardCounter:
+    """
+    Считает вызовы forward основной и черновой модели за время одного generate.
+    Каждая итерация assisted generation - один forward основной модели,
+    а каждый предложенный токен черновика - один forward черновой модели.
+    """
+
+    def __init__(self, target_model, draft_model):
+        self.target_model = target_model
+        self.draft_model = draft_model
+        self.target_calls = 0
+        self.draft_calls = 0
+        self._handles = []
+
+    def _count_target(self, module, args, output):
+        self.target_calls += 1
+
+    def _count_draft(self, module, args, output):
+        self.draft_calls += 1
+
+    def __enter__(self):
+        self._handles = [
+            self.target_model.register_forward_hook(self._count_target),
+            self.draft_model.register_forward_hook(self._count_draft)
+        ]
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+        return False
+
+
+class SpeculativeStats:
+    """
+    Накопленная статистика speculative decoding.
+    Основная модель добавляет один свой токен на итерацию, остальное - принятые токены черновика,
+    поэтому acceptance rate ~ (новые токены - итерации) / предложенные токены.
+    Оценка приблизительна, если ту же модель одновременно используют другие потоки.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.new_tokens = 0
+        self.target_forwards = 0
+        self.draft_forwards = 0
+        self.seconds = 0.0
+
+    def record(self, new_tokens: int, counter: ForwardCounter, seconds: float):
+        self.calls += 1
+        self.new_tokens += new_tokens
+        self.target_forwards += counter.target_calls
+        self.draft_forwards += counter.draft_calls
+        self.seconds += seconds
+
+    def to_dict(self) -> Dict:
+        accepted = max(0, self.new_tokens - self.target_forwards)
+        return {
+            "generate_calls": self.calls,
+            "new_tokens": self.new_tokens,
+            "target_forwards": self.target_forwards,
+            "draft_forwards": self.draft_forwards,
+            "acceptance_rate": round(accepted / self.draft_forwards, 3) if self.draft_forwards else 0.0,
+            "tokens_per_target_forward": round(self.new_tokens / self.target_forwards, 2) if self.target_forwards else 0.0,
+            "tokens_per_second": round(self.new_tokens / self.seconds, 2) if self.seconds else 0.0
+        }
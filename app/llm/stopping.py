@@ -0,0 +1,126 @@
+from typing import List
+
+# Маркеры пунктов списка фактов
+FACT_BULLETS = "-•*–"
+
+
+class JsonArrayScanner:
+    """Инкрементальный поиск конца первого JSON-массива верхнего уровня в потоке текста"""
+
+    def __init__(self):
+        self.pos = 0
+        self.start = None
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        # Позиция сразу после закрывающей скобки массива
+        self.end = None
+
+    def feed(self, text: str):
+        for ch in text:
+            if self.end is not None:
+                return
+            self.pos += 1
+
+            if self.start is None:
+                # Всё до первой "[" (например, ```json) пропускаем
+                if ch == "[":
+                    self.start = self.pos - 1
+                    self.depth = 1
+                continue
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in "[{":
+                self.depth += 1
+            elif ch in "]}":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.end = self.pos
+
+
+class FactsListScanner:
+    """
+    Инкрементальный поиск конца списка фактов: пустая строка после начала списка,
+    за которой идёт строка другого вида (для маркированного списка - без маркера,
+    для списка простых строк - любая)
+    """
+
+    def __init__(self):
+        self.pos = 0
+        self.line = ""
+        # Вид списка по первой строке: True - пункты с маркером, False - простые строки
+        self.bullet = None
+        self.blank_at = None
+        # Позиция конца списка (начало пустой строки перед посторонним текстом)
+        self.end = None
+
+    def feed(self, text: str):
+        for ch in text:
+            if self.end is not None:
+                return
+
+            if ch == "\n":
+                if not self.line.strip() and self.bullet is not None and self.blank_at is None:
+                    self.blank_at = self.pos
+                self.line = ""
+            else:
+                self.line += ch
+                # Решение принимается по первому видимому символу строки
+                if not ch.isspace() and len(self.line.strip()) == 1:
+                    is_bullet = ch in FACT_BULLETS
+                    if self.bullet is None:
+                        self.bullet = is_bullet
+                    elif self.blank_at is not None:
+                        if not (self.bullet and is_bullet):
+                            self.end = self.blank_at
+                            return
+                        self.blank_at = None
+            self.pos += 1
+
+
+class ScannerStoppingCriteria:
+    """
+    Stopping criteria для model.generate: строка батча останавливается,
+    как только её сканер нашёл конец (остальные строки продолжают декодирование)
+    """
+
+    def __init__(self, tokenizer, scanner_cls, batch_size: int, prompt_len: int):
+        self.tokenizer = tokenizer
+        self.scanners = [scanner_cls() for _ in range(batch_size)]
+        self.seen_len = prompt_len
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+
+        if input_ids.shape[1] > self.seen_len:
+            # При speculative decoding за шаг может добавиться несколько токенов
+            for scanner, token_ids in zip(self.scanners, input_ids[:, self.seen_len:].tolist()):
+                if scanner.end is None:
+                    scanner.feed(self.tokenizer.decode(token_ids, skip_special_tokens=True))
+        self.seen_len = input_ids.shape[1]
+
+        return torch.tensor([scanner.end is not None for scanner in self.scanners],
+                            dtype=torch.bool, device=input_ids.device)
+
+
+class ScannerStopFn:
+    """stop_fn(generated_ids) для планировщика continuous batching на основе сканера"""
+
+    def __init__(self, tokenizer, scanner_cls):
+        self.tokenizer = tokenizer
+        self.scanner = scanner_cls()
+        self.fed = 0
+
+    def __call__(self, generated: List[int]) -> bool:
+        for token_id in generated[self.fed:]:
+            self.scanner.feed(self.tokenizer.decode([token_id], skip_special_tokens=True))
+        self.fed = len(generated)
+        return self.scanner.end is not None
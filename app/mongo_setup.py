@@ -13,8 +13,13 @@ class MongoSetup:
     # Названия коллекций
     COLLECTION_TEST_DOCS = 'test_documents'
     COLLECTION_MATERIALS = 'materials_raw'
-    # COLLECTION_FACTS = 'facts'
-    # COLLECTION_CACHE = 'test_generation_cache'
+    COLLECTION_FACTS = 'facts'
+    COLLECTION_CACHE = 'test_generation_cache'
+    COLLECTION_JOBS = 'generation_jobs'
+    COLLECTION_QUESTION_BANK = 'question_bank'
+
+    # Срок жизни записей кэша фактов без expires_at (созданных до TTL-индекса)
+    FACTS_LEGACY_TTL_SECONDS = 30 * 24 * 3600
 
     def __init__(self, db):
         """
@@ -31,6 +36,10 @@ class MongoSetup:
         try:
             self._create_test_documents_indexes()
             self._create_materials_indexes()
+            self._create_facts_indexes()
+            self._create_generation_cache_indexes()
+            self._create_jobs_indexes()
+            self._create_question_bank_indexes()
             return True
         except OperationFailure as e:
             print(f"Failed to create indexes: {e}")
@@ -81,12 +90,127 @@ class MongoSetup:
             background=True
         )
 
+    def _create_facts_indexes(self):
+        """Создает индексы для коллекции facts (кэш извлечения фактов)"""
+        collection = self.db[self.COLLECTION_FACTS]
+
+        # Уникальный индекс для ключа кэша (хэш текста + модель + версия промпта)
+        collection.create_index(
+            [("cache_key", ASCENDING)],
+            name="idx_cache_key",
+            unique=True,
+            background=True
+        )
+
+        # Индекс для поиска всех записей одного текста (например, при смене модели)
+        collection.create_index(
+            [("text_hash", ASCENDING)],
+            name="idx_text_hash",
+            background=True
+        )
+
+        # Индекс для очистки давно не используемых записей
+        collection.create_index(
+            [("last_used_at", ASCENDING)],
+            name="idx_last_used_at",
+            background=True
+        )
+
+        # TTL-индекс: expires_at сдвигается при каждом использовании записи (FACT_CACHE_TTL_SECONDS)
+        collection.create_index(
+            [("expires_at", ASCENDING)],
+            name="idx_expires_at_ttl",
+            expireAfterSeconds=0,
+            background=True
+        )
+        # Записи, созданные до появления expires_at, иначе не удалялись бы никогда
+        collection.update_many(
+            {"expires_at": {"$exists": False}},
+            [{"$set": {"expires_at": {"$add": ["$$NOW", self.FACTS_LEGACY_TTL_SECONDS * 1000]}}}]
+        )
+
+    def _create_generation_cache_indexes(self):
+        """Создает индексы для коллекции test_generation_cache (кэш батчей вопросов)"""
+        collection = self.db[self.COLLECTION_CACHE]
+
+        # Уникальный индекс для ключа кэша
+        collection.create_index(
+            [("cache_key", ASCENDING)],
+            name="idx_cache_key",
+            unique=True,
+            background=True
+        )
+
+        # TTL-индекс: MongoDB удаляет запись, когда наступает expires_at
+        collection.create_index(
+            [("expires_at", ASCENDING)],
+            name="idx_expires_at_ttl",
+            expireAfterSeconds=0,
+            background=True
+        )
+
+        # Индекс для вытеснения самых старых записей при превышении лимита
+        collection.create_index(
+            [("created_at", ASCENDING)],
+            name="idx_created_at",
+            background=True
+        )
+
+    def _create_jobs_indexes(self):
+        """Создает индексы для коллекции generation_jobs (очередь фоновых задач)"""
+        collection = self.db[self.COLLECTION_JOBS]
+
+        # Уникальный индекс для job_id
+        collection.create_index(
+            [("job_id", ASCENDING)],
+            name="idx_job_id",
+            unique=True,
+            background=True
+        )
+
+        # Индекс для выборки следующей задачи из очереди
+        collection.create_index(
+            [("status", ASCENDING), ("created_at", ASCENDING)],
+            name="idx_status_created_at",
+            background=True
+        )
+
+        # Завершённые задачи удаляются через неделю
+        collection.create_index(
+            [("finished_at", ASCENDING)],
+            name="idx_finished_at_ttl",
+            expireAfterSeconds=7 * 24 * 3600,
+            background=True
+        )
+
+    def _create_question_bank_indexes(self):
+        """Создает индексы для коллекции question_bank (банк вопросов по материалам)"""
+        collection = self.db[self.COLLECTION_QUESTION_BANK]
+
+        # Уникальный индекс: один вопрос с тем же содержанием на материал и модель
+        collection.create_index(
+            [("material_id", ASCENDING), ("model_id", ASCENDING), ("fingerprint", ASCENDING)],
+            name="idx_material_model_fingerprint",
+            unique=True,
+            background=True
+        )
+
+        # Индекс для выборки наименее использованных вопросов нужного типа
+        collection.create_index(
+            [("material_id", ASCENDING), ("model_id", ASCENDING), ("question_type", ASCENDING),
+             ("used_count", ASCENDING)],
+            name="idx_material_model_type_used",
+            background=True
+        )
+
     def drop_all_indexes(self):
         """
         ОПАСНО: Удаляет все индексы (кроме _id)
         Использовать только для тестирования
         """
-        for collection_name in [self.COLLECTION_TEST_DOCS, self.COLLECTION_MATERIALS]:
+        for collection_name in [self.COLLECTION_TEST_DOCS, self.COLLECTION_MATERIALS,
+                                self.COLLECTION_FACTS, self.COLLECTION_CACHE, self.COLLECTION_JOBS,
+                                self.COLLECTION_QUESTION_BANK]:
             collection = self.db[collection_name]
             for index in collection.list_indexes():
                 if index['name'] != '_id_':
@@ -105,3 +229,23 @@ class MongoSetup:
     def materials_raw(self):
         """Коллекция materials_raw"""
         return self.db[self.COLLECTION_MATERIALS]
+
+    @property
+    def facts(self):
+        """Коллекция facts"""
+        return self.db[self.COLLECTION_FACTS]
+
+    @property
+    def test_generation_cache(self):
+        """Коллекция test_generation_cache"""
+        return self.db[self.COLLECTION_CACHE]
+
+    @property
+    def generation_jobs(self):
+        """Коллекция generation_jobs"""
+        return self.db[self.COLLECTION_JOBS]
+
+    @property
+    def question_bank(self):
+        """Коллекция question_bank"""
+        return self.db[self.COLLECTION_QUESTION_BANK]
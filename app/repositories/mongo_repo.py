@@ -26,19 +26,49 @@ class MongoRepository:
             document['version'] = 1
         return self.db[collection].insert_one(document)
 
-    def find_one(self, collection: str, query: dict):
-        return self.db[collection].find_one(query)
+    def find_one(self, collection: str, query: dict, projection: dict = None):
+        """
+        :param projection: Поля, которые нужно вернуть (None - весь документ)
+        """
+        return self.db[collection].find_one(query, projection)
 
-    def find_many(self, collection: str, query: dict, sort=None, limit=None):
-        cursor = self.db[collection].find(query)
+    def find_many(self, collection: str, query: dict, sort=None, limit=None, projection: dict = None):
+        cursor = self.db[collection].find(query, projection)
         if sort:
             cursor = cursor.sort(sort)
         if limit:
             cursor = cursor.limit(limit)
         return list(cursor)
 
-    def update_one(self, collection: str, query: dict, update: dict):
-        return self.db[collection].update_one(query, update)
+    def update_one(self, collection: str, query: dict, update: dict, upsert: bool = False):
+        return self.db[collection].update_one(query, update, upsert=upsert)
+
+    def update_many(self, collection: str, query: dict, update: dict):
+        return self.db[collection].update_many(query, update)
+
+    def find_one_and_update(self, collection: str, query: dict, update: dict, sort=None, projection: dict = None):
+        """
+        Атомарно обновить один документ и вернуть его новую версию.
+        :param projection: Поля, которые нужно вернуть (None - весь документ)
+        :return: Документ после обновления или None, если ничего не найдено
+        """
+        return self.db[collection].find_one_and_update(
+            query,
+            update,
+            projection=projection,
+            sort=sort,
+            return_document=pymongo.ReturnDocument.AFTER
+        )
+
+    def bulk_write(self, collection: str, operations: list, ordered: bool = False):
+        """
+        Несколько операций (UpdateOne, InsertOne, ...) одним запросом к серверу.
+        :param ordered: False - операции независимы, ошибка одной не останавливает остальные
+        :return: BulkWriteResult или None, если операций нет
+        """
+        if not operations:
+            return None
+        return self.db[collection].bulk_write(operations, ordered=ordered)
 
     def delete_one(self, collection: str, query: dict):
         return self.db[collection].delete_one(query)
@@ -49,6 +79,36 @@ class MongoRepository:
     def count(self, collection: str, query: dict):
         return self.db[collection].count_documents(query)
 
+    def estimated_count(self, collection: str):
+        """Число документов коллекции по метаданным (без обхода коллекции)"""
+        return self.db[collection].estimated_document_count()
+
+    def aggregate(self, collection: str, pipeline: list):
+        """
+        Выполнить aggregation pipeline (вычисления и $project на стороне сервера).
+        :return: Список результирующих документов
+        """
+        return list(self.db[collection].aggregate(pipeline))
+
+    def get_question_counts(self, test_ids: list):
+        """
+        Число вопросов последней версии каждого теста одной агрегацией
+        (массив questions не передаётся, размер считается на сервере)
+        :return: {test_id: {"version": N, "question_count": M}}
+        """
+        if not test_ids:
+            return {}
+        rows = self.aggregate('test_documents', [
+            {"$match": {"test_id": {"$in": list(test_ids)}}},
+            {"$sort": {"test_id": 1, "version": -1}},
+            {"$group": {
+                "_id": "$test_id",
+                "version": {"$first": "$version"},
+                "question_count": {"$first": {"$size": {"$ifNull": ["$questions", []]}}}
+            }}
+        ])
+        return {row['_id']: {"version": row['version'], "question_count": row['question_count']} for row in rows}
+
     def create_test_document(self, data: dict):
         """
         Создание документа в коллекции test_documents.
@@ -58,20 +118,22 @@ class MongoRepository:
         """
         return self.insert_one('test_documents', data, add_version=True)
 
-    def get_by_test_id(self, test_id: str, version: int = None):
+    def get_by_test_id(self, test_id: str, version: int = None, projection: dict = None):
         """
         Получение документа из test_documents по test_id.
         :param test_id: ID теста.
         :param version: Версия документа (если None, вернёт последнюю).
+        :param projection: Поля, которые нужно вернуть (None - весь документ).
         :return: Документ или None, если не найден.
         """
         query = {'test_id': test_id}
         if version is not None:
             query['version'] = version
-            return self.find_one('test_documents', query)
+            return self.find_one('test_documents', query, projection=projection)
         else:
             # Получить последнюю версию
-            results = self.find_many('test_documents', query, sort=[('version', -1)], limit=1)
+            results = self.find_many('test_documents', query, sort=[('version', -1)], limit=1,
+                                     projection=projection)
             return results[0] if results else None
 
     def get_test_versions(self, test_id: str):
@@ -82,6 +144,25 @@ class MongoRepository:
         """
         return self.find_many('test_documents', {'test_id': test_id}, sort=[('version', -1)])
 
+    def get_test_version_summaries(self, test_id: str):
+        """
+        Метаданные всех версий теста без массивов вопросов:
+        число вопросов считается на сервере через $size.
+        :param test_id: ID теста
+        :return: Список {version, question_count, created_at, updated_at}, новые версии первыми
+        """
+        return self.aggregate('test_documents', [
+            {"$match": {"test_id": test_id}},
+            {"$sort": {"version": -1}},
+            {"$project": {
+                "_id": 0,
+                "version": 1,
+                "created_at": 1,
+                "updated_at": 1,
+                "question_count": {"$size": {"$ifNull": ["$questions", []]}}
+            }}
+        ])
+
     def create_new_version(self, test_id: str, questions: list):
         """
         Создать новую версию теста.
@@ -90,7 +171,7 @@ class MongoRepository:
         :return: Номер новой версии или None при ошибке
         """
         # Найти максимальную версию
-        latest = self.get_by_test_id(test_id)
+        latest = self.get_by_test_id(test_id, projection={'version': 1})
         if not latest:
             return None
 
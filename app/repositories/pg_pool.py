@@ -0,0 +1,228 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeout(Exception):
+    """Свободное соединение не появилось за DB_POOL_TIMEOUT секунд"""
+
+
+class PgPool:
+    """
+    Пул соединений PostgreSQL на процесс.
+    Свободные соединения хранятся в собственном списке (до maxconn штук): ThreadedConnectionPool
+    закрывает возвращённое соединение, если свободных уже minconn, и под нагрузкой
+    открывал бы новое соединение почти на каждую выдачу.
+    Выдача ограничена семафором: поток ждёт освобождения соединения до timeout секунд.
+    Соединение, простоявшее дольше health_check_seconds, перед выдачей проверяется SELECT 1;
+    закрытые и сломанные соединения заменяются новыми.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, timeout: float = 10.0, health_check_seconds: float = 30.0,
+                 **connect_kwargs):
+        self.minconn = min(minconn, maxconn)
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_seconds = health_check_seconds
+        self.connect_kwargs = connect_kwargs
+        # Пул принадлежит процессу, который его создал (см. get_pool)
+        self.pid = os.getpid()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        # Свободные соединения: (conn, время возврата в пул); выдаются последние возвращённые
+        self._idle = []
+
+        self.in_use = 0
+        self.opened = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.replaced = 0
+        self._checkout_seconds = 0.0
+        self._max_checkout_seconds = 0.0
+
+        now = time.monotonic()
+        for _ in range(self.minconn):
+            self._idle.append((self._connect(), now))
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.connect_kwargs)
+        with self._lock:
+            self.opened += 1
+        return conn
+
+    def _healthy(self, conn, last_used: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_seconds:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _take_idle(self):
+        """Свободное рабочее соединение или None; не прошедшие проверку закрываются"""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                conn, last_used = self._idle.pop()
+            if self._healthy(conn, last_used):
+                return conn
+            self._close(conn)
+            with self._lock:
+                self.replaced += 1
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def getconn(self):
+        started = time.monotonic()
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.waits += 1
+            if not self._slots.acquire(timeout=self.timeout):
+                with self._lock:
+                    self.timeouts += 1
+                raise PoolTimeout(f"No free PostgreSQL connection within {self.timeout}s (max {self.maxconn})")
+
+        try:
+            # Каждое соединение из списка проверяется; новое соединение рабочее по построению
+            conn = self._take_idle() or self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self.in_use += 1
+            self.checkouts += 1
+            self._checkout_seconds += elapsed
+            self._max_checkout_seconds = max(self._max_checkout_seconds, elapsed)
+        return conn
+
+    def putconn(self, conn):
+        """
+        Вернуть соединение; незавершённая транзакция откатывается (страховка: чтения идут
+        в autocommit, записи фиксируются до возврата), сломанное соединение закрывается
+        """
+        try:
+            broken = bool(conn.closed)
+            if not broken:
+                status = conn.info.transaction_status
+                if status in (extensions.TRANSACTION_STATUS_INTRANS, extensions.TRANSACTION_STATUS_INERROR):
+                    conn.rollback()
+                elif status != extensions.TRANSACTION_STATUS_IDLE:
+                    broken = True
+        except Exception:
+            broken = True
+
+        try:
+            if broken:
+                self._close(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+        finally:
+            with self._lock:
+                self.in_use -= 1
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pid": self.pid,
+                "min": self.minconn,
+                "max": self.maxconn,
+                "in_use": self.in_use,
+                "idle": len(self._idle),
+                "opened": self.opened,
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+                "replaced": self.replaced,
+                "avg_checkout_ms": round(self._checkout_seconds / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "max_checkout_ms": round(self._max_checkout_seconds * 1000, 3)
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+# Пулы, унаследованные от родителя при fork: их сокеты принадлежат родителю, закрывать их
+# в дочернем процессе нельзя (PQfinish оборвал бы соединения родителя), поэтому ссылки
+# держатся здесь, чтобы сборщик мусора не закрыл соединения
+_inherited_pools = []
+
+
+def _reset_after_fork():
+    global _pool, _pool_lock
+    _pool_lock = threading.Lock()
+    if _pool is not None:
+        _inherited_pools.append(_pool)
+        _pool = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_pool(config) -> PgPool:
+    """
+    Пул текущего процесса; создаётся при первом обращении.
+    В дочернем процессе pre-fork сервера (gunicorn --preload) создаётся свой пул.
+    """
+    global _pool
+    pool = _pool
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+
+    with _pool_lock:
+        if _pool is not None and _pool.pid != os.getpid():
+            _inherited_pools.append(_pool)
+            _pool = None
+        if _pool is None:
+            _pool = PgPool(
+                minconn=config.DB_POOL_MIN,
+                maxconn=config.DB_POOL_MAX,
+                timeout=config.DB_POOL_TIMEOUT,
+                health_check_seconds=config.DB_POOL_HEALTH_CHECK_SECONDS,
+                host=config.DB_HOST,
+                port=config.DB_PORT,
+                dbname=config.DB_NAME,
+                user=config.DB_USER,
+                password=config.DB_PASSWORD
+            )
+        return _pool
+
+
+def pool_stats():
+    """Метрики пула текущего процесса (None, если пул ещё не создан)"""
+    pool = _pool
+    if pool is None or pool.pid != os.getpid():
+        return None
+    return pool.stats()
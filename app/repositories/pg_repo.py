@@ -1,37 +1,92 @@
-import psycopg2
+import threading
 from psycopg2.extras import RealDictCursor
-import os
 from contextlib import contextmanager
 from app.config import Config
+from app.repositories.pg_pool import get_pool
+
+# Активная единица работы потока (см. PostgresRepository.unit_of_work)
+_current = threading.local()
+
+
+class UnitOfWork:
+    """Запросы на одном соединении в одной транзакции; commit - при выходе из unit_of_work"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def _run(self, query, params, fetch_one: bool):
+        with self.conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(query, params or ())
+            if fetch_one:
+                return cursor.fetchone()
+            if query.strip().upper().startswith(('SELECT', 'WITH')):
+                return cursor.fetchall()
+            return None
+
+    def execute_query(self, query, params=None, commit=False):
+        """Выполнить запрос и вернуть результат (commit игнорируется: фиксирует unit_of_work)"""
+        return self._run(query, params, fetch_one=False)
+
+    def execute_query_one(self, query, params=None, commit=False):
+        """Выполнить запрос и вернуть одну строку"""
+        return self._run(query, params, fetch_one=True)
+
 
 class PostgresRepository:
     def __init__(self):
         self.config = Config()
 
+    @contextmanager
+    def unit_of_work(self):
+        """
+        Все запросы блока - на одном соединении в одной транзакции:
+        commit при нормальном выходе (в том числе через return), rollback при исключении.
+        execute_query/execute_query_one репозитория внутри блока (в этом потоке) выполняются в ней же;
+        вложенный unit_of_work присоединяется к внешнему.
+        Не держите блок открытым во время долгих операций (генерация): соединение занято, строки под FOR UPDATE заблокированы.
+        """
+        outer = getattr(_current, 'uow', None)
+        if outer is not None:
+            yield outer
+            return
+
+        with self.get_connection() as conn:
+            conn.autocommit = False
+            uow = UnitOfWork(conn)
+            _current.uow = uow
+            try:
+                yield uow
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                _current.uow = None
+
     @contextmanager
     def get_connection(self):
-        """Контекстный менеджер для соединения с БД"""
+        """Контекстный менеджер для соединения с БД (из пула процесса, см. pg_pool)"""
+        pool = get_pool(self.config)
         conn = None
         try:
-            conn = psycopg2.connect(
-                host=self.config.DB_HOST,
-                port=self.config.DB_PORT,
-                dbname=self.config.DB_NAME,
-                user=self.config.DB_USER,
-                password=self.config.DB_PASSWORD
-            )
+            conn = pool.getconn()
             yield conn
         except Exception as e:
             print(f"Database connection error: {e}")
             raise
         finally:
             if conn:
-                conn.close()
+                pool.putconn(conn)
 
     @contextmanager
     def get_cursor(self, commit=False):
-        """Контекстный менеджер для курсора"""
+        """
+        Контекстный менеджер для курсора.
+        commit=False - чтение: соединение в autocommit, без BEGIN и отката при возврате в пул
+        и без простоя idle in transaction; записи идут с commit=True или в unit_of_work
+        """
         with self.get_connection() as conn:
+            conn.autocommit = not commit
             cursor = conn.cursor(cursor_factory=RealDictCursor)
             try:
                 yield cursor
@@ -45,6 +100,9 @@ class PostgresRepository:
 
     def execute_query(self, query, params=None, commit=False):
         """Выполнить запрос и вернуть результат"""
+        uow = getattr(_current, 'uow', None)
+        if uow is not None:
+            return uow.execute_query(query, params)
         with self.get_cursor(commit=commit) as cursor:
             cursor.execute(query, params or ())
             if query.strip().upper().startswith(('SELECT', 'WITH')):
@@ -53,6 +111,9 @@ class PostgresRepository:
 
     def execute_query_one(self, query, params=None, commit=False):
         """Выполнить запрос и вернуть одну строку"""
+        uow = getattr(_current, 'uow', None)
+        if uow is not None:
+            return uow.execute_query_one(query, params)
         with self.get_cursor(commit=commit) as cursor:
             cursor.execute(query, params or ())
             return cursor.fetchone()
@@ -0,0 +1,147 @@
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from app.repositories.mongo_repo import MongoRepository
+
+
+class FactCacheService:
+    """
+    Кэш результатов extract_facts в коллекции facts.
+    Ключ - хэш исходного текста, id модели и версии промпта извлечения фактов.
+    Запись живёт ttl_seconds с последнего использования: каждое попадание сдвигает expires_at,
+    TTL-индекс удаляет давно не используемые записи.
+    """
+
+    COLLECTION = 'facts'
+
+    # Счётчики уровня процесса
+    _stats_lock = threading.Lock()
+    _hits = 0
+    _misses = 0
+
+    def __init__(self, ttl_seconds: int = 30 * 24 * 3600):
+        """
+        :param ttl_seconds: время жизни записи с последнего использования
+        """
+        self.mongo_repo = MongoRepository()
+        self.ttl_seconds = ttl_seconds
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def make_key(cls, text: str, model_id: str, prompt_version: str) -> str:
+        raw_key = f"{cls.text_hash(text)}:{model_id}:{prompt_version}"
+        return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def _count(cls, hit: bool):
+        with cls._stats_lock:
+            if hit:
+                cls._hits += 1
+            else:
+                cls._misses += 1
+
+    @classmethod
+    def stats(cls):
+        with cls._stats_lock:
+            total = cls._hits + cls._misses
+            return {
+                "hits": cls._hits,
+                "misses": cls._misses,
+                "hit_rate": round(cls._hits / total, 3) if total else 0.0
+            }
+
+    def get(self, text: str, model_id: str, prompt_version: str):
+        """Вернуть закэшированные факты или None (ошибка чтения кэша - промах)"""
+        cache_key = self.make_key(text, model_id, prompt_version)
+        now = datetime.utcnow()
+        try:
+            # Чтение и отметка использования одним запросом
+            doc = self.mongo_repo.find_one_and_update(
+                self.COLLECTION,
+                {"cache_key": cache_key},
+                {
+                    "$inc": {"hit_count": 1},
+                    "$set": {
+                        "last_used_at": now,
+                        "expires_at": now + timedelta(seconds=self.ttl_seconds)
+                    }
+                },
+                projection={"facts": 1}
+            )
+        except Exception as e:
+            print(f"Fact cache read failed: {e}")
+            doc = None
+
+        if not doc:
+            self._count(hit=False)
+            return None
+
+        self._count(hit=True)
+        return doc.get('facts')
+
+    def put(self, text: str, model_id: str, prompt_version: str, facts: str):
+        """Сохранить факты; ошибка записи только логируется: кэш не должен ронять генерацию"""
+        try:
+            self._put(text, model_id, prompt_version, facts)
+        except Exception as e:
+            print(f"Fact cache write failed: {e}")
+
+    def _put(self, text: str, model_id: str, prompt_version: str, facts: str):
+        cache_key = self.make_key(text, model_id, prompt_version)
+        now = datetime.utcnow()
+        self.mongo_repo.update_one(
+            self.COLLECTION,
+            {"cache_key": cache_key},
+            {
+                "$set": {
+                    "facts": facts,
+                    "last_used_at": now,
+                    "expires_at": now + timedelta(seconds=self.ttl_seconds)
+                },
+                "$setOnInsert": {
+                    "text_hash": self.text_hash(text),
+                    "model_id": model_id,
+                    "prompt_version": prompt_version,
+                    "char_count": len(text),
+                    "hit_count": 0,
+                    "created_at": now
+                }
+            },
+            upsert=True
+        )
+
+    def lookup(self, generator, text: str, bypass: bool = False):
+        """Факты из кэша для модели и версии промпта генератора или None"""
+        if bypass:
+            return None
+        return self.get(text, generator.model_id, generator.facts_prompt_version)
+
+    def get_or_extract(self, generator, text: str, bypass: bool = False) -> str:
+        """
+        Факты из кэша, иначе generator.extract_facts с сохранением результата
+        :param bypass: не читать кэш (свежий результат всё равно сохраняется)
+        """
+        facts = self.lookup(generator, text, bypass)
+        if facts is not None:
+            return facts
+
+        facts = generator.extract_facts(text)
+        # Факты, извлечённые не до конца (срок запроса), в кэш не попадают
+        if not generator.facts_truncated:
+            self.put(text, generator.model_id, generator.facts_prompt_version, facts)
+        return facts
+
+    def extract_stream(self, generator, text: str):
+        """
+        generator.iter_facts(text) с сохранением в кэш, когда пришла последняя группа фактов.
+        Остановленный на середине поток (отмена, срок) в кэш не попадает.
+        """
+        facts = []
+        for group_index, total_groups, group_facts in generator.iter_facts(text):
+            facts.extend(group_facts)
+            yield group_index, total_groups, group_facts
+        if not generator.facts_truncated:
+            self.put(text, generator.model_id, generator.facts_prompt_version, "\n".join(facts))
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List
+from app.repositories.mongo_repo import MongoRepository
+
+
+class GenerationCacheService:
+    """
+    Кэш провалидированных батчей вопросов в коллекции test_generation_cache.
+    Ключ: хэш фактов, типы вопросов батча, название теста, модель, temperature и seed.
+    Записи удаляются TTL-индексом по expires_at и ограничены по количеству (max_entries).
+    """
+
+    COLLECTION = 'test_generation_cache'
+    # Ограничение max_entries проверяется раз в столько записей процесса:
+    # обычное устаревание делает TTL-индекс, вытеснение нужно только против роста сверх лимита
+    EVICT_EVERY_WRITES = 100
+
+    # Счётчики уровня процесса
+    _stats_lock = threading.Lock()
+    _hits = 0
+    _misses = 0
+    _writes = 0
+
+    def __init__(self, ttl_seconds: int = 7 * 24 * 3600, max_entries: int = 10000, bypass: bool = False):
+        """
+        :param ttl_seconds: время жизни записи
+        :param max_entries: максимальное число записей, самые старые вытесняются
+        :param bypass: не читать кэш (новые результаты всё равно сохраняются)
+        """
+        self.mongo_repo = MongoRepository()
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.bypass = bypass
+
+    @staticmethod
+    def make_key(facts: str, types: List[str], test_set_name: str,
+                 model_id: str, temperature: float, seed) -> str:
+        facts_hash = hashlib.sha256(facts.encode('utf-8')).hexdigest()
+        raw_key = json.dumps(
+            [facts_hash, list(types), test_set_name, model_id, temperature, seed],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def _count(cls, hit: bool):
+        with cls._stats_lock:
+            if hit:
+                cls._hits += 1
+            else:
+                cls._misses += 1
+
+    @classmethod
+    def stats(cls) -> Dict:
+        with cls._stats_lock:
+            total = cls._hits + cls._misses
+            return {
+                "hits": cls._hits,
+                "misses": cls._misses,
+                "hit_rate": round(cls._hits / total, 3) if total else 0.0
+            }
+
+    def _key_for(self, generator, facts: str, types: List[str], test_set_name: str) -> str:
+        return self.make_key(
+            facts, types, test_set_name,
+            generator.model_id,
+            getattr(generator, 'temperature', None),
+            getattr(generator, 'seed', None)
+        )
+
+    def get_batch(self, generator, facts: str, types: List[str], test_set_name: str):
+        """Вернуть закэшированный батч вопросов или None (ошибка чтения кэша - промах, не ошибка генерации)"""
+        if self.bypass:
+            return None
+
+        cache_key = self._key_for(generator, facts, types, test_set_name)
+        try:
+            doc = self.mongo_repo.find_one(
+                self.COLLECTION,
+                {"cache_key": cache_key, "expires_at": {"$gt": datetime.utcnow()}}
+            )
+            if doc:
+                self.mongo_repo.update_one(
+                    self.COLLECTION,
+                    {"cache_key": cache_key},
+                    {"$inc": {"hit_count": 1}}
+                )
+        except Exception as e:
+            print(f"Generation cache read failed: {e}")
+            doc = None
+
+        if not doc:
+            self._count(hit=False)
+            return None
+
+        self._count(hit=True)
+        return doc.get('questions')
+
+    def put_batch(self, generator, facts: str, types: List[str], test_set_name: str, questions: List[Dict]):
+        """Сохранить батч; ошибка записи только логируется: кэш не должен ронять генерацию"""
+        try:
+            self._put_batch(generator, facts, types, test_set_name, questions)
+        except Exception as e:
+            print(f"Generation cache write failed: {e}")
+
+    def _put_batch(self, generator, facts: str, types: List[str], test_set_name: str, questions: List[Dict]):
+        cache_key = self._key_for(generator, facts, types, test_set_name)
+        now = datetime.utcnow()
+        self.mongo_repo.update_one(
+            self.COLLECTION,
+            {"cache_key": cache_key},
+            {
+                "$set": {
+                    "questions": questions,
+                    "expires_at": now + timedelta(seconds=self.ttl_seconds)
+                },
+                "$setOnInsert": {
+                    "question_types": list(types),
+                    "test_set": test_set_name,
+                    "model_id": generator.model_id,
+                    "hit_count": 0,
+                    "created_at": now
+                }
+            },
+            upsert=True
+        )
+        if self._should_evict():
+            self._evict_overflow()
+
+    @classmethod
+    def _should_evict(cls) -> bool:
+        with cls._stats_lock:
+            cls._writes += 1
+            return cls._writes % cls.EVICT_EVERY_WRITES == 1
+
+    def _evict_overflow(self):
+        """Удалить самые старые записи сверх max_entries"""
+        if not self.max_entries:
+            return
+
+        overflow = self.mongo_repo.estimated_count(self.COLLECTION) - self.max_entries
+        if overflow <= 0:
+            return
+
+        oldest = self.mongo_repo.find_many(
+            self.COLLECTION, {}, sort=[('created_at', 1)], limit=overflow, projection={'_id': 1}
+        )
+        self.mongo_repo.delete_many(
+            self.COLLECTION,
+            {"_id": {"$in": [doc['_id'] for doc in oldest]}}
+        )
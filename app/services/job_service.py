@@ -0,0 +1,181 @@
+import os
+import uuid
+from datetime import datetime, timedelta
+from app.repositories.mongo_repo import MongoRepository
+
+
+class JobService:
+    """
+    Очередь фоновых задач в коллекции generation_jobs.
+    Статусы: queued -> running -> done | failed | cancelled.
+    Отмена: queued-задачи сразу становятся cancelled, running-задачам ставится флаг
+    cancel_requested, который воркер опрашивает во время генерации.
+    Забранная задача получает lease_id: записи воркера (heartbeat, прогресс, итог) проходят
+    только с ним, так что после повторного захвата брошенной задачи прежний воркер
+    больше ничего не меняет.
+    """
+
+    COLLECTION = 'generation_jobs'
+
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CANCELLED = 'cancelled'
+
+    def __init__(self):
+        self.mongo_repo = MongoRepository()
+
+    def enqueue(self, job_type: str, user_id: str, params: dict, test_id: str = None):
+        """
+        Поставить задачу в очередь
+        :return: Документ задачи
+        """
+        now = datetime.utcnow()
+        job = {
+            "job_id": str(uuid.uuid4()),
+            "type": job_type,
+            "user_id": user_id,
+            "test_id": test_id,
+            "params": params,
+            "status": self.STATUS_QUEUED,
+            "progress": {},
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now
+        }
+        self.mongo_repo.insert_one(self.COLLECTION, job)
+        return job
+
+    def claim_next(self, stale_after_seconds: int = 600):
+        """
+        Атомарно забрать следующую задачу из очереди.
+        Задачи в статусе running без heartbeat дольше stale_after_seconds
+        считаются брошенными (воркер упал) и забираются повторно.
+        :return: Документ задачи с новым lease_id или None
+        """
+        now = datetime.utcnow()
+        return self.mongo_repo.find_one_and_update(
+            self.COLLECTION,
+            {
+                "$or": [
+                    {"status": self.STATUS_QUEUED},
+                    {
+                        "status": self.STATUS_RUNNING,
+                        "heartbeat_at": {"$lt": now - timedelta(seconds=stale_after_seconds)},
+                        "cancel_requested": {"$ne": True}
+                    }
+                ]
+            },
+            {
+                "$set": {
+                    "status": self.STATUS_RUNNING,
+                    "worker": f"{os.uname().nodename}:{os.getpid()}",
+                    "lease_id": str(uuid.uuid4()),
+                    "started_at": now,
+                    "heartbeat_at": now,
+                    "updated_at": now
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("created_at", 1)]
+        )
+
+    @staticmethod
+    def _lease_query(job_id: str, lease_id: str = None):
+        query = {"job_id": job_id}
+        if lease_id is not None:
+            query["lease_id"] = lease_id
+        return query
+
+    def heartbeat(self, job_id: str, lease_id: str) -> bool:
+        """
+        Продлить аренду running-задачи
+        :return: False, если задачу уже забрал другой воркер (или она завершена)
+        """
+        now = datetime.utcnow()
+        query = self._lease_query(job_id, lease_id)
+        query["status"] = self.STATUS_RUNNING
+        result = self.mongo_repo.update_one(
+            self.COLLECTION, query, {"$set": {"heartbeat_at": now, "updated_at": now}}
+        )
+        return result.matched_count > 0
+
+    def update_progress(self, job_id: str, progress: dict, lease_id: str = None):
+        now = datetime.utcnow()
+        fields = {f"progress.{key}": value for key, value in progress.items()}
+        fields.update({"heartbeat_at": now, "updated_at": now})
+        self.mongo_repo.update_one(self.COLLECTION, self._lease_query(job_id, lease_id), {"$set": fields})
+
+    def complete(self, job_id: str, result: dict, lease_id: str = None):
+        now = datetime.utcnow()
+        self.mongo_repo.update_one(
+            self.COLLECTION,
+            self._lease_query(job_id, lease_id),
+            {"$set": {"status": self.STATUS_DONE, "result": result, "finished_at": now, "updated_at": now}}
+        )
+
+    def fail(self, job_id: str, error: str, lease_id: str = None):
+        now = datetime.utcnow()
+        self.mongo_repo.update_one(
+            self.COLLECTION,
+            self._lease_query(job_id, lease_id),
+            {"$set": {"status": self.STATUS_FAILED, "error": error, "finished_at": now, "updated_at": now}}
+        )
+
+    def cancelled(self, job_id: str, lease_id: str = None):
+        now = datetime.utcnow()
+        self.mongo_repo.update_one(
+            self.COLLECTION,
+            self._lease_query(job_id, lease_id),
+            {"$set": {"status": self.STATUS_CANCELLED, "finished_at": now, "updated_at": now}}
+        )
+
+    def request_cancel_for_test(self, test_id: str, user_id: str) -> int:
+        """
+        Отменить незавершённые задачи теста
+        :return: Количество затронутых задач
+        """
+        now = datetime.utcnow()
+        queued = self.mongo_repo.update_many(
+            self.COLLECTION,
+            {"test_id": test_id, "user_id": user_id, "status": self.STATUS_QUEUED},
+            {"$set": {"status": self.STATUS_CANCELLED, "finished_at": now, "updated_at": now}}
+        )
+        running = self.mongo_repo.update_many(
+            self.COLLECTION,
+            {"test_id": test_id, "user_id": user_id, "status": self.STATUS_RUNNING},
+            {"$set": {"cancel_requested": True, "updated_at": now}}
+        )
+        return queued.modified_count + running.modified_count
+
+    def is_cancel_requested(self, job_id: str) -> bool:
+        job = self.mongo_repo.find_one(self.COLLECTION, {"job_id": job_id})
+        return bool(job and job.get("cancel_requested"))
+
+    def get_job(self, job_id: str, user_id: str):
+        """Задача пользователя в виде ответа API или None"""
+        job = self.mongo_repo.find_one(self.COLLECTION, {"job_id": job_id, "user_id": user_id})
+        if not job:
+            return None
+        return self.to_dict(job)
+
+    @staticmethod
+    def to_dict(job: dict):
+        def iso(value):
+            return value.isoformat() if value else None
+
+        return {
+            "job_id": job['job_id'],
+            "type": job['type'],
+            "test_id": job.get('test_id'),
+            "status": job['status'],
+            "progress": job.get('progress', {}),
+            "result": job.get('result'),
+            "error": job.get('error'),
+            "cancel_requested": job.get('cancel_requested', False),
+            "created_at": iso(job.get('created_at')),
+            "started_at": iso(job.get('started_at')),
+            "finished_at": iso(job.get('finished_at'))
+        }
@@ -0,0 +1,166 @@
+import threading
+import traceback
+from app.llm.cancellation import CancellationToken, GenerationCancelled
+from app.services.job_service import JobService
+
+
+def run_generate_questions(job: dict, job_service: JobService, cancel_token: CancellationToken):
+    """Обработчик задачи generate_questions: TestService.generate_test_questions с отчётом по батчам"""
+    from app.services.test_service import TestService
+
+    job_id = job['job_id']
+    lease_id = job.get('lease_id')
+    params = job['params']
+    counters = {"batches_done": 0, "questions_done": 0, "truncated": False}
+    # DELETE /tests/<id>/generate ставит задаче cancel_requested; опрашиваем его во время генерации
+    cancel_token.add_poll(lambda: job_service.is_cancel_requested(job_id))
+
+    def on_event(event_type, data):
+        if event_type == "stage":
+            job_service.update_progress(job_id, {"stage": data["stage"]}, lease_id)
+        elif event_type == "batch":
+            counters["batches_done"] += 1
+            counters["questions_done"] += len(data["questions"])
+            job_service.update_progress(job_id, {
+                "stage": "generating",
+                "batches_done": counters["batches_done"],
+                "total_batches": data["total_batches"],
+                "questions_done": counters["questions_done"]
+            }, lease_id)
+        elif event_type == "bank":
+            counters["questions_done"] += len(data["questions"])
+            job_service.update_progress(
+                job_id, {"stage": "bank", "questions_done": counters["questions_done"]}, lease_id
+            )
+        elif event_type == "truncated":
+            counters["truncated"] = True
+
+    questions, error = TestService().generate_test_questions(
+        test_id=job['test_id'],
+        user_id=job['user_id'],
+        material_id=params['material_id'],
+        question_count=params.get('question_count', 10),
+        bypass_cache=params.get('bypass_cache', False),
+        on_event=on_event,
+        persist_incrementally=True,
+        cancel_token=cancel_token,
+        deadline_seconds=params.get('deadline_seconds')
+    )
+    if error == TestService.ERROR_CANCELLED:
+        raise GenerationCancelled(error)
+    if error:
+        raise RuntimeError(error)
+
+    return {"question_count": len(questions), "truncated": counters["truncated"]}
+
+
+def run_precompute_facts(job: dict, job_service: JobService, cancel_token: CancellationToken):
+    """Обработчик задачи precompute_facts: извлечение фактов материала после загрузки"""
+    from app.services.test_service import TestService
+
+    job_service.update_progress(job['job_id'], {"stage": "extracting_facts"}, job.get('lease_id'))
+    result, error = TestService().precompute_material_facts(job['params']['material_id'])
+    if error:
+        raise RuntimeError(error)
+
+    return result
+
+
+# Тип задачи -> обработчик(job, job_service, cancel_token) -> result
+JOB_HANDLERS = {
+    'generate_questions': run_generate_questions,
+    'precompute_facts': run_precompute_facts
+}
+
+
+class JobWorker(threading.Thread):
+    """Поток, который забирает задачи из generation_jobs и выполняет их в контексте приложения"""
+
+    def __init__(self, app, poll_interval: float = 1.0, stale_after_seconds: int = 600,
+                 heartbeat_interval: float = 30.0, name: str = None):
+        super().__init__(name=name, daemon=True)
+        self.app = app
+        self.poll_interval = poll_interval
+        self.stale_after_seconds = stale_after_seconds
+        # Heartbeat пишется по таймеру, независимо от прогресса: долгое извлечение фактов
+        # или батч не должны выглядеть брошенной задачей
+        self.heartbeat_interval = min(heartbeat_interval, stale_after_seconds / 3)
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        with self.app.app_context():
+            job_service = JobService()
+            while not self._stop_event.is_set():
+                try:
+                    job = job_service.claim_next(self.stale_after_seconds)
+                except Exception as e:
+                    print(f"Job claim failed: {e}")
+                    job = None
+
+                if job is None:
+                    self._stop_event.wait(self.poll_interval)
+                    continue
+
+                self._run_job(job_service, job)
+
+    def _heartbeat(self, job_service: JobService, job: dict, cancel_token: CancellationToken,
+                   done: threading.Event):
+        """Продлевать аренду задачи, пока она выполняется; при потере аренды отменить выполнение"""
+        with self.app.app_context():
+            while not done.wait(self.heartbeat_interval):
+                try:
+                    if not job_service.heartbeat(job['job_id'], job.get('lease_id')):
+                        print(f"[{self.name}] Задача {job['job_id']} забрана другим воркером, останавливаем")
+                        cancel_token.cancel("lease lost")
+                        return
+                except Exception as e:
+                    print(f"[{self.name}] Heartbeat задачи {job['job_id']} не записан: {e}")
+
+    def _run_job(self, job_service: JobService, job: dict):
+        job_id = job['job_id']
+        lease_id = job.get('lease_id')
+        handler = JOB_HANDLERS.get(job['type'])
+        if handler is None:
+            job_service.fail(job_id, f"Unknown job type: {job['type']}", lease_id)
+            return
+
+        cancel_token = CancellationToken()
+        done = threading.Event()
+        threading.Thread(
+            target=self._heartbeat, args=(job_service, job, cancel_token, done),
+            name=f"{self.name}-heartbeat", daemon=True
+        ).start()
+
+        print(f"[{self.name}] Задача {job_id} ({job['type']}) запущена")
+        try:
+            result = handler(job, job_service, cancel_token)
+            job_service.complete(job_id, result, lease_id)
+            print(f"[{self.name}] Задача {job_id} завершена")
+        except GenerationCancelled:
+            print(f"[{self.name}] Задача {job_id} отменена")
+            job_service.cancelled(job_id, lease_id)
+        except Exception as e:
+            print(f"[{self.name}] Задача {job_id} завершилась ошибкой: {e}")
+            traceback.print_exc()
+            job_service.fail(job_id, str(e), lease_id)
+        finally:
+            done.set()
+
+
+def start_job_workers(app, count: int):
+    """Запустить count потоков-воркеров; модель в реестре общая для всех потоков процесса"""
+    workers = []
+    for i in range(count):
+        worker = JobWorker(
+            app,
+            poll_interval=app.config.get('JOB_POLL_INTERVAL', 1.0),
+            stale_after_seconds=app.config.get('JOB_STALE_AFTER_SECONDS', 600),
+            heartbeat_interval=app.config.get('JOB_HEARTBEAT_SECONDS', 30),
+            name=f"job-worker-{i + 1}"
+        )
+        worker.start()
+        workers.append(worker)
+    return workers
@@ -2,18 +2,29 @@ import uuid
 from datetime import datetime
 from app.repositories.pg_repo import PostgresRepository
 from app.repositories.mongo_repo import MongoRepository
+from app.utils.helpers import encode_cursor
+from app.services.job_service import JobService
+from app.services.question_bank_service import QuestionBankService
 
 
 class MaterialService:
+    # materials.facts_status: предварительное извлечение фактов (задача precompute_facts)
+    FACTS_NONE = 'none'
+    FACTS_PENDING = 'pending'
+    FACTS_READY = 'ready'
+    FACTS_FAILED = 'failed'
+
     def __init__(self):
         self.pg_repo = PostgresRepository()
         self.mongo_repo = MongoRepository()
 
-    def create_material(self, user_id: str, title: str, text: str, material_type: str = 'text'):
+    def create_material(self, user_id: str, title: str, text: str, material_type: str = 'text',
+                        precompute_facts: bool = False):
         """
         Create a new material:
         1. Store raw text in MongoDB
         2. Store metadata in PostgreSQL
+        3. Optionally enqueue fact extraction (precompute_facts job), so generation can skip it
         """
         # Generate UUID for material
         material_id = str(uuid.uuid4())
@@ -34,41 +45,61 @@ class MaterialService:
         mongo_id = str(mongo_result.inserted_id)
 
         # Store metadata in PostgreSQL
+        facts_status = self.FACTS_PENDING if precompute_facts else self.FACTS_NONE
         query = """
-            INSERT INTO materials (id, user_id, title, type, mongo_id, created_at, updated_at)
-            VALUES (%s, %s, %s, %s, %s, NOW(), NOW())
-            RETURNING id, title, type, created_at, updated_at
+            INSERT INTO materials (id, user_id, title, type, mongo_id, facts_status, created_at, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, NOW(), NOW())
+            RETURNING id, title, type, facts_status, created_at, updated_at
         """
         result = self.pg_repo.execute_query_one(
             query,
-            (material_id, user_id, title, material_type, mongo_id),
+            (material_id, user_id, title, material_type, mongo_id, facts_status),
             commit=True  # IMPORTANT: Commit the transaction!
         )
 
         if result:
+            if precompute_facts:
+                JobService().enqueue('precompute_facts', user_id, {"material_id": material_id})
+
             return {
                 "id": result['id'],
                 "title": result['title'],
                 "type": result['type'],
                 "char_count": len(text),
                 "word_count": len(text.split()),
+                "facts_status": result['facts_status'],
                 "created_at": result['created_at'].isoformat(),
                 "updated_at": result['updated_at'].isoformat()
             }
 
         return None
 
-    def list_user_materials(self, user_id: str):
+    def list_user_materials(self, user_id: str, limit: int, cursor=None):
         """
-        Get list of user's materials (metadata only)
+        Get a page of user's materials (metadata only), newest first
+        :param cursor: (created_at, id) of the last material on the previous page
+        :return: (materials, next_cursor) - next_cursor is None on the last page
         """
-        query = """
-            SELECT id, title, type, created_at, updated_at
+        keyset = ""
+        params = [user_id]
+        if cursor:
+            keyset = "AND (created_at, id) < (%s, %s::uuid)"
+            params.extend(cursor)
+
+        query = f"""
+            SELECT id, title, type, facts_status, created_at, updated_at
             FROM materials
-            WHERE user_id = %s
-            ORDER BY created_at DESC
+            WHERE user_id = %s {keyset}
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
         """
-        results = self.pg_repo.execute_query(query, (user_id,))
+        params.append(limit + 1)
+        results = self.pg_repo.execute_query(query, tuple(params))
+
+        next_cursor = None
+        if len(results) > limit:
+            results = results[:limit]
+            next_cursor = encode_cursor(results[-1]['created_at'], results[-1]['id'])
 
         materials = []
         for row in results:
@@ -76,11 +107,12 @@ class MaterialService:
                 "id": row['id'],
                 "title": row['title'],
                 "type": row['type'],
+                "facts_status": row['facts_status'],
                 "created_at": row['created_at'].isoformat(),
                 "updated_at": row['updated_at'].isoformat()
             })
 
-        return materials
+        return materials, next_cursor
 
     def get_material(self, material_id: str, user_id: str):
         """
@@ -88,7 +120,7 @@ class MaterialService:
         """
         # Get metadata from PostgreSQL
         query = """
-            SELECT id, title, type, mongo_id, created_at, updated_at
+            SELECT id, title, type, mongo_id, facts_status, created_at, updated_at
             FROM materials
             WHERE id = %s AND user_id = %s
         """
@@ -110,6 +142,7 @@ class MaterialService:
                 "title": result['title'],
                 "type": result['type'],
                 "text": "",
+                "facts_status": result['facts_status'],
                 "error": "Content not found in database",
                 "created_at": result['created_at'].isoformat(),
                 "updated_at": result['updated_at'].isoformat()
@@ -121,6 +154,7 @@ class MaterialService:
             "type": result['type'],
             "text": mongo_doc.get('raw_text', ''),
             "metadata": mongo_doc.get('metadata', {}),
+            "facts_status": result['facts_status'],
             "created_at": result['created_at'].isoformat(),
             "updated_at": result['updated_at'].isoformat()
         }
@@ -129,19 +163,21 @@ class MaterialService:
         """
         Delete material (both PostgreSQL and MongoDB)
         """
-        # First check if material exists and belongs to user
-        query = "SELECT mongo_id FROM materials WHERE id = %s AND user_id = %s"
-        result = self.pg_repo.execute_query_one(query, (material_id, user_id))
+        with self.pg_repo.unit_of_work() as uow:
+            # First check if material exists and belongs to user
+            query = "SELECT mongo_id FROM materials WHERE id = %s AND user_id = %s FOR UPDATE"
+            result = uow.execute_query_one(query, (material_id, user_id))
 
-        if not result:
-            return False
+            if not result:
+                return False
 
-        # Delete from MongoDB
-        self.mongo_repo.delete_one('materials_raw', {"material_id": material_id})
+            # Delete from MongoDB
+            self.mongo_repo.delete_one('materials_raw', {"material_id": material_id})
+            QuestionBankService().delete_material(material_id)
 
-        # Delete from PostgreSQL (will cascade to related tests if ON DELETE CASCADE)
-        delete_query = "DELETE FROM materials WHERE id = %s AND user_id = %s"
-        self.pg_repo.execute_query(delete_query, (material_id, user_id), commit=True)
+            # Delete from PostgreSQL (will cascade to related tests if ON DELETE CASCADE)
+            delete_query = "DELETE FROM materials WHERE id = %s AND user_id = %s"
+            uow.execute_query(delete_query, (material_id, user_id))
 
         return True
 
@@ -152,10 +188,53 @@ class MaterialService:
         """
         mongo_doc = self.mongo_repo.find_one(
             'materials_raw',
-            {"material_id": material_id}
+            {"material_id": material_id},
+            projection={"raw_text": 1}
         )
 
         if not mongo_doc:
             return None
 
         return mongo_doc.get('raw_text', '')
+
+    def get_material_source(self, material_id: str):
+        """
+        Text and precomputed facts of a material (for generation)
+        No user_id check - used internally by services
+        :return: (text, facts) - facts: {"text", "model_id", "prompt_version", "computed_at"} или None
+        """
+        mongo_doc = self.mongo_repo.find_one(
+            'materials_raw',
+            {"material_id": material_id},
+            projection={"raw_text": 1, "facts": 1}
+        )
+
+        if not mongo_doc:
+            return None, None
+
+        return mongo_doc.get('raw_text', ''), mongo_doc.get('facts')
+
+    def save_precomputed_facts(self, material_id: str, facts: str, model_id: str, prompt_version: str):
+        """Store extracted facts next to the raw text and mark the material ready"""
+        self.mongo_repo.update_one(
+            'materials_raw',
+            {"material_id": material_id},
+            {
+                "$set": {
+                    "facts": {
+                        "text": facts,
+                        "model_id": model_id,
+                        "prompt_version": prompt_version,
+                        "computed_at": datetime.utcnow()
+                    }
+                }
+            }
+        )
+        self.set_facts_status(material_id, self.FACTS_READY)
+
+    def set_facts_status(self, material_id: str, status: str):
+        self.pg_repo.execute_query(
+            "UPDATE materials SET facts_status = %s WHERE id = %s",
+            (status, material_id),
+            commit=True
+        )
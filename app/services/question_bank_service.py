@@ -0,0 +1,128 @@
+import copy
+import hashlib
+import json
+import random
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List
+from pymongo import UpdateOne
+from app.repositories.mongo_repo import MongoRepository
+
+
+class QuestionBankService:
+    """
+    Банк провалидированных вопросов по материалам в коллекции question_bank.
+    Каждый сгенерированный вопрос сохраняется с material_id, моделью и типом;
+    новый тест по материалу берёт вопросы из банка по нужному набору типов
+    и генерирует только недостающие.
+    """
+
+    COLLECTION = 'question_bank'
+    # Из скольких наименее использованных вопросов типа случайно выбираются нужные
+    SAMPLE_POOL_FACTOR = 3
+
+    # Счётчики уровня процесса
+    _stats_lock = threading.Lock()
+    _requested = 0
+    _served = 0
+
+    def __init__(self):
+        self.mongo_repo = MongoRepository()
+
+    @staticmethod
+    def fingerprint(question: Dict) -> str:
+        """Хэш содержания вопроса (без номера и названия теста) для удаления дублей"""
+        content = [
+            str(question.get("question_type", "")).lower(),
+            " ".join(str(question.get("question_text", "")).lower().split()),
+            sorted(str(option) for option in question.get("options", [])),
+            sorted(str(option) for option in question.get("question_options", []))
+        ]
+        raw = json.dumps(content, ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def _count(cls, requested: int, served: int):
+        with cls._stats_lock:
+            cls._requested += requested
+            cls._served += served
+
+    @classmethod
+    def stats(cls) -> Dict:
+        with cls._stats_lock:
+            return {
+                "questions_requested": cls._requested,
+                "questions_served": cls._served,
+                "serve_rate": round(cls._served / cls._requested, 3) if cls._requested else 0.0
+            }
+
+    def sample(self, material_id: str, model_id: str, types: List[str], rng: random.Random = None):
+        """
+        Выбрать из банка вопросы под набор типов; предпочтение наименее использованным.
+        :param rng: генератор случайных чисел запроса (generator.rng); глобальный random не используется
+        :return: (questions, missing_types) - вопросы в порядке types и типы, которых не хватило
+        """
+        rng = rng or random.Random()
+        by_type = {}
+        chosen_ids = []
+        for qtype, needed in Counter(types).items():
+            candidates = self.mongo_repo.find_many(
+                self.COLLECTION,
+                {"material_id": material_id, "model_id": model_id, "question_type": qtype},
+                sort=[("used_count", 1)],
+                limit=needed * self.SAMPLE_POOL_FACTOR
+            )
+            chosen = rng.sample(candidates, min(needed, len(candidates)))
+            by_type[qtype] = [copy.deepcopy(doc["question"]) for doc in chosen]
+            chosen_ids.extend(doc["_id"] for doc in chosen)
+
+        if chosen_ids:
+            self.mongo_repo.update_many(
+                self.COLLECTION,
+                {"_id": {"$in": chosen_ids}},
+                {"$inc": {"used_count": 1}, "$set": {"last_used_at": datetime.utcnow()}}
+            )
+
+        questions = []
+        missing = []
+        for qtype in types:
+            if by_type.get(qtype):
+                questions.append(by_type[qtype].pop(0))
+            else:
+                missing.append(qtype)
+
+        self._count(len(types), len(questions))
+        return questions, missing
+
+    def add(self, material_id: str, model_id: str, questions: List[Dict]):
+        """Сохранить новые вопросы материала одним bulk_write (дубли по содержанию пропускаются)"""
+        now = datetime.utcnow()
+        operations = {}
+        for question in questions:
+            fingerprint = self.fingerprint(question)
+            if fingerprint in operations:
+                continue
+            stored = {k: v for k, v in question.items() if k not in ("question_number", "test_set")}
+            operations[fingerprint] = UpdateOne(
+                {
+                    "material_id": material_id,
+                    "model_id": model_id,
+                    "fingerprint": fingerprint
+                },
+                {
+                    "$setOnInsert": {
+                        "question_type": str(question.get("question_type", "")).lower(),
+                        "question": stored,
+                        # Вопрос уже использован тестом, для которого сгенерирован
+                        "used_count": 1,
+                        "created_at": now,
+                        "last_used_at": now
+                    }
+                },
+                upsert=True
+            )
+        self.mongo_repo.bulk_write(self.COLLECTION, list(operations.values()), ordered=False)
+
+    def delete_material(self, material_id: str):
+        self.mongo_repo.delete_many(self.COLLECTION, {"material_id": material_id})
@@ -1,17 +1,35 @@
 import uuid
+import queue
+import threading
 from datetime import datetime
 from app.repositories.pg_repo import PostgresRepository
 from app.repositories.mongo_repo import MongoRepository
+from app.utils.helpers import encode_cursor
 from app.services.material_service import MaterialService
-from app.llm.generator import get_generator
+from app.services.fact_cache_service import FactCacheService
+from app.services.generation_cache_service import GenerationCacheService
+from app.services.job_service import JobService
+from app.services.question_bank_service import QuestionBankService
+from app.llm.generator import get_generator, plan_question_types
+from app.llm.backends import inference_backend_options
+from app.llm.cancellation import CancellationToken, GenerationCancelled, cancellation_registry
+from app.llm.deadline import Deadline
 from flask import current_app
 
 
 class TestService:
+    ERROR_CANCELLED = "Generation cancelled"
+    ERROR_DEADLINE = "Deadline exceeded before any question was generated"
+    STREAM_PING_SECONDS = 5
+
     def __init__(self):
         self.pg_repo = PostgresRepository()
         self.mongo_repo = MongoRepository()
         self.material_service = MaterialService()
+        self.fact_cache = FactCacheService(
+            ttl_seconds=current_app.config.get('FACT_CACHE_TTL_SECONDS', 30 * 24 * 3600)
+        )
+        self.job_service = JobService()
 
     def create_test(self, user_id: str, title: str, description: str = None, material_id: str = None):
         """
@@ -58,23 +76,41 @@ class TestService:
 
         return None
 
-    def list_user_tests(self, user_id: str):
-        query = """
+    def list_user_tests(self, user_id: str, limit: int, cursor=None):
+        """
+        Страница тестов пользователя, новые первыми
+        :param cursor: (created_at, id) последнего теста предыдущей страницы
+        :return: (tests, next_cursor) - next_cursor None на последней странице
+        """
+        keyset = ""
+        params = [user_id]
+        if cursor:
+            keyset = "AND (t.created_at, t.id) < (%s, %s::uuid)"
+            params.extend(cursor)
+
+        query = f"""
             SELECT t.id, t.title, t.description, t.status, t.current_version,
                    t.material_id, m.title as material_title, t.created_at, t.updated_at
             FROM tests t
             LEFT JOIN materials m ON t.material_id = m.id
-            WHERE t.user_id = %s
-            ORDER BY t.created_at DESC
+            WHERE t.user_id = %s {keyset}
+            ORDER BY t.created_at DESC, t.id DESC
+            LIMIT %s
         """
+        params.append(limit + 1)
+
+        results = self.pg_repo.execute_query(query, tuple(params))
+        next_cursor = None
+        if len(results) > limit:
+            results = results[:limit]
+            next_cursor = encode_cursor(results[-1]['created_at'], results[-1]['id'])
 
-        results = self.pg_repo.execute_query(query, (user_id,))
+        # Question counts of all tests (latest version, as in get_test) in one Mongo aggregation
+        counts = self.mongo_repo.get_question_counts([str(row['id']) for row in results])
 
         tests = []
         for row in results:
-            # Get question count from MongoDB
-            mongo_doc = self.mongo_repo.find_one('test_documents', {"test_id": row['id']})
-            question_count = len(mongo_doc.get('questions', [])) if mongo_doc else 0
+            question_count = counts.get(str(row['id']), {}).get("question_count", 0)
 
             tests.append({
                 "id": row['id'],
@@ -89,7 +125,7 @@ class TestService:
                 "updated_at": row['updated_at'].isoformat()
             })
 
-        return tests
+        return tests, next_cursor
 
     def get_test(self, test_id: str, user_id: str):
         query = """
@@ -124,55 +160,196 @@ class TestService:
             "updated_at": result['updated_at'].isoformat()
         }
 
-    def generate_test_questions(self, test_id: str, user_id: str, material_id: str, question_count: int = 10):
+    def _get_generator(self):
+        """
+        Get generator based on config
+        :return: (generator, error)
+        """
+        use_mock = current_app.config.get('USE_MOCK_QUESTION_GENERATOR', True)
+
+        if use_mock:
+            delay = current_app.config.get('MOCK_GENERATION_DELAY', 2.0)
+            return get_generator(use_mock=True, delay=delay), None
+
+        model_path = current_app.config.get('MODEL_PATH')
+        if not model_path:
+            return None, "MODEL_PATH not configured"
+        return get_generator(
+            use_mock=False,
+            model_path=model_path,
+            batched=current_app.config.get('GENERATION_BATCHED', False),
+            max_parallel_batches=current_app.config.get('GENERATION_MAX_PARALLEL_BATCHES'),
+            use_prefix_cache=current_app.config.get('GENERATION_PREFIX_CACHE', True),
+            seed=current_app.config.get('GENERATION_SEED'),
+            fact_chunk_tokens=current_app.config.get('FACT_CHUNK_TOKENS', 1500),
+            fact_chunk_batch_size=current_app.config.get('FACT_CHUNK_BATCH_SIZE', 4),
+            use_scheduler=current_app.config.get('GENERATION_SCHEDULER', False),
+            scheduler_max_batch_size=current_app.config.get('GENERATION_SCHEDULER_MAX_BATCH', 16),
+            constrained_decoding=current_app.config.get('GENERATION_CONSTRAINED', False),
+            facts_per_batch=current_app.config.get('FACTS_PER_BATCH'),
+            backend=current_app.config.get('INFERENCE_BACKEND'),
+            backend_options=inference_backend_options(current_app.config),
+            draft_model_path=current_app.config.get('GENERATION_DRAFT_MODEL_PATH')
+        ), None
+
+    def _get_generation_cache(self, bypass: bool = False):
+        if not current_app.config.get('GENERATION_CACHE_ENABLED', True):
+            return None
+        return GenerationCacheService(
+            ttl_seconds=current_app.config.get('GENERATION_CACHE_TTL_SECONDS', 7 * 24 * 3600),
+            max_entries=current_app.config.get('GENERATION_CACHE_MAX_ENTRIES', 10000),
+            bypass=bypass
+        )
+
+    def _get_question_bank(self):
+        if not current_app.config.get('QUESTION_BANK_ENABLED', True):
+            return None
+        return QuestionBankService()
+
+    def generate_test_questions(self, test_id: str, user_id: str, material_id: str, question_count: int = 10,
+                                bypass_cache: bool = False, on_event=None, persist_incrementally: bool = False,
+                                cancel_token: CancellationToken = None, deadline_seconds: float = None):
+        """
+        :param bypass_cache: не читать кэши фактов и батчей (свежие результаты всё равно сохраняются)
+        :param on_event: callback(event_type, data) о ходе генерации:
+            ("stage", {"stage": ...}), ("bank", {"questions", "missing"}) - вопросы из банка материала,
+            ("batch", {"batch_index", "total_batches", "questions"})
+            и ("truncated", {"question_count", "requested"}), если к сроку готова только часть вопросов
+        :param bypass_cache: также не брать вопросы из банка (новые вопросы всё равно попадают в банк)
+        :param persist_incrementally: дописывать вопросы в pending_questions документа теста после
+            каждого батча; questions заменяются только в конце, при ошибке и отмене остаются прежними
+        :param cancel_token: токен отмены; генерация также регистрируется для cancel_test_generation
+        :param deadline_seconds: срок ответа с начала запроса (включая извлечение фактов);
+            генерация подстраивается под него и возвращает готовую часть вопросов
+        :return: (questions, error); при отмене error == ERROR_CANCELLED,
+            если к сроку не готово ни одного вопроса - ERROR_DEADLINE
+        """
+        deadline = Deadline(deadline_seconds) if deadline_seconds else None
+        cancel_token = cancel_token or CancellationToken()
+        started_at = datetime.utcnow()
+        # Отмена из другого процесса: cancel_test_generation ставит cancel_requested_at в test_documents
+        cancel_token.add_poll(lambda: self._cancel_requested_since(test_id, started_at))
+        cancellation_registry.register(test_id, cancel_token)
+        try:
+            # Проверки отмены идут в потоке-наблюдателе, а не в потоке декодирования
+            with cancel_token.watching():
+                questions, error = self._run_generation(test_id, user_id, material_id, question_count,
+                                                        bypass_cache, on_event, persist_incrementally,
+                                                        cancel_token, deadline)
+        except Exception:
+            if persist_incrementally:
+                self._discard_pending_questions(test_id)
+            raise
+        finally:
+            cancellation_registry.release(test_id, cancel_token)
+
+        if error and persist_incrementally:
+            self._discard_pending_questions(test_id)
+        return questions, error
+
+    def _discard_pending_questions(self, test_id: str):
+        """Убрать частичный результат прерванной генерации; questions теста не трогаются"""
+        try:
+            self.mongo_repo.update_one(
+                'test_documents',
+                {"test_id": test_id},
+                {"$unset": {"pending_questions": ""}}
+            )
+        except Exception as e:
+            print(f"Failed to discard pending questions of test {test_id}: {e}")
+
+    def _run_generation(self, test_id: str, user_id: str, material_id: str, question_count: int,
+                        bypass_cache: bool, on_event, persist_incrementally: bool, cancel_token: CancellationToken,
+                        deadline: Deadline = None):
+        def emit(event_type, data):
+            if on_event is not None:
+                on_event(event_type, data)
+
+        # Проверка владельца и название теста (test_set_name) одним запросом
         test_check = self.pg_repo.execute_query_one(
-            "SELECT id FROM tests WHERE id = %s AND user_id = %s",
+            "SELECT id, title FROM tests WHERE id = %s AND user_id = %s",
             (test_id, user_id)
         )
 
         if not test_check:
             return None, "Test not found or unauthorized"
+        test_set_name = test_check['title'] or "Test"
 
         # Get material text
-        material_text = self.material_service.get_material_text(material_id)
+        material_text, precomputed = self.material_service.get_material_source(material_id)
 
         if not material_text:
             return None, "Material not found"
 
-        # Get generator based on config
-        use_mock = current_app.config.get('USE_MOCK_QUESTION_GENERATOR', True)
-
-        if use_mock:
-            delay = current_app.config.get('MOCK_GENERATION_DELAY', 2.0)
-            generator = get_generator(use_mock=True, delay=delay)
-        else:
-            model_path = current_app.config.get('MODEL_PATH')
-            if not model_path:
-                return None, "MODEL_PATH not configured"
-            generator = get_generator(use_mock=False, model_path=model_path)
-
-        # Extract facts
-        try:
-            facts = generator.extract_facts(material_text)
-        except Exception as e:
-            return None, f"Fact extraction failed: {str(e)}"
+        generator, error = self._get_generator()
+        if error:
+            return None, error
+        generator.cancel_token = cancel_token
+        generator.deadline = deadline
 
-        # Generate questions
-        try:
-            # Get test title for test_set_name
-            test_info = self.pg_repo.execute_query_one(
-                "SELECT title FROM tests WHERE id = %s",
-                (test_id,)
+        # Готовые батчи копятся в pending_questions: прежние questions остаются в тесте,
+        # пока генерация не завершится
+        if persist_incrementally:
+            self.mongo_repo.update_one(
+                'test_documents',
+                {"test_id": test_id},
+                {"$set": {"pending_questions": [], "updated_at": datetime.utcnow()}}
             )
-            test_set_name = test_info['title'] if test_info else "Test"
 
-            questions = generator.generate_questions(
-                facts=facts,
-                test_set_name=test_set_name,
-                question_count=question_count
+        def persist(batch_questions):
+            if persist_incrementally and batch_questions:
+                self.mongo_repo.update_one(
+                    'test_documents',
+                    {"test_id": test_id},
+                    {
+                        "$push": {"pending_questions": {"$each": batch_questions}},
+                        "$set": {"updated_at": datetime.utcnow()}
+                    }
+                )
+
+        # Вопросы из банка материала; генерируется только недостающее
+        types_pool = plan_question_types(question_count, generator.rng)
+        bank = self._get_question_bank()
+        bank_questions, missing_types = [], types_pool
+        if bank is not None and not bypass_cache:
+            bank_questions, missing_types = bank.sample(material_id, generator.model_id, types_pool, generator.rng)
+            if bank_questions:
+                print(f"Банк вопросов: {len(bank_questions)} из {question_count} без генерации")
+                persist(bank_questions)
+                emit("bank", {"questions": bank_questions, "missing": len(missing_types)})
+
+        generated = []
+        if missing_types:
+            generated, error = self._generate_fresh(
+                generator, material_id, material_text, precomputed, test_set_name, missing_types,
+                bypass_cache, persist, emit
             )
-        except Exception as e:
-            return None, f"Question generation failed: {str(e)}"
+            if error == self.ERROR_CANCELLED:
+                print(f"Генерация теста {test_id} отменена")
+            if error:
+                return None, error
+            if bank is not None and generated:
+                # Банк - оптимизация: ошибка записи в него не отменяет готовый тест
+                try:
+                    bank.add(material_id, generator.model_id, generated)
+                except Exception as e:
+                    print(f"Failed to add questions of test {test_id} to the question bank: {e}")
+
+        questions = self._merge_by_types(types_pool, bank_questions, generated)
+        for i, q in enumerate(questions):
+            q["question_number"] = i + 1
+            q["test_set"] = test_set_name
+
+        if generator.truncated or generator.facts_truncated:
+            if not questions:
+                return None, self.ERROR_DEADLINE
+            print(f"Генерация теста {test_id} усечена по сроку: {len(questions)} из {question_count} вопросов")
+            emit("truncated", {"question_count": len(questions), "requested": question_count})
+
+        # Отмена или потеря аренды задачи (её забрал другой воркер) после последнего батча:
+        # результат не записывается
+        if cancel_token.cancelled:
+            return None, self.ERROR_CANCELLED
 
         # Store questions in MongoDB
         self.mongo_repo.update_one(
@@ -182,11 +359,13 @@ class TestService:
                 "$set": {
                     "questions": questions,
                     "updated_at": datetime.utcnow()
-                }
+                },
+                "$unset": {"pending_questions": ""}
             }
         )
 
         # Update PostgreSQL metadata
+        # (отдельный короткий запрос: транзакция не держится открытой на время генерации)
         self.pg_repo.execute_query(
             "UPDATE tests SET updated_at = NOW() WHERE id = %s",
             (test_id,),
@@ -195,6 +374,229 @@ class TestService:
 
         return questions, None
 
+    def stream_test_questions(self, test_id: str, user_id: str, material_id: str, question_count: int = 10,
+                              bypass_cache: bool = False, deadline_seconds: float = None):
+        """
+        Генерация с выдачей событий по мере готовности батчей.
+        Генерация идёт в отдельном потоке; вопросы сохраняются в pending_questions после каждого батча.
+        :return: итератор (event_type, data); последнее событие - "done" или "error".
+            Пока батч генерируется, раз в STREAM_PING_SECONDS выдаётся ("ping", {}):
+            запись в закрытое соединение прерывает поток, и генерация отменяется
+        """
+        app = current_app._get_current_object()
+        events = queue.Queue()
+        cancel_token = CancellationToken()
+        finished = threading.Event()
+        truncated = threading.Event()
+
+        def on_event(event_type, data):
+            if event_type == "truncated":
+                truncated.set()
+            events.put((event_type, data))
+
+        def run():
+            with app.app_context():
+                try:
+                    questions, error = TestService().generate_test_questions(
+                        test_id=test_id,
+                        user_id=user_id,
+                        material_id=material_id,
+                        question_count=question_count,
+                        bypass_cache=bypass_cache,
+                        on_event=on_event,
+                        persist_incrementally=True,
+                        cancel_token=cancel_token,
+                        deadline_seconds=deadline_seconds
+                    )
+                    if error:
+                        events.put(("error", {"error": error}))
+                    else:
+                        events.put(("done", {"questions": questions, "question_count": len(questions),
+                                             "truncated": truncated.is_set()}))
+                except Exception as e:
+                    events.put(("error", {"error": str(e)}))
+                finally:
+                    finished.set()
+                    events.put(None)
+
+        threading.Thread(target=run, name=f"stream-{test_id}", daemon=True).start()
+
+        try:
+            while True:
+                try:
+                    event = events.get(timeout=self.STREAM_PING_SECONDS)
+                except queue.Empty:
+                    yield ("ping", {})
+                    continue
+                if event is None:
+                    return
+                yield event
+        finally:
+            # Клиент закрыл соединение (GeneratorExit на yield): освобождаем модель
+            if not finished.is_set():
+                cancel_token.cancel("client disconnected")
+
+    def enqueue_test_generation(self, test_id: str, user_id: str, material_id: str, question_count: int = 10,
+                                bypass_cache: bool = False, deadline_seconds: float = None):
+        """
+        Поставить генерацию в очередь generation_jobs вместо выполнения в веб-воркере
+        :return: (job, error)
+        """
+        test_check = self.pg_repo.execute_query_one(
+            "SELECT id FROM tests WHERE id = %s AND user_id = %s",
+            (test_id, user_id)
+        )
+
+        if not test_check:
+            return None, "Test not found or unauthorized"
+
+        job = self.job_service.enqueue(
+            'generate_questions',
+            user_id,
+            {
+                "material_id": material_id,
+                "question_count": question_count,
+                "bypass_cache": bypass_cache,
+                "deadline_seconds": deadline_seconds
+            },
+            test_id=test_id
+        )
+        return job, None
+
+    def _generate_fresh(self, generator, material_id: str, material_text: str, precomputed, test_set_name: str,
+                        types: list, bypass_cache: bool, persist, emit):
+        """
+        Extract facts (precomputed, cached or pipelined) and generate questions of the given types
+        :return: (questions, error)
+        """
+        # В режиме конвейера без попадания в кэш факты извлекаются параллельно с генерацией вопросов
+        pipeline = current_app.config.get('GENERATION_PIPELINE', True)
+        emit("stage", {"stage": "extracting_facts"})
+        try:
+            if not bypass_cache and self._precomputed_facts_match(generator, precomputed):
+                facts = precomputed["text"]
+                print(f"Факты материала {material_id} извлечены заранее")
+            elif pipeline:
+                facts = self.fact_cache.lookup(generator, material_text, bypass=bypass_cache)
+            else:
+                facts = self.fact_cache.get_or_extract(generator, material_text, bypass=bypass_cache)
+        except GenerationCancelled:
+            return None, self.ERROR_CANCELLED
+        except Exception as e:
+            return None, f"Fact extraction failed: {str(e)}"
+
+        # Срок вышел раньше, чем извлеклась хоть одна группа фактов: генерировать не из чего
+        if facts is not None and not facts.strip() and generator.facts_truncated:
+            return [], None
+
+        def on_batch(batch_index, total_batches, batch_questions):
+            persist(batch_questions)
+            emit("batch", {
+                "batch_index": batch_index,
+                "total_batches": total_batches,
+                "questions": batch_questions
+            })
+
+        try:
+            if facts is not None:
+                emit("stage", {"stage": "generating"})
+                questions = generator.generate_questions(
+                    facts=facts,
+                    test_set_name=test_set_name,
+                    cache=self._get_generation_cache(bypass=bypass_cache),
+                    on_batch=on_batch,
+                    types=types
+                )
+            else:
+                def on_facts(group_index, total_groups, group_facts):
+                    if group_index == 0:
+                        emit("stage", {"stage": "generating"})
+
+                questions = generator.generate_questions_streaming(
+                    self.fact_cache.extract_stream(generator, material_text),
+                    test_set_name=test_set_name,
+                    cache=self._get_generation_cache(bypass=bypass_cache),
+                    on_batch=on_batch,
+                    on_facts=on_facts,
+                    types=types
+                )
+        except GenerationCancelled:
+            return None, self.ERROR_CANCELLED
+        except Exception as e:
+            return None, f"Question generation failed: {str(e)}"
+
+        return questions, None
+
+    @staticmethod
+    def _merge_by_types(types: list, bank_questions: list, generated: list) -> list:
+        """Bank and fresh questions in the planned type order (types that failed to generate are skipped)"""
+        buckets = {}
+        for q in bank_questions + generated:
+            buckets.setdefault(str(q.get("question_type", "")).lower(), []).append(q)
+        return [buckets[qtype].pop(0) for qtype in types if buckets.get(qtype)]
+
+    @staticmethod
+    def _precomputed_facts_match(generator, precomputed) -> bool:
+        """Precomputed facts are only valid for the same model and facts prompt"""
+        return bool(precomputed) and precomputed.get("model_id") == generator.model_id \
+            and precomputed.get("prompt_version") == generator.facts_prompt_version
+
+    def precompute_material_facts(self, material_id: str):
+        """
+        Extract facts of an uploaded material in the background (precompute_facts job)
+        and store them in materials_raw; they also go to the facts cache
+        :return: (result, error)
+        """
+        material_text, _ = self.material_service.get_material_source(material_id)
+        if not material_text:
+            return None, "Material not found"
+
+        generator, error = self._get_generator()
+        if error:
+            self.material_service.set_facts_status(material_id, MaterialService.FACTS_FAILED)
+            return None, error
+
+        try:
+            facts = self.fact_cache.get_or_extract(generator, material_text)
+        except Exception as e:
+            self.material_service.set_facts_status(material_id, MaterialService.FACTS_FAILED)
+            return None, f"Fact extraction failed: {str(e)}"
+
+        self.material_service.save_precomputed_facts(
+            material_id, facts, generator.model_id, generator.facts_prompt_version
+        )
+        return {"material_id": material_id, "fact_count": len(facts.splitlines())}, None
+
+    def _cancel_requested_since(self, test_id: str, started_at: datetime) -> bool:
+        doc = self.mongo_repo.find_one(
+            'test_documents', {"test_id": test_id}, projection={"cancel_requested_at": 1}
+        )
+        requested_at = doc.get("cancel_requested_at") if doc else None
+        return bool(requested_at and requested_at >= started_at)
+
+    def cancel_test_generation(self, test_id: str, user_id: str):
+        """
+        Отменить генерацию теста: идущие в этом процессе (синхронные и SSE)
+        и фоновые задачи generation_jobs
+        :return: (result, error)
+        """
+        test_check = self.pg_repo.execute_query_one(
+            "SELECT id FROM tests WHERE id = %s AND user_id = %s",
+            (test_id, user_id)
+        )
+
+        if not test_check:
+            return None, "Test not found or unauthorized"
+
+        self.mongo_repo.update_one(
+            'test_documents',
+            {"test_id": test_id},
+            {"$set": {"cancel_requested_at": datetime.utcnow()}}
+        )
+        in_process = cancellation_registry.cancel(test_id, "cancelled by user")
+        jobs = self.job_service.request_cancel_for_test(test_id, user_id)
+        return {"cancelled_generations": in_process, "cancelled_jobs": jobs}, None
+
     def update_test_content(self, test_id: str, user_id: str, questions: list):
         """
         Update test questions (editing)
@@ -230,83 +632,84 @@ class TestService:
         return True
 
     def delete_test(self, test_id: str, user_id: str):
-        # Check ownership
-        test_check = self.pg_repo.execute_query_one(
-            "SELECT id FROM tests WHERE id = %s AND user_id = %s",
-            (test_id, user_id)
-        )
+        with self.pg_repo.unit_of_work() as uow:
+            # Check ownership
+            test_check = uow.execute_query_one(
+                "SELECT id FROM tests WHERE id = %s AND user_id = %s FOR UPDATE",
+                (test_id, user_id)
+            )
 
-        if not test_check:
-            return False
+            if not test_check:
+                return False
 
-        # Delete from MongoDB
-        self.mongo_repo.delete_one('test_documents', {"test_id": test_id})
+            # Delete from MongoDB
+            self.mongo_repo.delete_one('test_documents', {"test_id": test_id})
 
-        # Delete from PostgreSQL
-        self.pg_repo.execute_query(
-            "DELETE FROM tests WHERE id = %s",
-            (test_id,),
-            commit=True
-        )
+            # Delete from PostgreSQL
+            uow.execute_query(
+                "DELETE FROM tests WHERE id = %s",
+                (test_id,)
+            )
 
         return True
 
     def update_test_content(self, test_id: str, user_id: str, questions: list, create_version: bool = True):
         """
         Update test questions (editing)
+        Проверка владельца и обновление current_version - одна транзакция; строка теста
+        заблокирована (FOR UPDATE), поэтому одновременные правки получают разные номера версий
         :param test_id: ID теста
         :param user_id: ID пользователя
         :param questions: Новые вопросы
         :param create_version: Создать новую версию (True) или обновить текущую (False)
         :return: Новая версия или False при ошибке
         """
-        # Verify ownership
-        test_check = self.pg_repo.execute_query_one(
-            "SELECT id, current_version FROM tests WHERE id = %s AND user_id = %s",
-            (test_id, user_id)
-        )
-
-        if not test_check:
-            return False
-
-        if create_version:
-            # Создать новую версию в MongoDB
-            new_version = self.mongo_repo.create_new_version(test_id, questions)
-
-            if not new_version:
-                return False
-
-            # Обновить current_version в PostgreSQL
-            self.pg_repo.execute_query(
-                "UPDATE tests SET current_version = %s, updated_at = NOW() WHERE id = %s",
-                (new_version, test_id),
-                commit=True
+        with self.pg_repo.unit_of_work() as uow:
+            # Verify ownership
+            test_check = uow.execute_query_one(
+                "SELECT id, current_version FROM tests WHERE id = %s AND user_id = %s FOR UPDATE",
+                (test_id, user_id)
             )
 
-            return new_version
-        else:
-            # Обновить существующую версию
-            current_version = test_check['current_version']
+            if not test_check:
+                return False
 
-            self.mongo_repo.update_one(
-                'test_documents',
-                {"test_id": test_id, "version": current_version},
-                {
-                    "$set": {
-                        "questions": questions,
-                        "updated_at": datetime.utcnow()
+            if create_version:
+                # Создать новую версию в MongoDB
+                new_version = self.mongo_repo.create_new_version(test_id, questions)
+
+                if not new_version:
+                    return False
+
+                # Обновить current_version в PostgreSQL
+                uow.execute_query(
+                    "UPDATE tests SET current_version = %s, updated_at = NOW() WHERE id = %s",
+                    (new_version, test_id)
+                )
+
+                return new_version
+            else:
+                # Обновить существующую версию
+                current_version = test_check['current_version']
+
+                self.mongo_repo.update_one(
+                    'test_documents',
+                    {"test_id": test_id, "version": current_version},
+                    {
+                        "$set": {
+                            "questions": questions,
+                            "updated_at": datetime.utcnow()
+                        }
                     }
-                }
-            )
+                )
 
-            # Update timestamp in PostgreSQL
-            self.pg_repo.execute_query(
-                "UPDATE tests SET updated_at = NOW() WHERE id = %s",
-                (test_id,),
-                commit=True
-            )
+                # Update timestamp in PostgreSQL
+                uow.execute_query(
+                    "UPDATE tests SET updated_at = NOW() WHERE id = %s",
+                    (test_id,)
+                )
 
-            return current_version
+                return current_version
 
     def get_test_version_history(self, test_id: str, user_id: str):
         """
@@ -320,11 +723,11 @@ class TestService:
         if not test_check:
             return None
 
-        versions = self.mongo_repo.get_test_versions(test_id)
+        versions = self.mongo_repo.get_test_version_summaries(test_id)
 
         return [{
             'version': v['version'],
-            'question_count': len(v.get('questions', [])),
+            'question_count': v['question_count'],
             'created_at': v['created_at'].isoformat(),
             'updated_at': v['updated_at'].isoformat()
         } for v in versions]
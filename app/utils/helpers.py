@@ -0,0 +1,45 @@
+import base64
+import json
+import uuid
+from datetime import datetime
+
+
+def encode_cursor(created_at: datetime, item_id) -> str:
+    """Непрозрачный курсор keyset-пагинации по (created_at, id) последнего элемента страницы"""
+    raw = json.dumps([created_at.isoformat(), str(item_id)])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str):
+    """
+    :return: (created_at, id) из курсора
+    :raises ValueError: курсор повреждён или подделан
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, item_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.fromisoformat(created_at), str(uuid.UUID(item_id))
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def parse_page_params(args, default_limit: int, max_limit: int):
+    """
+    limit и cursor из query-параметров списка
+    :return: (limit, cursor_or_None, error)
+    """
+    try:
+        limit = int(args.get('limit', default_limit))
+    except (TypeError, ValueError):
+        return None, None, "limit must be an integer"
+    if limit <= 0:
+        return None, None, "limit must be positive"
+    limit = min(limit, max_limit)
+
+    cursor = args.get('cursor')
+    if not cursor:
+        return limit, None, None
+    try:
+        return limit, decode_cursor(cursor), None
+    except ValueError as e:
+        return None, None, str(e)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+"""
+Пропускная способность и память бэкендов инференса на одном батче вопросов.
+
+    python benchmarks/backend_throughput.py --model-path /models/qwen --backends transformers-cpu onnxruntime --threads 8
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+# Добавляем корень проекта в Python path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.llm.generator import RealGenerator
+from app.llm.backends import BACKENDS
+from app.llm.model_registry import model_registry
+
+SAMPLE_FACTS = """Клетка - основная структурная единица живых организмов.
+Ядро хранит наследственную информацию в виде ДНК.
+Митохондрии вырабатывают энергию в форме АТФ.
+Рибосомы синтезируют белки.
+Клеточная мембрана регулирует обмен веществ с окружающей средой."""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inference backend throughput and memory")
+    parser.add_argument("--model-path", required=True)
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--max-new-tokens", type=int, default=300)
+    args = parser.parse_args()
+
+    for backend in args.backends:
+        generator = RealGenerator(model_path=args.model_path, backend=backend,
+                                  backend_options={"num_threads": args.threads})
+        generator._load_model()
+        model_registry.warmup(args.model_path, backend, generator.backend_options)
+
+        messages = generator._build_batch_messages(SAMPLE_FACTS, ["mcq", "input", "match"], 1, "Бенчмарк")
+        started = time.perf_counter()
+        for _ in range(args.runs):
+            generator._generate_texts([messages], max_new_tokens=args.max_new_tokens, top_p=0.9)
+        elapsed = time.perf_counter() - started
+
+        loaded = generator._loaded
+        print(f"{backend}: загрузка {loaded.load_time:.1f} с, {args.runs} генераций за {elapsed:.1f} с")
+        print(f"  throughput: {loaded.throughput.to_dict()}")
+        print(f"  memory: {loaded.memory}")
+
+        model_registry.unload(args.model_path, backend)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+"""
+Пропускная способность при N одновременных генерациях батча вопросов:
+независимые вызовы model.generate против общего планировщика continuous batching.
+
+    python benchmarks/concurrent_generation.py --model-path /models/qwen --concurrency 1 4 10 16
+"""
+
+import argparse
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Добавляем корень проекта в Python path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.llm.generator import RealGenerator
+
+SAMPLE_FACTS = """Клетка - основная структурная единица живых организмов.
+Ядро хранит наследственную информацию в виде ДНК.
+Митохондрии вырабатывают энергию в форме АТФ.
+Рибосомы синтезируют белки.
+Клеточная мембрана регулирует обмен веществ с окружающей средой."""
+
+
+def run_concurrent(generator, concurrency, max_new_tokens):
+    """Запустить concurrency потоков, каждый генерирует один батч; вернуть (секунды, токены)"""
+    outputs = [None] * concurrency
+
+    def worker(i):
+        messages = generator._build_batch_messages(SAMPLE_FACTS, ["mcq", "input", "match"], i * 3 + 1, "Бенчмарк")
+        outputs[i] = generator._generate_texts([messages], max_new_tokens=max_new_tokens, top_p=0.9)[0]
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    tokens = sum(len(generator.tokenizer(text, add_special_tokens=False)["input_ids"]) for text in outputs)
+    return elapsed, tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent generation throughput with and without the scheduler")
+    parser.add_argument("--model-path", required=True)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 10])
+    parser.add_argument("--max-new-tokens", type=int, default=400)
+    parser.add_argument("--max-batch", type=int, default=16)
+    args = parser.parse_args()
+
+    plain = RealGenerator(model_path=args.model_path)
+    scheduled = RealGenerator(model_path=args.model_path, use_scheduler=True,
+                              scheduler_max_batch_size=args.max_batch)
+    plain._load_model()
+    scheduled._load_model()
+
+    print(f"{'concurrency':>11} {'plain tok/s':>12} {'scheduler tok/s':>16} {'speedup':>8}")
+    for concurrency in args.concurrency:
+        plain_time, plain_tokens = run_concurrent(plain, concurrency, args.max_new_tokens)
+        sched_time, sched_tokens = run_concurrent(scheduled, concurrency, args.max_new_tokens)
+        plain_tps = plain_tokens / plain_time
+        sched_tps = sched_tokens / sched_time
+        print(f"{concurrency:>11} {plain_tps:>12.1f} {sched_tps:>16.1f} {sched_tps / plain_tps:>7.2f}x")
+
+    print(f"Статистика планировщика: {scheduled._loaded.scheduler.stats()}")
+
+
+if __name__ == "__main__":
+    main()
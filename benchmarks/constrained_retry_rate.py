@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+"""
+Доля повторов батчей вопросов без ограничения декодирования и с JSON-шаблоном.
+Попытка - одно декодирование батча или его недостающей части: повтор перегенерирует только
+вопросы, не прошедшие разбор или валидацию, с бюджетом токенов по их типам
+(QUESTION_TOKEN_BUDGET), поэтому цена повторов - столбец regenerated (перегенерированные вопросы).
+
+    python benchmarks/constrained_retry_rate.py --model-path /models/qwen --runs 5 --questions 9
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+# Добавляем корень проекта в Python path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.llm.generator import RealGenerator
+
+SAMPLE_FACTS = """Клетка - основная структурная единица живых организмов.
+Ядро хранит наследственную информацию в виде ДНК.
+Митохондрии вырабатывают энергию в форме АТФ.
+Рибосомы синтезируют белки.
+Клеточная мембрана регулирует обмен веществ с окружающей средой.
+Сначала ДНК транскрибируется в РНК, затем РНК транслируется в белок."""
+
+
+def run(generator, runs, question_count):
+    """Сгенерировать тест runs раз и сложить счётчики попыток"""
+    totals = {"batches": 0, "attempts": 0, "parse_failures": 0, "validation_failures": 0,
+              "questions": 0, "questions_requested": 0}
+    questions = 0
+    started = time.perf_counter()
+    for _ in range(runs):
+        questions += len(generator.generate_questions(SAMPLE_FACTS, "Бенчмарк", question_count))
+        for key in totals:
+            totals[key] += generator.batch_stats[key]
+    elapsed = time.perf_counter() - started
+    return totals, questions, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Question batch retry rate with and without constrained decoding")
+    parser.add_argument("--model-path", required=True)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--questions", type=int, default=9)
+    parser.add_argument("--max-retries", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'mode':>12} {'batches':>8} {'attempts':>9} {'bad json':>9} {'invalid':>8} "
+          f"{'retry rate':>11} {'regenerated':>12} {'questions':>10} {'seconds':>8}")
+    for constrained in (False, True):
+        generator = RealGenerator(model_path=args.model_path, max_retries=args.max_retries,
+                                  constrained_decoding=constrained)
+        generator._load_model()
+        totals, questions, elapsed = run(generator, args.runs, args.questions)
+        failures = totals["parse_failures"] + totals["validation_failures"]
+        retry_rate = failures / totals["attempts"] if totals["attempts"] else 0.0
+        regenerated = max(0, totals["questions_requested"] - totals["questions"])
+        mode = "constrained" if constrained else "free"
+        print(f"{mode:>12} {totals['batches']:>8} {totals['attempts']:>9} {totals['parse_failures']:>9} "
+              f"{totals['validation_failures']:>8} {retry_rate:>10.1%} {regenerated:>12} {questions:>10} "
+              f"{elapsed:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
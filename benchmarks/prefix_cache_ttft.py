@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+"""
+Бенчмарк time-to-first-token для промпта батча вопросов
+с KV-кэшем статического префикса и без него.
+
+    python benchmarks/prefix_cache_ttft.py --model-path /models/qwen --runs 5 --batches 1 4
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Добавляем корень проекта в Python path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.llm.generator import RealGenerator
+
+SAMPLE_FACTS = """Клетка - основная структурная единица живых организмов.
+Ядро хранит наследственную информацию в виде ДНК.
+Митохондрии вырабатывают энергию в форме АТФ.
+Рибосомы синтезируют белки.
+Клеточная мембрана регулирует обмен веществ с окружающей средой."""
+
+
+def measure_ttft(generator, messages_list, use_prefix_cache, runs):
+    """Время генерации одного токена = prefill + первый шаг декодирования"""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        generator._generate_texts(messages_list, max_new_tokens=1, top_p=0.9,
+                                  use_prefix_cache=use_prefix_cache)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TTFT with and without the shared prefix KV cache")
+    parser.add_argument("--model-path", required=True)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--batches", type=int, nargs="+", default=[1],
+                        help="Сколько батчей вопросов в одном вызове generate")
+    args = parser.parse_args()
+
+    generator = RealGenerator(model_path=args.model_path)
+    generator._load_model()
+
+    started = time.perf_counter()
+    prefix_cache = generator._loaded.get_prefix_cache(generator._question_prefix_text())
+    print(f"Построение кэша префикса: {time.perf_counter() - started:.3f} с")
+
+    print(f"{'batches':>8} {'prompt tok':>11} {'prefix tok':>11} {'no cache, s':>12} {'cache, s':>10} {'speedup':>8}")
+    for n_batches in args.batches:
+        messages_list = [
+            generator._build_batch_messages(SAMPLE_FACTS, ["mcq", "input", "match"], i * 3 + 1, "Бенчмарк")
+            for i in range(n_batches)
+        ]
+        text = generator.tokenizer.apply_chat_template(messages_list[0], tokenize=False, add_generation_prompt=True)
+        prompt_tokens = len(generator.tokenizer(text)["input_ids"])
+
+        # Прогрев обоих путей
+        measure_ttft(generator, messages_list, False, 1)
+        measure_ttft(generator, messages_list, True, 1)
+
+        plain = statistics.median(measure_ttft(generator, messages_list, False, args.runs))
+        cached = statistics.median(measure_ttft(generator, messages_list, True, args.runs))
+        print(f"{n_batches:>8} {prompt_tokens:>11} {prefix_cache.length:>11} "
+              f"{plain:>12.3f} {cached:>10.3f} {plain / cached:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+"""
+Speculative decoding против обычного декодирования на извлечении фактов и батче вопросов.
+По умолчанию на CPU с маленькими локальными моделями:
+
+    python benchmarks/speculative_decoding.py --model-path /models/qwen-1.5b --draft-model-path /models/qwen-0.5b
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+# Добавляем корень проекта в Python path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.llm.generator import RealGenerator
+
+SAMPLE_TEXT = """Клетка - основная структурная единица живых организмов. Ядро хранит наследственную
+информацию в виде ДНК. Митохондрии вырабатывают энергию в форме АТФ. Рибосомы синтезируют белки.
+Клеточная мембрана регулирует обмен веществ с окружающей средой. Сначала ДНК транскрибируется в РНК,
+затем РНК транслируется в белок на рибосомах."""
+
+
+def run(generator, runs, max_new_tokens):
+    """Извлечение фактов и один батч вопросов runs раз; вернуть (секунды, новые токены)"""
+    facts_messages = generator._build_facts_messages(SAMPLE_TEXT)
+    batch_messages = generator._build_batch_messages(SAMPLE_TEXT, ["mcq", "input", "match"], 1, "Бенчмарк")
+
+    generated = 0
+    started = time.perf_counter()
+    for _ in range(runs):
+        for messages in (facts_messages, batch_messages):
+            raw = generator._generate_texts([messages], max_new_tokens=max_new_tokens, top_p=0.9)[0]
+            generated += len(generator.tokenizer(raw, add_special_tokens=False)["input_ids"])
+    return time.perf_counter() - started, generated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Speculative decoding speedup and acceptance rate")
+    parser.add_argument("--model-path", required=True)
+    parser.add_argument("--draft-model-path", required=True)
+    parser.add_argument("--backend", default="transformers-cpu")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--max-new-tokens", type=int, default=400)
+    args = parser.parse_args()
+
+    options = {"num_threads": args.threads}
+    plain = RealGenerator(model_path=args.model_path, backend=args.backend, backend_options=options)
+    assisted = RealGenerator(model_path=args.model_path, backend=args.backend, backend_options=options,
+                             draft_model_path=args.draft_model_path)
+    plain._load_model()
+    assisted._load_model()
+
+    plain_time, plain_tokens = run(plain, args.runs, args.max_new_tokens)
+    assisted_time, assisted_tokens = run(assisted, args.runs, args.max_new_tokens)
+
+    plain_tps = plain_tokens / plain_time
+    assisted_tps = assisted_tokens / assisted_time
+    print(f"plain:       {plain_tps:.1f} tok/s ({plain_tokens} токенов за {plain_time:.1f} с)")
+    print(f"speculative: {assisted_tps:.1f} tok/s ({assisted_tokens} токенов за {assisted_time:.1f} с)")
+    print(f"speedup:     {assisted_tps / plain_tps:.2f}x")
+    print(f"Статистика: {assisted.speculative_stats.to_dict()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -83,6 +83,126 @@ def create_indexes():
         )
         print("  ✓ Created index: created_at (descending)")
 
+        # ==========================================
+        # 3. Индексы для facts (кэш извлечения фактов)
+        # ==========================================
+        print("\n🧠 Creating indexes for 'facts' collection...")
+        facts = db['facts']
+
+        # Уникальный индекс для ключа кэша (хэш текста + модель + версия промпта)
+        facts.create_index(
+            [("cache_key", ASCENDING)],
+            name="idx_cache_key",
+            unique=True
+        )
+        print("  ✓ Created unique index: cache_key")
+
+        # Индекс для поиска всех записей одного текста
+        facts.create_index(
+            [("text_hash", ASCENDING)],
+            name="idx_text_hash"
+        )
+        print("  ✓ Created index: text_hash")
+
+        # Индекс для очистки давно не используемых записей
+        facts.create_index(
+            [("last_used_at", ASCENDING)],
+            name="idx_last_used_at"
+        )
+        print("  ✓ Created index: last_used_at")
+
+        # TTL-индекс: expires_at сдвигается при каждом использовании записи
+        facts.create_index(
+            [("expires_at", ASCENDING)],
+            name="idx_expires_at_ttl",
+            expireAfterSeconds=0
+        )
+        facts.update_many(
+            {"expires_at": {"$exists": False}},
+            [{"$set": {"expires_at": {"$add": ["$$NOW", 30 * 24 * 3600 * 1000]}}}]
+        )
+        print("  ✓ Created TTL index: expires_at")
+
+        # ==========================================
+        # 4. Индексы для test_generation_cache (кэш батчей вопросов)
+        # ==========================================
+        print("\n🗃️ Creating indexes for 'test_generation_cache' collection...")
+        generation_cache = db['test_generation_cache']
+
+        # Уникальный индекс для ключа кэша
+        generation_cache.create_index(
+            [("cache_key", ASCENDING)],
+            name="idx_cache_key",
+            unique=True
+        )
+        print("  ✓ Created unique index: cache_key")
+
+        # TTL-индекс: запись удаляется, когда наступает expires_at
+        generation_cache.create_index(
+            [("expires_at", ASCENDING)],
+            name="idx_expires_at_ttl",
+            expireAfterSeconds=0
+        )
+        print("  ✓ Created TTL index: expires_at")
+
+        # Индекс для вытеснения самых старых записей
+        generation_cache.create_index(
+            [("created_at", ASCENDING)],
+            name="idx_created_at"
+        )
+        print("  ✓ Created index: created_at")
+
+        # ==========================================
+        # 5. Индексы для generation_jobs (очередь фоновых задач)
+        # ==========================================
+        print("\n⏳ Creating indexes for 'generation_jobs' collection...")
+        jobs = db['generation_jobs']
+
+        # Уникальный индекс для job_id
+        jobs.create_index(
+            [("job_id", ASCENDING)],
+            name="idx_job_id",
+            unique=True
+        )
+        print("  ✓ Created unique index: job_id")
+
+        # Индекс для выборки следующей задачи из очереди
+        jobs.create_index(
+            [("status", ASCENDING), ("created_at", ASCENDING)],
+            name="idx_status_created_at"
+        )
+        print("  ✓ Created index: status + created_at")
+
+        # Завершённые задачи удаляются через неделю
+        jobs.create_index(
+            [("finished_at", ASCENDING)],
+            name="idx_finished_at_ttl",
+            expireAfterSeconds=7 * 24 * 3600
+        )
+        print("  ✓ Created TTL index: finished_at")
+
+        # ==========================================
+        # 6. Индексы для question_bank (банк вопросов по материалам)
+        # ==========================================
+        print("\n🏦 Creating indexes for 'question_bank' collection...")
+        question_bank = db['question_bank']
+
+        # Уникальный индекс: один вопрос с тем же содержанием на материал и модель
+        question_bank.create_index(
+            [("material_id", ASCENDING), ("model_id", ASCENDING), ("fingerprint", ASCENDING)],
+            name="idx_material_model_fingerprint",
+            unique=True
+        )
+        print("  ✓ Created unique index: material_id + model_id + fingerprint")
+
+        # Индекс для выборки наименее использованных вопросов нужного типа
+        question_bank.create_index(
+            [("material_id", ASCENDING), ("model_id", ASCENDING), ("question_type", ASCENDING),
+             ("used_count", ASCENDING)],
+            name="idx_material_model_type_used"
+        )
+        print("  ✓ Created index: material_id + model_id + question_type + used_count")
+
         # ==========================================
         # Вывод информации об индексах
         # ==========================================
@@ -98,6 +218,22 @@ def create_indexes():
         for idx in materials.list_indexes():
             print(f"  - {idx['name']}: {idx['key']}")
 
+        print("\n🔹 facts:")
+        for idx in facts.list_indexes():
+            print(f"  - {idx['name']}: {idx['key']}")
+
+        print("\n🔹 test_generation_cache:")
+        for idx in generation_cache.list_indexes():
+            print(f"  - {idx['name']}: {idx['key']}")
+
+        print("\n🔹 generation_jobs:")
+        for idx in jobs.list_indexes():
+            print(f"  - {idx['name']}: {idx['key']}")
+
+        print("\n🔹 question_bank:")
+        for idx in question_bank.list_indexes():
+            print(f"  - {idx['name']}: {idx['key']}")
+
         print("\n✅ All indexes created successfully!")
         return True
 
@@ -0,0 +1,2 @@
+-- Статус предварительного извлечения фактов материала: none | pending | ready | failed
+ALTER TABLE materials ADD COLUMN IF NOT EXISTS facts_status TEXT NOT NULL DEFAULT 'none';
@@ -0,0 +1,3 @@
+-- Keyset-пагинация списков: WHERE user_id = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC
+CREATE INDEX IF NOT EXISTS idx_materials_user_created ON materials (user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_tests_user_created ON tests (user_id, created_at DESC, id DESC);
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+"""
+Отдельный процесс-воркер фоновых задач (generation_jobs).
+
+    python worker.py --threads 2
+"""
+
+import argparse
+import time
+from app import create_app, preload_model
+from app.services.job_worker import start_job_workers
+
+app = create_app(start_workers=False)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Background job worker")
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+
+    # Модель загружается только в процессе-воркере, веб-процессы её не держат
+    preload_model(app)
+    workers = start_job_workers(app, args.threads)
+    print(f"Запущено воркеров: {len(workers)}")
+    try:
+        while any(worker.is_alive() for worker in workers):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.stop()
+        for worker in workers:
+            worker.join()